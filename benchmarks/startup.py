@@ -0,0 +1,133 @@
+"""
+Startup time of each entry point
+
+Runs every entry point in fresh interpreters and reports the median import
+and boot time, so regressions in import cost (an eager heavy import) or in
+bot construction show up before they slow down the CLI and worker forks.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --json
+    python benchmarks/startup.py --importtime bot
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name: (import step, boot step); each is timed separately in a new process
+ENTRY_POINTS = {
+    "package": ("import insta_bot", "insta_bot.Config"),
+    "cli": ("from insta_bot.cli import cli", "cli(['validate'], standalone_mode=False)"),
+    "bot": ("from insta_bot.bot import InstagramBot", "InstagramBot().shutdown(timeout=1)"),
+    "wsgi": ("from insta_bot.wsgi import app", "app.get()"),
+    "first_reply": (
+        "from insta_bot.bot import InstagramBot; bot = InstagramBot()",
+        "bot.gemini_handler.model; bot.shutdown(timeout=1)",
+    ),
+}
+
+TIMER = """
+import time
+_start = time.perf_counter()
+{import_step}
+_imported = time.perf_counter()
+{boot_step}
+_booted = time.perf_counter()
+import json, sys
+sys.stderr.flush()
+print("STARTUP " + json.dumps({{"import": _imported - _start, "boot": _booted - _imported}}))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark import and boot time per entry point")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per entry point")
+    parser.add_argument("--entry", action="append", choices=sorted(ENTRY_POINTS),
+                        help="Entry point to measure (repeatable; default: all)")
+    parser.add_argument("--importtime", choices=sorted(ENTRY_POINTS),
+                        help="Show the slowest imports of one entry point (python -X importtime)")
+    parser.add_argument("--top", type=int, default=15, help="Modules listed with --importtime")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    return parser.parse_args()
+
+
+def environment() -> dict:
+    """Configuration that lets every entry point boot without real credentials"""
+    env = dict(os.environ)
+    env.setdefault("GEMINI_API_KEY", "benchmark")
+    env.setdefault("INSTAGRAM_APP_ID", "benchmark")
+    env.setdefault("INSTAGRAM_ACCESS_TOKEN", "benchmark")
+    env["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="insta-bot-startup-"), "startup.db")
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["PYTHONWARNINGS"] = "ignore"
+    return env
+
+
+def measure(name: str, env: dict) -> dict:
+    """Import and boot seconds of one entry point in a fresh interpreter"""
+    import_step, boot_step = ENTRY_POINTS[name]
+    code = TIMER.format(import_step=import_step, boot_step=boot_step)
+    result = subprocess.run(
+        [sys.executable, "-c", code], env=env, cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    for line in result.stdout.splitlines():
+        if line.startswith("STARTUP "):
+            return json.loads(line[len("STARTUP "):])
+    raise RuntimeError(f"{name} printed no timing:\n{result.stdout}\n{result.stderr}")
+
+
+def run(args) -> dict:
+    env = environment()
+    report = {}
+    for name in args.entry or ENTRY_POINTS:
+        samples = [measure(name, env) for _ in range(args.runs)]
+        imports = [s["import"] for s in samples]
+        boots = [s["boot"] for s in samples]
+        report[name] = {
+            "import_ms": round(statistics.median(imports) * 1000, 1),
+            "boot_ms": round(statistics.median(boots) * 1000, 1),
+            "total_ms": round(statistics.median(i + b for i, b in zip(imports, boots)) * 1000, 1),
+            "min_total_ms": round(min(i + b for i, b in zip(imports, boots)) * 1000, 1),
+        }
+    return report
+
+
+def slowest_imports(name: str, top: int) -> list:
+    """(cumulative ms, module) for the slowest imports of an entry point"""
+    import_step, boot_step = ENTRY_POINTS[name]
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"{import_step}\n{boot_step}"],
+        env=environment(), cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append((int(cumulative) / 1000, module))
+    return sorted(rows, reverse=True)[:top]
+
+
+def print_report(report: dict):
+    print(f"{'entry point':<14}{'import':>10}{'boot':>10}{'total':>10}{'min':>10}")
+    for name, row in report.items():
+        print(f"{name:<14}{row['import_ms']:>8} ms{row['boot_ms']:>7} ms{row['total_ms']:>7} ms"
+              f"{row['min_total_ms']:>7} ms")
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.importtime:
+        for milliseconds, module in slowest_imports(arguments.importtime, arguments.top):
+            print(f"{milliseconds:>9.1f} ms  {module}")
+        sys.exit(0)
+    result = run(arguments)
+    if arguments.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
@@ -0,0 +1,371 @@
+"""
+Load test for the webhook → reply → send path
+
+Replays synthetic webhook traffic into InstagramBot.app with a fake Gemini
+model and a local fake Graph API server, then reports webhook latency,
+end-to-end reply latency, throughput and conversation store time.
+
+    python benchmarks/webhook_load.py --rate 200 --users 50 --duration 10
+    python benchmarks/webhook_load.py --model-latency 0.5 --json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the Instagram bot request path")
+    parser.add_argument("--rate", type=float, default=100, help="Webhook events per second")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of traffic")
+    parser.add_argument("--users", type=int, default=20, help="Distinct senders (fan-out)")
+    parser.add_argument("--clients", type=int, default=4, help="Threads posting webhooks")
+    parser.add_argument("--model-latency", type=float, default=0.2, help="Fake Gemini seconds per reply")
+    parser.add_argument("--graph-latency", type=float, default=0.05, help="Fake Graph API seconds per send")
+    parser.add_argument("--drain-timeout", type=float, default=30, help="Seconds to wait for outstanding replies")
+    parser.add_argument("--store", default="sqlite", help="STORE_BACKEND to benchmark")
+    parser.add_argument("--db-path", help="SQLite file (default: a temporary file)")
+    parser.add_argument("--stream", action="store_true", help="Enable STREAM_REPLIES")
+    parser.add_argument("--coalesce-window", type=float, default=0.0,
+                        help="COALESCE_WINDOW (default 0 so latency reflects the request path)")
+    parser.add_argument("--real-send-limits", action="store_true",
+                        help="Keep the Graph API send rate limits instead of lifting them")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    """Set configuration before insta_bot reads it"""
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ.setdefault("INSTAGRAM_APP_ID", "benchmark")
+    os.environ.setdefault("INSTAGRAM_ACCESS_TOKEN", "benchmark")
+    os.environ.setdefault("BOT_INSTAGRAM_ID", "bot")
+    os.environ["STORE_BACKEND"] = args.store
+    os.environ["DB_PATH"] = args.db_path or os.path.join(tempfile.mkdtemp(prefix="insta-bot-bench-"), "bench.db")
+    os.environ["COALESCE_WINDOW"] = str(args.coalesce_window)
+    os.environ["STREAM_REPLIES"] = "true" if args.stream else "false"
+    os.environ["WORKER_QUEUE_SIZE"] = str(max(int(args.rate * args.duration), 1000))
+    if not args.real_send_limits:
+        for name in ("SEND_RATE", "SEND_BURST", "SEND_RECIPIENT_RATE", "SEND_RECIPIENT_BURST"):
+            os.environ[name] = "1000000"
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values: list) -> dict:
+    """Millisecond percentiles of a list of second durations"""
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(max(values) * 1000, 2) if values else 0.0,
+    }
+
+
+class FakeChat:
+    """Chat session that answers after a fixed delay"""
+    
+    def __init__(self, model, history):
+        self.model = model
+        self.history = history or []
+    
+    def send_message(self, prompt, stream=False, **kwargs):
+        time.sleep(self.model.latency)
+        text = f"Thanks for your message! You said: {str(prompt)[-60:]}. Anything else?"
+        if stream:
+            return [types.SimpleNamespace(text=word + " ") for word in text.split(" ")]
+        return types.SimpleNamespace(text=text)
+
+
+class FakeModel:
+    """Stand-in for genai.GenerativeModel with configurable latency"""
+    
+    def __init__(self, latency: float):
+        self.latency = latency
+    
+    def start_chat(self, history=None, **kwargs):
+        return FakeChat(self, history)
+    
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(self.latency)
+        return types.SimpleNamespace(text="Summary of the earlier conversation.")
+
+
+class FakeGraphServer:
+    """Local HTTP server answering POST /me/messages and profile lookups like the Graph API"""
+    
+    def __init__(self, latency: float, on_message):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                time.sleep(server.latency)
+                payload = json.loads(body or b"{}")
+                recipient_id = payload.get("recipient", {}).get("id")
+                server.on_message(recipient_id, payload.get("message", {}).get("text"))
+                self._respond({"recipient_id": recipient_id, "message_id": "m.fake"})
+            
+            def do_GET(self):
+                # GET /{user_id} or GET /?ids=a,b: sender profiles for the profile cache
+                url = urlsplit(self.path)
+                time.sleep(server.latency)
+                ids = parse_qs(url.query).get("ids")
+                if ids:
+                    self._respond({user_id: _fake_profile(user_id) for user_id in ids[0].split(",")})
+                else:
+                    self._respond(_fake_profile(url.path.rsplit("/", 1)[-1]))
+            
+            def _respond(self, payload: dict):
+                response = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.send_header("x-app-usage", json.dumps({"call_count": 1, "total_time": 1, "total_cputime": 1}))
+                self.end_headers()
+                self.wfile.write(response)
+            
+            def log_message(self, *args):
+                pass
+        
+        self.latency = latency
+        self.on_message = on_message
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+    
+    def start(self):
+        self._thread.start()
+    
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _fake_profile(user_id: str) -> dict:
+    return {"id": user_id, "name": f"User {user_id}", "username": f"user_{user_id}"}
+
+
+class StoreTimer:
+    """Accumulate time spent in conversation store calls"""
+    
+    METHODS = ("add_message", "get_history", "get_summary", "save_summary")
+    
+    def __init__(self, store):
+        self.total = 0.0
+        self.calls = 0
+        self._lock = threading.Lock()
+        for name in self.METHODS:
+            setattr(store, name, self._wrap(getattr(store, name)))
+    
+    def _wrap(self, method):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.total += elapsed
+                    self.calls += 1
+        return timed
+
+
+class LatencyTracker:
+    """Match replies received by the fake Graph server to the webhooks that caused them"""
+    
+    def __init__(self):
+        self._pending = defaultdict(deque)
+        self._lock = threading.Lock()
+        self.end_to_end = []
+        self.first_reply_at = None
+        self.last_reply_at = None
+        self.replies = 0
+        self.messages_sent = 0
+    
+    def webhook_posted(self, sender_id: str, posted_at: float):
+        with self._lock:
+            self._pending[sender_id].append(posted_at)
+    
+    def reply_received(self, recipient_id: str, text: str):
+        now = time.perf_counter()
+        with self._lock:
+            self.messages_sent += 1
+            pending = self._pending.get(recipient_id)
+            # Later chunks of a streamed reply, or one reply to a merged batch, have nothing left to match
+            if not pending:
+                return
+            while pending:
+                self.end_to_end.append(now - pending.popleft())
+            self.replies += 1
+            self.first_reply_at = self.first_reply_at or now
+            self.last_reply_at = now
+    
+    def outstanding(self) -> int:
+        with self._lock:
+            return sum(len(p) for p in self._pending.values())
+
+
+def webhook_body(sender_id: str, mid: str, text: str) -> dict:
+    return {
+        "object": "instagram",
+        "entry": [{
+            "id": "bot",
+            "time": int(time.time() * 1000),
+            "messaging": [{
+                "sender": {"id": sender_id},
+                "recipient": {"id": "bot"},
+                "timestamp": int(time.time() * 1000),
+                "message": {"mid": mid, "text": text},
+            }],
+        }],
+    }
+
+
+def post_traffic(app, args, tracker: LatencyTracker) -> dict:
+    """Post webhooks at the target rate from several client threads"""
+    total = int(args.rate * args.duration)
+    interval = args.clients / args.rate
+    webhook_latency = []
+    statuses = defaultdict(int)
+    lock = threading.Lock()
+    start = time.perf_counter()
+    
+    def client(index: int):
+        client = app.test_client()
+        latencies = []
+        local_statuses = defaultdict(int)
+        for n in range(index, total, args.clients):
+            # Open loop: each event has a fixed send time, even if earlier ones were slow
+            due = start + (n // args.clients) * interval + index * interval / args.clients
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            
+            sender_id = f"user-{n % args.users}"
+            body = webhook_body(sender_id, f"mid-{n}", f"Question number {n}, what are your opening hours?")
+            posted_at = time.perf_counter()
+            tracker.webhook_posted(sender_id, posted_at)
+            response = client.post("/webhook", json=body)
+            latencies.append(time.perf_counter() - posted_at)
+            local_statuses[response.status_code] += 1
+        
+        with lock:
+            webhook_latency.extend(latencies)
+            for status, count in local_statuses.items():
+                statuses[status] += count
+    
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    return {
+        "events": total,
+        "seconds": time.perf_counter() - start,
+        "latency": webhook_latency,
+        "statuses": dict(statuses),
+    }
+
+
+def run(args) -> dict:
+    configure_environment(args)
+    
+    from insta_bot import gemini_handler
+    from insta_bot.bot import InstagramBot
+    
+    # Every model the handler builds (persona, summaries without it, fallbacks) is the fake one
+    model = FakeModel(args.model_latency)
+    gemini_handler._build_model = lambda model_name, system_instruction=None: model
+    
+    tracker = LatencyTracker()
+    graph = FakeGraphServer(args.graph_latency, tracker.reply_received)
+    graph.start()
+    
+    bot = InstagramBot()
+    bot.instagram_api.base_url = graph.url
+    store_timer = StoreTimer(bot.conversation_store)
+    
+    try:
+        traffic = post_traffic(bot.app, args, tracker)
+        
+        deadline = time.perf_counter() + args.drain_timeout
+        while tracker.outstanding() and time.perf_counter() < deadline:
+            time.sleep(0.05)
+    finally:
+        bot.shutdown(timeout=5)
+        graph.stop()
+    
+    accepted = traffic["statuses"].get(200, 0)
+    reply_seconds = (tracker.last_reply_at or 0) - (tracker.first_reply_at or 0)
+    return {
+        "config": {
+            "rate": args.rate,
+            "duration": args.duration,
+            "users": args.users,
+            "model_latency": args.model_latency,
+            "graph_latency": args.graph_latency,
+            "store": args.store,
+            "stream": args.stream,
+            "coalesce_window": args.coalesce_window,
+        },
+        "webhooks": {
+            "sent": traffic["events"],
+            "achieved_rate": round(traffic["events"] / traffic["seconds"], 1),
+            "statuses": traffic["statuses"],
+            **summarize(traffic["latency"]),
+        },
+        "end_to_end": summarize(tracker.end_to_end),
+        "replies": {
+            "count": tracker.replies,
+            "messages_sent": tracker.messages_sent,
+            "unanswered": tracker.outstanding(),
+            "per_second": round(tracker.replies / reply_seconds, 1) if reply_seconds > 0 else 0.0,
+        },
+        "store": {
+            "calls": store_timer.calls,
+            "total_ms": round(store_timer.total * 1000, 1),
+            "ms_per_message": round(store_timer.total * 1000 / accepted, 3) if accepted else 0.0,
+        },
+    }
+
+
+def print_report(report: dict):
+    webhooks, e2e = report["webhooks"], report["end_to_end"]
+    replies, store = report["replies"], report["store"]
+    print(f"Config:      {report['config']}")
+    print(f"Webhooks:    {webhooks['sent']} sent at {webhooks['achieved_rate']}/s, statuses {webhooks['statuses']}")
+    print(f"  latency    p50 {webhooks['p50_ms']} ms  p95 {webhooks['p95_ms']} ms  p99 {webhooks['p99_ms']} ms")
+    print(f"End to end:  p50 {e2e['p50_ms']} ms  p95 {e2e['p95_ms']} ms  p99 {e2e['p99_ms']} ms")
+    print(f"Replies:     {replies['count']} ({replies['per_second']}/s), "
+          f"{replies['messages_sent']} messages sent, {replies['unanswered']} unanswered")
+    print(f"Store:       {store['ms_per_message']} ms per message ({store['calls']} calls, {store['total_ms']} ms)")
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    result = run(arguments)
+    if arguments.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
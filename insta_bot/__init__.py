@@ -4,10 +4,29 @@ InstagramBot - Instagram DM Bot with Gemini AI
 A simple, configurable bot for responding to Instagram DMs using Google Gemini AI.
 """
 
+import importlib
+
 __version__ = "1.0.0"
 __author__ = "Your Name"
 
-from .bot import InstagramBot
-from .config import Config
-
 __all__ = ["InstagramBot", "Config"]
+
+# Loaded on first access: importing the bot pulls in Flask and Gemini,
+# which commands like `instachatdmbot validate` don't need
+_LAZY_ATTRIBUTES = {
+    "InstagramBot": ".bot",
+    "Config": ".config",
+}
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
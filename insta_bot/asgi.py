@@ -0,0 +1,203 @@
+"""
+ASGI application: the bot served from an event loop
+
+    instachatdmbot run --server async
+    uvicorn --factory insta_bot.asgi:create_app
+
+Serves the same /webhook, /health and /metrics routes as the Flask app.
+Replies run as coroutines: Gemini is called through the SDK's async API and
+conversation store work runs in the loop's thread pool, so a process can
+wait on thousands of replies at once instead of one per worker thread.
+"""
+import asyncio
+import json
+import logging
+from functools import partial
+from urllib.parse import parse_qsl
+from . import metrics
+from .bot import InstagramBot, verify_signature
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Webhook payloads are small; anything bigger is not from Meta
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class AsyncInstagramBot(InstagramBot):
+    """InstagramBot as an ASGI application"""
+    
+    def __init__(self, custom_instructions: str = None, gemini_model: str = None):
+        """
+        Initialize the bot
+        
+        Args:
+            custom_instructions: Custom system prompt for the AI
+            gemini_model: Gemini model to use
+        """
+        self._loop = None
+        self._reply_slots = None
+        self._replies = set()
+        super().__init__(custom_instructions=custom_instructions, gemini_model=gemini_model)
+    
+    def _create_app(self):
+        # The bot itself is the ASGI callable
+        return self
+    
+    def _bind_loop(self):
+        """Remember the serving event loop; replies are scheduled onto it"""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._reply_slots = asyncio.Semaphore(Config.ASYNC_MAX_REPLIES)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        
+        self._bind_loop()
+        method, path = scope["method"], scope["path"]
+        if path == "/webhook" and method == "GET":
+            query = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+            body, status = self._verify_webhook(query)
+            await _respond(send, status, body or "")
+        elif path == "/webhook" and method == "POST":
+            with metrics.WEBHOOK_SECONDS.time():
+                raw = await _read_body(receive)
+                if raw is None:
+                    await _respond(send, 413, "Payload Too Large")
+                    return
+                try:
+                    payload = json.loads(raw)
+                except ValueError:
+                    payload = None
+                headers = dict(scope.get("headers", []))
+                signed = verify_signature(raw, headers.get(b"x-hub-signature-256", b"").decode("latin-1"))
+                # Deduplication reads and writes SQLite
+                body, status = await self._loop.run_in_executor(None, self._accept_webhook, payload, signed)
+            await _respond(send, status, body)
+        elif path == "/health" and method == "GET":
+            await _respond(send, 200, json.dumps(self._health()), "application/json")
+        elif path == "/metrics" and method == "GET":
+            await _respond(send, 200, metrics.REGISTRY.render(), "text/plain; version=0.0.4")
+        else:
+            await _respond(send, 404, "Not Found")
+    
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._bind_loop()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown_async()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    
+    def _dispatch_reply(self, key: tuple, messages: list) -> bool:
+        """Start a reply coroutine for a batch (called from the coalescer's threads)"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            # Not serving yet: fall back to the worker threads
+            return super()._dispatch_reply(key, messages)
+        loop.call_soon_threadsafe(self._start_reply, key, messages)
+        return True
+    
+    def _start_reply(self, key: tuple, messages: list):
+        task = asyncio.ensure_future(self._reply_async(key, messages))
+        self._replies.add(task)
+        task.add_done_callback(self._replies.discard)
+    
+    async def _reply_async(self, key: tuple, messages: list):
+        """Generate and send one reply to a batch of messages"""
+        tenant_id, sender_id = key
+        try:
+            async with self._reply_slots:
+                gemini_handler, conversation_id, user_message = self._reply_context(key, messages)
+                submit = partial(self.send_scheduler.submit, sender_id, tenant_id=tenant_id)
+                
+                # The send queue persists to SQLite, so submitting goes through the thread pool
+                if Config.STREAM_REPLIES:
+                    async for chunk in gemini_handler.stream_reply_async(conversation_id, user_message):
+                        await self._loop.run_in_executor(None, submit, chunk)
+                else:
+                    reply = await gemini_handler.generate_reply_async(conversation_id, user_message)
+                    await self._loop.run_in_executor(None, submit, reply)
+        except Exception as e:
+            metrics.ERRORS.inc(component="reply")
+            logger.error(f"Error replying to {sender_id}: {e}")
+        finally:
+            self.coalescer.done(key)
+    
+    def _health(self) -> dict:
+        health = super()._health()
+        health["replies_in_flight"] = len(self._replies)
+        return health
+    
+    async def shutdown_async(self, timeout: float = None):
+        """Finish queued and in-flight replies, then shut down like InstagramBot.shutdown"""
+        timeout = Config.SHUTDOWN_TIMEOUT if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self._shutting_down = True
+        
+        # These schedule the remaining replies onto this loop
+        await loop.run_in_executor(None, self._close_attachments)
+        await loop.run_in_executor(None, self.coalescer.close)
+        await loop.run_in_executor(None, partial(self.dispatcher.shutdown, drain=True, timeout=timeout))
+        while self._replies and loop.time() < deadline:
+            await asyncio.wait(set(self._replies), timeout=deadline - loop.time())
+        if self._replies:
+            logger.warning(f"⚠️ Shutting down with {len(self._replies)} replies unfinished")
+        
+        await loop.run_in_executor(None, self.shutdown, max(deadline - loop.time(), 0))
+    
+    def run(self, host: str = "0.0.0.0", port: int = 8000, debug: bool = False):
+        """Run the ASGI app with uvicorn"""
+        serve(host, port, bot=self)
+
+
+async def _read_body(receive) -> bytes:
+    """The request body, or None if it is larger than MAX_BODY_BYTES"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _respond(send, status: int, body: str, content_type: str = "text/plain; charset=utf-8"):
+    data = body.encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type.encode("latin-1")),
+            (b"content-length", str(len(data)).encode("latin-1")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": data})
+
+
+def create_app(custom_instructions: str = None, gemini_model: str = None) -> AsyncInstagramBot:
+    """Build the ASGI app (for `uvicorn --factory insta_bot.asgi:create_app`)"""
+    return AsyncInstagramBot(custom_instructions=custom_instructions, gemini_model=gemini_model)
+
+
+def serve(host: str = "0.0.0.0", port: int = 8000, bot: AsyncInstagramBot = None):
+    """Serve the bot with uvicorn (requires the async extra)"""
+    try:
+        import uvicorn
+    except ImportError as e:
+        raise ImportError("The async server requires uvicorn: pip install 'instachatdmbot[async]'") from e
+    
+    logger.info(f"Starting async bot on {host}:{port}")
+    uvicorn.run(bot or create_app(), host=host, port=port, lifespan="on")
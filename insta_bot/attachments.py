@@ -0,0 +1,370 @@
+"""Photos, voice notes and story replies: downloaded, described once per content hash"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+from . import metrics
+from .config import Config
+from .conversation_store import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+# Meta's CDN redirects lookaside URLs once; more than this is not a media URL
+MAX_REDIRECTS = 3
+
+# What the user sent, by webhook attachment type
+LABELS = {
+    "image": "a photo",
+    "animated_image": "a GIF",
+    "sticker": "a sticker",
+    "audio": "a voice message",
+    "video": "a video",
+    "file": "a file",
+    "ig_reel": "a reel",
+    "reel": "a reel",
+    "share": "a shared post",
+    "story_mention": "a story mentioning you",
+    "story": "a reply to your story",
+}
+
+# Media Gemini can take as input
+DESCRIBABLE_TYPES = ("image/", "audio/", "video/", "application/pdf")
+
+PROMPT = (
+    "A user sent this {label} in an Instagram DM. Describe it in one or two sentences for a chat "
+    "assistant that cannot see or hear it. Quote any visible text, and transcribe speech in full. "
+    "Answer with the description only."
+)
+
+
+class AttachmentTooLarge(Exception):
+    """The attachment is larger than ATTACHMENT_MAX_BYTES"""
+
+
+class AttachmentRejected(Exception):
+    """The attachment URL is not an https URL on an allowed host"""
+
+
+def allowed_url(url: str, hosts: list) -> bool:
+    """
+    Whether an attachment may be downloaded from `url`
+    
+    Args:
+        hosts: Allowed host names; an entry starting with "." allows its subdomains
+    """
+    try:
+        parsed = urlparse(url)
+        host = (parsed.hostname or "").lower()
+    except ValueError:
+        return False
+    if parsed.scheme != "https" or not host:
+        return False
+    return any(host.endswith(allowed) if allowed.startswith(".") else host == allowed for allowed in hosts)
+
+
+class _Media:
+    """A downloaded attachment: in memory up to the inline limit, else in a temp file"""
+    
+    def __init__(self, sha256: str, mime_type: str, size: int, data: bytes = None, path: str = None):
+        self.sha256 = sha256
+        self.mime_type = mime_type
+        self.size = size
+        self.data = data
+        self.path = path
+    
+    def discard(self):
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class AttachmentProcessor:
+    """
+    Turn attachments into text the model can reply to
+    
+    Media is streamed from the webhook URL with a hard size limit: it stays
+    in memory up to ATTACHMENT_INLINE_BYTES and is spooled to a temp file
+    beyond that, so memory is bounded by the number of download workers.
+    The content is hashed while it streams; descriptions are cached by hash
+    in memory and in SQLite, and concurrent requests for the same content
+    share one model call, so reshared memes and stickers are described once.
+    """
+    
+    def __init__(self, describe, session, db_path: str = None, max_bytes: int = None, inline_bytes: int = None,
+                 workers: int = None, cache_size: int = None, tmp_dir: str = None):
+        """
+        Initialize the processor
+        
+        Args:
+            describe: describe(prompt, mime_type, data=None, path=None) -> description (GeminiHandler.describe_media)
+            session: requests.Session used to download media
+            db_path: SQLite database for cached descriptions (default: from config)
+            max_bytes: Larger attachments are not downloaded
+            inline_bytes: Larger attachments are spooled to disk and uploaded through the File API
+            workers: Attachments downloaded and described at once
+            cache_size: Descriptions kept in memory
+            tmp_dir: Directory for spooled attachments (default: the system temp dir)
+        """
+        self.describe = describe
+        self.session = session
+        self.db = ConnectionManager(db_path or Config.DB_PATH)
+        self.max_bytes = max_bytes or Config.ATTACHMENT_MAX_BYTES
+        self.inline_bytes = Config.ATTACHMENT_INLINE_BYTES if inline_bytes is None else inline_bytes
+        self.cache_size = cache_size or Config.ATTACHMENT_CACHE_SIZE
+        self.tmp_dir = (Config.ATTACHMENT_TMP_DIR if tmp_dir is None else tmp_dir) or None
+        self.max_pending = Config.ATTACHMENT_QUEUE_SIZE
+        self.allowed_hosts = [host.strip().lower() for host in Config.ATTACHMENT_HOSTS.split(",") if host.strip()]
+        
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or Config.ATTACHMENT_WORKERS, thread_name_prefix="insta-bot-attachments"
+        )
+        self._descriptions = OrderedDict()
+        self._in_flight = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "described": 0, "cached": 0, "too_large": 0, "unsupported": 0, "failed": 0, "rejected": 0, "dropped": 0
+        }
+        
+        self._initialize_db()
+    
+    def _initialize_db(self):
+        """Create the descriptions table"""
+        try:
+            with self.db.connection() as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS attachment_descriptions (
+                        sha256 TEXT PRIMARY KEY,
+                        mime_type TEXT,
+                        description TEXT NOT NULL,
+                        created_at REAL NOT NULL
+                    ) WITHOUT ROWID
+                """)
+        except Exception as e:
+            logger.error(f"Error initializing attachment descriptions table: {e}")
+    
+    @staticmethod
+    def extract(message: dict) -> list:
+        """(type, url) of each attachment in a webhook message, story replies included"""
+        attachments = []
+        for attachment in message.get("attachments") or []:
+            url = (attachment.get("payload") or {}).get("url")
+            if url:
+                attachments.append((attachment.get("type") or "file", url))
+        story_url = ((message.get("reply_to") or {}).get("story") or {}).get("url")
+        if story_url:
+            attachments.append(("story", story_url))
+        return attachments
+    
+    def submit(self, attachments: list, text: str, callback) -> bool:
+        """
+        Describe attachments in the background, then call callback(message text)
+        
+        Returns:
+            False if too many attachments are queued; the callback then gets
+            the message with unviewed attachments, right away
+        """
+        with self._lock:
+            accept = self._pending < self.max_pending
+            if accept:
+                self._pending += 1
+            else:
+                self._stats["dropped"] += 1
+        if not accept:
+            callback(self._message(text, [(kind, None) for kind, _ in attachments]))
+            return False
+        
+        try:
+            self._executor.submit(self._process, attachments, text, callback)
+        except RuntimeError:
+            # Closed while the dispatcher drains: describe on the caller's thread
+            self._process(attachments, text, callback)
+        return True
+    
+    def _process(self, attachments: list, text: str, callback):
+        try:
+            callback(self.describe_message(attachments, text))
+        except Exception as e:
+            metrics.ERRORS.inc(component="attachments")
+            logger.error(f"Error processing attachments: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+    
+    def describe_message(self, attachments: list, text: str = None) -> str:
+        """The message text with a description of each attachment"""
+        return self._message(text, [(kind, self.describe_attachment(kind, url)) for kind, url in attachments])
+    
+    @staticmethod
+    def _message(text: str, described: list) -> str:
+        parts = [text] if text else []
+        for kind, description in described:
+            label = LABELS.get(kind, "an attachment")
+            parts.append(f"[Sent {label}: {description}]" if description else f"[Sent {label}]")
+        return "\n".join(parts)
+    
+    def describe_attachment(self, kind: str, url: str) -> str:
+        """A description of one attachment, or None if it can't be viewed"""
+        try:
+            media = self._download(url)
+        except AttachmentTooLarge:
+            self._count(kind, "too_large")
+            return None
+        except AttachmentRejected as e:
+            self._count(kind, "rejected")
+            logger.warning(f"⚠️ Refused to download {kind} attachment from {e}")
+            return None
+        except Exception as e:
+            self._count(kind, "failed")
+            logger.warning(f"⚠️ Could not download {kind} attachment: {e}")
+            return None
+        
+        try:
+            if not media.mime_type.startswith(DESCRIBABLE_TYPES):
+                self._count(kind, "unsupported")
+                return None
+            return self._describe_once(kind, media)
+        finally:
+            media.discard()
+    
+    def _describe_once(self, kind: str, media: _Media) -> str:
+        """Cached description by content hash; one model call per hash at a time"""
+        with self._lock:
+            description = self._descriptions.get(media.sha256)
+            if description is not None:
+                self._descriptions.move_to_end(media.sha256)
+            else:
+                future = self._in_flight.get(media.sha256)
+                owner = future is None
+                if owner:
+                    future = self._in_flight[media.sha256] = Future()
+        if description is not None:
+            self._count(kind, "cached")
+            return description
+        if not owner:
+            self._count(kind, "cached")
+            return future.result()
+        
+        try:
+            description = self._load(media.sha256)
+            if description is not None:
+                self._count(kind, "cached")
+            else:
+                description = self._generate(kind, media)
+        except Exception as e:
+            description = None
+            self._count(kind, "failed")
+            logger.error(f"Error describing {kind} attachment: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.pop(media.sha256, None)
+                if description is not None:
+                    self._remember(media.sha256, description)
+            future.set_result(description)
+        return description
+    
+    def _download(self, url: str) -> _Media:
+        """Stream an attachment, hashing it and spooling to disk past the inline limit"""
+        digest = hashlib.sha256()
+        buffer = bytearray()
+        spool = None
+        size = 0
+        
+        with self._get(url) as response:
+            response.raise_for_status()
+            declared = response.headers.get("Content-Length")
+            if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                raise AttachmentTooLarge(declared)
+            mime_type = (response.headers.get("Content-Type") or "application/octet-stream").split(";")[0].strip()
+            
+            try:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise AttachmentTooLarge(size)
+                    digest.update(chunk)
+                    if spool is None and size > self.inline_bytes:
+                        spool = tempfile.NamedTemporaryFile(prefix="insta-bot-", dir=self.tmp_dir, delete=False)
+                        spool.write(buffer)
+                        buffer = None
+                    if spool is not None:
+                        spool.write(chunk)
+                    else:
+                        buffer.extend(chunk)
+            except BaseException:
+                if spool is not None:
+                    spool.close()
+                    os.remove(spool.name)
+                raise
+        
+        if spool is not None:
+            spool.close()
+            return _Media(digest.hexdigest(), mime_type, size, path=spool.name)
+        return _Media(digest.hexdigest(), mime_type, size, data=bytes(buffer))
+    
+    def _get(self, url: str):
+        """Start a streamed download, following redirects only to allowed hosts"""
+        for _ in range(MAX_REDIRECTS + 1):
+            # The URL comes from the webhook body: never fetch internal or non-Meta addresses
+            if not allowed_url(url, self.allowed_hosts):
+                raise AttachmentRejected(urlparse(url).hostname or url[:100])
+            response = self.session.get(url, stream=True, timeout=(5, 30), allow_redirects=False)
+            if not response.is_redirect:
+                return response
+            url = urljoin(url, response.headers["Location"])
+            response.close()
+        raise AttachmentRejected(f"{urlparse(url).hostname} (too many redirects)")
+    
+    def _generate(self, kind: str, media: _Media) -> str:
+        """Describe media with the model and persist the description"""
+        prompt = PROMPT.format(label=LABELS.get(kind, "attachment").split(" ", 1)[-1])
+        description = self.describe(prompt, media.mime_type, data=media.data, path=media.path)
+        self._count(kind, "described")
+        
+        try:
+            with self.db.connection() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO attachment_descriptions (sha256, mime_type, description, created_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (media.sha256, media.mime_type, description, time.time())
+                )
+        except Exception as e:
+            logger.error(f"Error saving attachment description: {e}")
+        return description
+    
+    def _load(self, sha256: str) -> str:
+        """A description saved by this or another process"""
+        row = self.db.connection().execute(
+            "SELECT description FROM attachment_descriptions WHERE sha256 = ?", (sha256,)
+        ).fetchone()
+        return row[0] if row else None
+    
+    def _remember(self, sha256: str, description: str):
+        """Cache a description in memory (lock held)"""
+        self._descriptions[sha256] = description
+        self._descriptions.move_to_end(sha256)
+        while len(self._descriptions) > self.cache_size:
+            self._descriptions.popitem(last=False)
+    
+    def _count(self, kind: str, result: str):
+        metrics.ATTACHMENTS.inc(kind=kind, result=result)
+        with self._lock:
+            self._stats[result] += 1
+    
+    def stats(self) -> dict:
+        """Attachment counters"""
+        with self._lock:
+            return {**self._stats, "pending": self._pending, "cached_descriptions": len(self._descriptions)}
+    
+    def close(self):
+        """Finish queued attachments and close database connections"""
+        self._executor.shutdown(wait=True)
+        self.db.close()
@@ -1,10 +1,21 @@
 """Main Instagram Bot class"""
+import atexit
+import hashlib
+import hmac
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from . import metrics, resilience
+from .attachments import AttachmentProcessor
 from .config import Config
 from .instagram_api import InstagramAPI
 from .gemini_handler import GeminiHandler
-from .conversation_store import ConversationStore
+from .conversation_store import create_store
+from .coalescer import MessageCoalescer
+from .dedup import EventDeduplicator
+from .dispatcher import MessageDispatcher
+from .profile_cache import ProfileCache
+from .send_scheduler import SendScheduler
+from .tenants import TenantRegistry
 
 logger = logging.getLogger(__name__)
 
@@ -28,62 +39,182 @@ class InstagramBot:
             raise
         
         # Initialize components
-        self.conversation_store = ConversationStore()
+        self.conversation_store = create_store()
         self.instagram_api = InstagramAPI()
+        
+        # Senders' names and usernames, fetched off the reply path
+        self.profiles = None
+        if Config.PROFILE_CACHE_ENABLED:
+            self.profiles = ProfileCache()
+            self.profiles.start()
+        
         self.gemini_handler = GeminiHandler(
             system_prompt=custom_instructions or Config.BOT_INSTRUCTIONS,
             model=gemini_model or Config.GEMINI_MODEL,
-            conversation_store=self.conversation_store
+            conversation_store=self.conversation_store,
+            profiles=self.profiles,
         )
         
-        # Flask app
-        self.app = Flask(__name__)
-        self._setup_routes()
+        # Photos, voice messages and story replies become text the model can answer
+        self.attachments = None
+        if Config.ATTACHMENTS_ENABLED:
+            self.attachments = AttachmentProcessor(
+                self.gemini_handler.describe_media, self.instagram_api.session
+            )
+        
+        # Further accounts served by this process, sharing connections, models and the store
+        self.tenants = None
+        if Config.TENANTS_FILE:
+            self.tenants = TenantRegistry.load(
+                Config.TENANTS_FILE,
+                conversation_store=self.conversation_store,
+                session=self.instagram_api.session,
+                reply_cache=self.gemini_handler.reply_cache,
+                models=self.gemini_handler.models,
+                chat_sessions=self.gemini_handler.sessions,
+                profiles=self.profiles,
+            )
+        
+        # Outbound replies go through a rate-limit aware, persisted queue
+        self.send_scheduler = SendScheduler(
+            self.instagram_api, api_for=self.tenants.api if self.tenants else None
+        )
+        self.send_scheduler.start()
+        
+        # Meta redelivers events; drop the ones we've already accepted
+        self.deduplicator = EventDeduplicator()
+        
+        # Background workers so webhooks are acknowledged immediately
+        self.dispatcher = MessageDispatcher()
+        self.dispatcher.start()
+        
+        # One reply in flight per sender; burst messages are merged
+        self.coalescer = MessageCoalescer(self._dispatch_reply)
+        self.coalescer.start()
+        self._shutting_down = False
+        metrics.REGISTRY.start_writer()
+        atexit.register(self.shutdown)
+        
+        self.app = self._create_app()
         
         logger.info(f"✅ Bot initialized: {Config.BOT_NAME}")
     
-    def _setup_routes(self):
-        """Setup Flask webhook routes"""
+    def _create_app(self):
+        """Create the Flask app serving the webhook routes"""
+        app = Flask(__name__)
         
-        @self.app.route("/webhook", methods=["GET"])
+        @app.route("/webhook", methods=["GET"])
         def verify_webhook():
-            mode = request.args.get("hub.mode")
-            token = request.args.get("hub.verify_token")
-            challenge = request.args.get("hub.challenge")
-            
-            if mode == "subscribe" and token == Config.VERIFY_TOKEN:
-                logger.info("✅ Webhook verified!")
-                return challenge, 200
-            
-            logger.warning("❌ Webhook verification failed!")
-            return "Forbidden", 403
+            return self._verify_webhook(request.args)
         
-        @self.app.route("/webhook", methods=["POST"])
+        @app.route("/webhook", methods=["POST"])
         def handle_webhook():
-            body = request.get_json()
-            
-            if not body:
-                return "Bad Request", 400
+            with metrics.WEBHOOK_SECONDS.time():
+                signed = verify_signature(request.get_data(), request.headers.get("X-Hub-Signature-256"))
+                return self._accept_webhook(request.get_json(silent=True), signed)
+        
+        @app.route("/health", methods=["GET"])
+        def health():
+            return jsonify(self._health())
+        
+        @app.route("/metrics", methods=["GET"])
+        def metrics_endpoint():
+            return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+        
+        return app
+    
+    def _verify_webhook(self, args) -> tuple:
+        """Answer Meta's subscription check: (body, status)"""
+        mode = args.get("hub.mode")
+        token = args.get("hub.verify_token")
+        challenge = args.get("hub.challenge")
+        
+        if mode == "subscribe" and token == Config.VERIFY_TOKEN:
+            logger.info("✅ Webhook verified!")
+            return challenge, 200
+        
+        logger.warning("❌ Webhook verification failed!")
+        return "Forbidden", 403
+    
+    def _accept_webhook(self, body: dict, signed: bool = False) -> tuple:
+        """
+        Queue a webhook's new events for processing: (body, status)
+        
+        Args:
+            signed: Whether the body carried a valid X-Hub-Signature-256
+        """
+        # With an app secret, only Meta's signed posts are accepted
+        if Config.INSTAGRAM_APP_SECRET and not signed:
+            logger.warning("❌ Webhook signature invalid or missing")
+            return "Forbidden", 403
+        
+        if not body:
+            return "Bad Request", 400
+        
+        if body.get("object") != "instagram":
+            return "OK", 200
+        
+        try:
+            rejected = 0
+            for entry in body.get("entry", []):
+                for messaging_event in entry.get("messaging", []):
+                    event_key = self.deduplicator.event_key(messaging_event)
+                    if self.deduplicator.seen(event_key):
+                        logger.info(f"🔁 Dropped redelivered event {event_key}")
+                        continue
+                    if not self.dispatcher.submit(
+                        self._process_event, event_key, messaging_event, entry.get("id"), signed
+                    ):
+                        # Let Meta's redelivery through
+                        self.deduplicator.forget(event_key)
+                        rejected += 1
             
-            if body.get("object") != "instagram":
-                return "OK", 200
+            # Ask Meta to redeliver rather than silently dropping events
+            if rejected:
+                logger.warning(f"⚠️ Rejected {rejected} webhook events (queue full)")
+                return "Service Unavailable", 503
             
-            try:
-                for entry in body.get("entry", []):
-                    for messaging_event in entry.get("messaging", []):
-                        self._handle_message(messaging_event)
-                
-                return "OK", 200
-            except Exception as e:
-                logger.error(f"Error handling webhook: {e}")
-                return "OK", 200
-        
-        @self.app.route("/health", methods=["GET"])
-        def health():
-            return jsonify({"status": "healthy", "bot": Config.BOT_NAME})
+            return "OK", 200
+        except Exception as e:
+            metrics.ERRORS.inc(component="webhook")
+            logger.error(f"Error handling webhook: {e}")
+            return "OK", 200
+    
+    def _health(self) -> dict:
+        """Status and component counters for /health"""
+        # Only the SQLite store has a write-behind buffer
+        writer = getattr(self.conversation_store, "writer", None)
+        return {
+            "status": "healthy",
+            "bot": Config.BOT_NAME,
+            "queue": self.dispatcher.stats(),
+            "coalescer": self.coalescer.stats(),
+            "dedup": self.deduplicator.stats(),
+            "outbound": self.send_scheduler.stats(),
+            "history_cache": self.conversation_store.cache.stats() if self.conversation_store.cache else None,
+            "reply_cache": self.gemini_handler.reply_cache.stats() if self.gemini_handler.reply_cache else None,
+            "chat_sessions": self.gemini_handler.sessions.stats() if self.gemini_handler.sessions else None,
+            "profiles": self.profiles.stats() if self.profiles else None,
+            "attachments": self.attachments.stats() if self.attachments else None,
+            "write_behind": writer.stats() if writer else None,
+            "tenants": self.tenants.stats() if self.tenants else None,
+            "gemini": resilience.upstream_stats(),
+        }
+    
+    def _process_event(self, event_key: str, messaging_event: dict, account_id: str = None, signed: bool = False):
+        """Handle a queued webhook event unless another process or an earlier run already did"""
+        if self.deduplicator.record(event_key):
+            logger.info(f"🔁 Dropped redelivered event {event_key}")
+            return
+        self._handle_message(messaging_event, account_id, signed)
     
-    def _handle_message(self, messaging_event: dict):
-        """Process incoming message and send response"""
+    def _handle_message(self, messaging_event: dict, account_id: str = None, signed: bool = False):
+        """
+        Process incoming message and send response
+        
+        Args:
+            signed: The event came in a signed webhook; only then are attachment URLs fetched
+        """
         try:
             sender_id = messaging_event.get("sender", {}).get("id")
             recipient_id = messaging_event.get("recipient", {}).get("id")
@@ -93,26 +224,139 @@ class InstagramBot:
             if sender_id == Config.BOT_INSTAGRAM_ID:
                 return
             
+            # Route to the account the message was sent to (multi-tenant mode)
+            tenant_id = None
+            if self.tenants is not None:
+                tenant = self.tenants.resolve(account_id, recipient_id)
+                if tenant is not None:
+                    tenant_id = tenant.id
+                elif not Config.INSTAGRAM_ACCESS_TOKEN:
+                    logger.warning(f"⚠️ No tenant for account {account_id or recipient_id}, ignoring message")
+                    return
+                if sender_id == tenant_id:
+                    return
+            
             # Get message
             message = messaging_event.get("message", {})
             user_message = message.get("text")
+            attachments = []
+            if self.attachments is not None:
+                attachments = self.attachments.extract(message)
+                if attachments and not signed:
+                    # Anyone can post to an unsigned webhook; don't fetch URLs from it
+                    logger.warning(
+                        f"⚠️ Ignoring attachments from {sender_id}: set INSTAGRAM_APP_SECRET to verify webhooks"
+                    )
+                    attachments = []
             
-            if not user_message:
+            if not user_message and not attachments:
                 logger.debug(f"Received non-text message from {sender_id}")
                 return
             
-            logger.info(f"📨 Message from {sender_id}: {user_message}")
+            if attachments:
+                logger.info(f"📎 {len(attachments)} attachments from {sender_id}: {user_message or ''}")
+            else:
+                logger.info(f"📨 Message from {sender_id}: {user_message}")
             
-            # Generate reply
-            reply = self.gemini_handler.generate_reply(sender_id, user_message)
+            # Fetched while the burst settles, so the reply can use it without waiting
+            if self.profiles is not None:
+                api = self.tenants.api(tenant_id) if tenant_id is not None else self.instagram_api
+                self.profiles.prefetch(_conversation_id(tenant_id, sender_id), sender_id, api)
             
-            # Send reply
-            self.instagram_api.send_message(sender_id, reply)
+            # Replied to once the sender's burst settles
+            key = (tenant_id, sender_id)
+            if attachments:
+                # Described off the worker thread; the text joins the burst when ready
+                self.attachments.submit(attachments, user_message, lambda text: self.coalescer.add(key, text))
+            else:
+                self.coalescer.add(key, user_message)
             
         except Exception as e:
+            metrics.ERRORS.inc(component="webhook")
             logger.error(f"Error handling message: {e}")
     
+    def _dispatch_reply(self, key: tuple, messages: list) -> bool:
+        """Queue a reply job for a batch of messages from one (tenant, sender)"""
+        if self.dispatcher.submit(self._reply, key, messages):
+            return True
+        if self._shutting_down:
+            # Workers are draining; finish the batch here rather than drop it
+            self._reply(key, messages)
+            return True
+        return False
+    
+    def _reply(self, key: tuple, messages: list) -> bool:
+        """Generate and send one reply to a batch of messages; False if that failed"""
+        tenant_id, sender_id = key
+        try:
+            gemini_handler, conversation_id, user_message = self._reply_context(key, messages)
+            
+            # Send reply (queued; delivered within Graph API rate limits, in order)
+            if Config.STREAM_REPLIES:
+                for chunk in gemini_handler.stream_reply(conversation_id, user_message):
+                    self.send_scheduler.submit(sender_id, chunk, tenant_id=tenant_id)
+            else:
+                reply = gemini_handler.generate_reply(conversation_id, user_message)
+                self.send_scheduler.submit(sender_id, reply, tenant_id=tenant_id)
+            return True
+        except Exception as e:
+            metrics.ERRORS.inc(component="reply")
+            logger.error(f"Error replying to {sender_id}: {e}")
+            return False
+        finally:
+            self.coalescer.done(key)
+    
+    def _reply_context(self, key: tuple, messages: list) -> tuple:
+        """The handler, conversation id and merged text for a batch: (gemini_handler, conversation_id, text)"""
+        tenant_id, sender_id = key
+        gemini_handler = self.gemini_handler
+        if tenant_id is not None:
+            gemini_handler = self.tenants.clients(tenant_id)[1]
+        conversation_id = _conversation_id(tenant_id, sender_id)
+        
+        if len(messages) > 1:
+            logger.info(f"🧩 Merged {len(messages)} messages from {sender_id}")
+        return gemini_handler, conversation_id, "\n".join(messages)
+    
+    def shutdown(self, timeout: float = None):
+        """Drain queued messages, stop background workers and close connections"""
+        self._shutting_down = True
+        self._close_attachments()
+        self.coalescer.close()
+        self.dispatcher.shutdown(drain=True, timeout=timeout)
+        self.send_scheduler.shutdown(timeout=timeout)
+        self.gemini_handler.close()
+        if self.tenants is not None:
+            self.tenants.close()
+        self.instagram_api.close()
+        if self.profiles is not None:
+            self.profiles.close()
+        self.deduplicator.close()
+        self.conversation_store.close()
+        metrics.REGISTRY.stop_writer()
+    
+    def _close_attachments(self):
+        """Finish describing queued attachments; their messages go to the coalescer"""
+        if self.attachments is not None:
+            self.attachments.close()
+    
     def run(self, host: str = "0.0.0.0", port: int = 8000, debug: bool = False):
         """Run the Flask app"""
         logger.info(f"Starting bot on {host}:{port}")
-        self.app.run(host=host, port=port, debug=debug)
+        try:
+            self.app.run(host=host, port=port, debug=debug)
+        finally:
+            self.shutdown()
+
+
+def _conversation_id(tenant_id: str, sender_id: str) -> str:
+    """Store key for a conversation; sender ids are scoped to the account, so tenants' are kept apart"""
+    return sender_id if tenant_id is None else f"{tenant_id}:{sender_id}"
+
+
+def verify_signature(body: bytes, header: str) -> bool:
+    """Whether X-Hub-Signature-256 is the HMAC-SHA256 of the raw body with the app secret"""
+    if not Config.INSTAGRAM_APP_SECRET or not header or not header.startswith("sha256="):
+        return False
+    expected = hmac.new(Config.INSTAGRAM_APP_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, header[len("sha256="):])
@@ -0,0 +1,166 @@
+"""Pool of live Gemini chat sessions, reused across a user's turns"""
+import threading
+from collections import OrderedDict
+from . import metrics
+from .config import Config
+from .context_window import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+
+# Approximate fixed cost of one converted chat turn (Content and Part protos)
+TURN_OVERHEAD_BYTES = 400
+
+
+def turn_text(turn) -> str:
+    """Text of a chat turn, given as a dict or as an SDK Content"""
+    if isinstance(turn, dict):
+        return " ".join(turn["parts"])
+    return " ".join(part.text for part in turn.parts)
+
+
+class PooledSession:
+    """
+    A user's chat history, converted once to the SDK's format
+    
+    Each reply starts a chat from this history (one per attempt, so hedged
+    and fallback calls never share one). `upto` is the id of the last stored
+    message the history reflects; the session is only reused while nothing
+    else was stored for the user in between (another worker, a cached reply,
+    a cleared history).
+    """
+    
+    __slots__ = ("history", "convert", "upto", "messages", "tokens", "size", "personalized", "recall_before",
+                 "recalled")
+    
+    def __init__(self, history: list, messages: int, convert=list):
+        """
+        Args:
+            history: Chat history in Gemini format
+            messages: Conversation messages in the history (the summary and recall turns not counted)
+            convert: Converts turns to the SDK's Content objects
+        """
+        self.convert = convert
+        self.history = convert(history)
+        self.upto = None
+        # Whether the history opens with the user's profile
+        self.personalized = False
+        # Id bound of the recall search, if the history had aged-out messages, and
+        # whether it holds recall turns (right before the conversation messages)
+        self.recall_before = None
+        self.recalled = False
+        self.messages = messages
+        self.tokens = 0
+        self.size = 0
+        for turn in self.history[:len(self.history) - messages]:
+            self.size += TURN_OVERHEAD_BYTES + len(turn_text(turn))
+        # The window's token budget only covers the conversation messages
+        for turn in self.history[len(self.history) - messages:]:
+            self._count(turn_text(turn))
+    
+    def _count(self, text: str):
+        self.tokens += estimate_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+        self.size += TURN_OVERHEAD_BYTES + len(text)
+    
+    def replace_recall(self, turns: list):
+        """Swap the recall turns for ones found for the new message"""
+        start = len(self.history) - self.messages - 2
+        old = self.history[start:start + 2]
+        new = self.convert(turns)
+        self.history[start:start + 2] = new
+        self.size += sum(len(turn_text(turn)) for turn in new) - sum(len(turn_text(turn)) for turn in old)
+    
+    def append(self, prompt: str, reply: str, upto: int):
+        """Add a finished exchange, as stored (the reply after cleanup)"""
+        self.history.extend(self.convert([
+            {"role": "user", "parts": [prompt]},
+            {"role": "model", "parts": [reply]},
+        ]))
+        self.messages += 2
+        self._count(prompt)
+        self._count(reply)
+        self.upto = upto
+
+
+class ChatSessionPool:
+    """LRU pool of chat sessions by conversation"""
+    
+    def __init__(self, max_sessions: int = None):
+        """
+        Initialize the pool
+        
+        Args:
+            max_sessions: Sessions kept; the least recently used one is dropped beyond this
+        """
+        self.max_sessions = max_sessions or Config.CHAT_SESSION_POOL_SIZE
+        
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.full = 0
+        self.evictions = 0
+    
+    def checkout(self, user_id: str, previous_id: int, max_messages: int, max_tokens: int):
+        """
+        Take a user's session if it is still current and has room for another exchange
+        
+        Args:
+            previous_id: Id of the last stored message before the new one
+            max_messages: Context window size in messages
+            max_tokens: Context window budget in estimated tokens
+        
+        Returns:
+            The session (removed from the pool until it is stored again), or
+            None if the history has to be rebuilt from the store
+        """
+        with self._lock:
+            session = self._sessions.pop(user_id, None)
+            if session is not None:
+                self._bytes -= session.size
+            
+            if session is None:
+                self.misses += 1
+                result = "miss"
+            elif session.upto != previous_id:
+                self.stale += 1
+                session = None
+                result = "stale"
+            elif session.messages + 2 > max_messages or session.tokens > max_tokens:
+                # Rebuilding trims the window and brings the summary up to date
+                self.full += 1
+                session = None
+                result = "full"
+            else:
+                self.hits += 1
+                result = "hit"
+        metrics.CHAT_SESSIONS.inc(result=result)
+        return session
+    
+    def store(self, user_id: str, session: PooledSession):
+        """Keep a session for the user's next turn"""
+        with self._lock:
+            previous = self._sessions.pop(user_id, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._sessions[user_id] = session
+            self._bytes += session.size
+            while len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+    
+    def stats(self) -> dict:
+        """Hit/miss counters and approximate memory use"""
+        with self._lock:
+            lookups = self.hits + self.misses + self.stale + self.full
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "full": self.full,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
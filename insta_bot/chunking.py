@@ -0,0 +1,117 @@
+"""Reply cleanup and splitting of streamed replies into messages"""
+import re
+from .config import Config
+
+# Instagram rejects longer messages
+MAX_REPLY_LENGTH = 990
+
+# Speaker labels the model sometimes puts in front of its reply
+REPLY_PREFIXES = ["Reply:", "Response:", "Me:", "Message:", "Him:"]
+
+# Characters needed before we can tell whether the reply starts with a prefix
+_PREFIX_LOOKAHEAD = max(len(p) for p in REPLY_PREFIXES)
+
+# Whitespace after sentence-ending punctuation, or a line break
+_BOUNDARY = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+
+def strip_prefixes(reply: str) -> str:
+    """Remove speaker labels from the start of a reply"""
+    for prefix in REPLY_PREFIXES:
+        if reply.lower().startswith(prefix.lower()):
+            reply = reply[len(prefix):].strip()
+    return reply
+
+
+def truncate(reply: str) -> str:
+    """Limit a reply to one Instagram message"""
+    if len(reply) > MAX_REPLY_LENGTH:
+        reply = reply[:MAX_REPLY_LENGTH - 3] + "..."
+    return reply
+
+
+class ReplyChunker:
+    """
+    Split streamed reply text into messages at sentence boundaries
+    
+    The first sentence is released as soon as it is complete; later
+    messages collect sentences up to chunk_chars. No message is longer
+    than MAX_REPLY_LENGTH, and the reply as a whole stops at max_total
+    characters: the message reaching it is cut short and `done` is set,
+    so the caller can stop reading the stream.
+    """
+    
+    def __init__(self, chunk_chars: int = None, max_chars: int = MAX_REPLY_LENGTH, max_total: int = None):
+        """
+        Initialize the chunker
+        
+        Args:
+            chunk_chars: Preferred minimum length of messages after the first
+            max_chars: Hard limit per message
+            max_total: Hard limit for the whole reply (default: max_chars * STREAM_MAX_MESSAGES)
+        """
+        self.max_chars = max_chars
+        self.chunk_chars = min(chunk_chars or Config.STREAM_CHUNK_CHARS, max_chars)
+        self.max_total = max_total or max_chars * Config.STREAM_MAX_MESSAGES
+        self.done = False
+        
+        self._buffer = ""
+        self._prefix_checked = False
+        self._chunks = 0
+        self._total = 0
+    
+    def feed(self, text: str) -> list:
+        """Add streamed text and return the messages that are ready"""
+        if self.done:
+            return []
+        self._buffer += text
+        return self._take(final=False)
+    
+    def finish(self) -> list:
+        """Return the remaining messages once the stream has ended"""
+        return self._take(final=True)
+    
+    def _take(self, final: bool) -> list:
+        if not self._prefix_checked:
+            self._buffer = self._buffer.lstrip()
+            if len(self._buffer) <= _PREFIX_LOOKAHEAD and not final:
+                return []
+            # strip_prefixes() would also trim the end, which may still be mid-stream
+            for prefix in REPLY_PREFIXES:
+                if self._buffer.lower().startswith(prefix.lower()):
+                    self._buffer = self._buffer[len(prefix):].lstrip()
+            self._prefix_checked = True
+        
+        chunks = []
+        while self._buffer:
+            target = self.chunk_chars if self._chunks else 1
+            candidates = [m for m in _BOUNDARY.finditer(self._buffer) if m.start() <= self.max_chars]
+            cut = next(((m.start(), m.end()) for m in candidates if m.start() >= target), None)
+            
+            if cut is None and len(self._buffer) > self.max_chars:
+                if candidates and candidates[-1].start() > 0:
+                    cut = (candidates[-1].start(), candidates[-1].end())
+                else:
+                    # No sentence fits: split at the last space instead
+                    space = self._buffer.rfind(" ", 0, self.max_chars + 1)
+                    cut = (space, space + 1) if space > 0 else (self.max_chars, self.max_chars)
+            
+            if cut is None:
+                if not final:
+                    break
+                cut = (len(self._buffer), len(self._buffer))
+            
+            chunk = self._buffer[:cut[0]].strip()
+            self._buffer = self._buffer[cut[1]:]
+            if chunk and self._total + len(chunk) > self.max_total:
+                # The reply has used its budget: end it with this message
+                room = self.max_total - self._total
+                chunk = chunk[:room - 3].rstrip() + "..." if room > 3 else ""
+                self._buffer = ""
+                self.done = True
+            if chunk:
+                chunks.append(chunk)
+                self._chunks += 1
+                self._total += len(chunk)
+        
+        return chunks
@@ -93,9 +93,14 @@ DB_PATH=./conversations.db
 @cli.command()
 @click.option("--host", default="0.0.0.0", help="Host to run on")
 @click.option("--port", default=8000, help="Port to run on")
-def run(host, port):
+@click.option("--server", type=click.Choice(["flask", "async"]), default="flask",
+              help="flask: threaded WSGI server; async: ASGI event loop (needs the async extra)")
+def run(host, port, server):
     """Run the bot"""
-    from .bot import InstagramBot
+    if server == "async":
+        from .asgi import AsyncInstagramBot as InstagramBot
+    else:
+        from .bot import InstagramBot
     
     try:
         bot = InstagramBot()
@@ -122,5 +127,109 @@ def validate():
         sys.exit(1)
 
 
+@cli.command()
+@click.option("--max-messages", type=int, help="Messages kept per user (default: RETENTION_MAX_MESSAGES)")
+@click.option("--max-age-days", type=float, help="Remove messages older than this (default: RETENTION_MAX_AGE_DAYS)")
+@click.option("--batch-size", type=int, help="Messages removed per transaction")
+@click.option("--no-archive", is_flag=True, help="Delete removed messages instead of archiving them")
+@click.option("--archive-file", type=click.Path(dir_okay=False), help="Also append removed messages to a .ndjson.gz file")
+@click.option("--no-vacuum", is_flag=True, help="Leave freed pages in the database file")
+@click.option("--full-vacuum", is_flag=True, help="Rebuild the file and enable incremental vacuum (blocks the bot)")
+def retention(max_messages, max_age_days, batch_size, no_archive, archive_file, no_vacuum, full_vacuum):
+    """Expire and archive old conversation history"""
+    from .retention import RetentionJob
+    
+    job = RetentionJob(
+        max_messages=max_messages,
+        max_age_days=max_age_days,
+        batch_size=batch_size,
+        archive=False if no_archive else None,
+        archive_file=archive_file,
+    )
+    if not job.max_messages and not job.max_age_days:
+        click.secho("⚠️  No limits set: use --max-messages/--max-age-days or RETENTION_* settings", fg="yellow")
+    
+    try:
+        report = job.run(vacuum=not no_vacuum, full_vacuum=full_vacuum)
+    except Exception as e:
+        click.secho(f"❌ Retention failed: {e}", fg="red")
+        sys.exit(1)
+    finally:
+        job.close()
+    
+    click.secho("✅ Retention complete", fg="green")
+    click.echo(f"  Expired by age: {report['expired']}")
+    click.echo(f"  Trimmed over limit: {report['trimmed']}")
+    click.echo(f"  Archived: {report['archived_messages']} messages ({report['archive_bytes']} bytes compressed)")
+    click.echo(f"  Database: {report['bytes_before']} → {report['bytes_after']} bytes "
+               f"({report['bytes_reclaimed']} reclaimed) in {report['seconds']}s")
+
+
+@cli.command()
+@click.argument("input_file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--concurrency", type=int, default=8, show_default=True,
+              help="Replies generated at once (Gemini calls are also capped by GEMINI_CALL_THREADS)")
+@click.option("--output", type=click.Path(dir_okay=False), help="Append the replies to this NDJSON file")
+@click.option("--store", type=click.Choice(["memory", "sqlite", "redis"]), default="memory", show_default=True,
+              help="Conversation store the replayed history goes to")
+@click.option("--model", help="Gemini model (default: GEMINI_MODEL)")
+@click.option("--instructions-file", type=click.Path(exists=True, dir_okay=False),
+              help="System prompt to replay with (default: BOT_INSTRUCTIONS)")
+@click.option("--checkpoint", type=click.Path(dir_okay=False), help="Progress file (default: INPUT_FILE.checkpoint)")
+@click.option("--checkpoint-every", type=int, default=1000, show_default=True, help="Lines between checkpoint saves")
+@click.option("--resume", is_flag=True, help="Continue from the checkpoint")
+@click.option("--limit", type=int, help="Stop after this many lines")
+@click.option("--attachments", is_flag=True, help="Download and describe attachments (recorded URLs may have expired)")
+@click.option("--json", "as_json", is_flag=True, help="Print the summary as JSON")
+def replay(input_file, concurrency, output, store, model, instructions_file, checkpoint, checkpoint_every, resume,
+           limit, attachments, as_json):
+    """Replay recorded webhook payloads (NDJSON) through the bot without sending anything"""
+    import json
+    from .replay import DryRunSink, ReplayBot, ReplayRunner
+    
+    instructions = None
+    if instructions_file:
+        instructions = Path(instructions_file).read_text(encoding="utf-8")
+    
+    sink = DryRunSink(output)
+    try:
+        bot = ReplayBot(sink, custom_instructions=instructions, gemini_model=model, store=store,
+                        attachments=attachments)
+    except Exception as e:
+        click.secho(f"❌ Error: {e}", fg="red")
+        sys.exit(1)
+    
+    runner = ReplayRunner(
+        bot,
+        concurrency=concurrency,
+        checkpoint=checkpoint or f"{input_file}.checkpoint",
+        checkpoint_every=checkpoint_every,
+        limit=limit,
+    )
+    try:
+        report = runner.run(input_file, resume=resume)
+    finally:
+        bot.shutdown()
+        sink.close()
+    
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+    
+    latency = report["latency_ms"]
+    if report["interrupted"]:
+        click.secho(f"⚠️  Interrupted: resume with --resume (from line {report['checkpoint_line']})", fg="yellow")
+    else:
+        click.secho("✅ Replay complete", fg="green")
+    click.echo(f"  Lines: {report['lines']} ({report['invalid']} invalid), events: {report['events']}, "
+               f"replies: {report['replies']}")
+    if report["failed"]:
+        click.secho(f"  Failed events: {report['failed']} ({report['fallback_replies']} fallback replies, "
+                    f"{report['reply_errors']} reply errors)", fg="red")
+    click.echo(f"  Throughput: {report['events_per_second']} events/s over {report['seconds']}s")
+    click.echo(f"  Latency per event: p50 {latency['p50']} ms, p95 {latency['p95']} ms, "
+               f"p99 {latency['p99']} ms, max {latency['max']} ms")
+
+
 if __name__ == "__main__":
     cli()
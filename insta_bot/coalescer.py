@@ -0,0 +1,168 @@
+"""Per-sender serialization and merging of burst messages"""
+import heapq
+import logging
+import threading
+import time
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class _SenderState:
+    """Messages waiting for one sender"""
+    
+    __slots__ = ("pending", "in_flight", "first_at", "deadline")
+    
+    def __init__(self):
+        self.pending = []
+        self.in_flight = False
+        self.first_at = None
+        self.deadline = None
+
+
+class MessageCoalescer:
+    """
+    Keep at most one reply generation in flight per sender
+    
+    Messages arriving within the debounce window, or while a reply for the
+    same sender is being generated, are merged into one batch.
+    """
+    
+    def __init__(self, dispatch, window: float = None, max_wait: float = None):
+        """
+        Initialize the coalescer
+        
+        Args:
+            dispatch: Called as dispatch(sender_id, messages) with a batch of
+                texts; returns False if the batch could not be queued
+            window: Seconds to wait for more messages after the latest one (0 disables)
+            max_wait: Maximum seconds a message waits for the window to close
+        """
+        self.dispatch = dispatch
+        self.window = Config.COALESCE_WINDOW if window is None else window
+        self.max_wait = Config.COALESCE_MAX_WAIT if max_wait is None else max_wait
+        
+        self._states = {}
+        self._timers = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._batches = 0
+        self._merged = 0
+    
+    def start(self):
+        """Start the debounce timer thread"""
+        self._thread = threading.Thread(target=self._run, name="insta-bot-coalescer", daemon=True)
+        self._thread.start()
+    
+    def add(self, sender_id: str, text: str):
+        """Queue a message from a sender"""
+        with self._cond:
+            state = self._states.get(sender_id)
+            if state is None:
+                state = self._states[sender_id] = _SenderState()
+            state.pending.append(text)
+            
+            # Merged into the batch after the one in flight
+            if state.in_flight:
+                return
+            
+            if self.window <= 0 or self._closed:
+                flush_now = True
+            else:
+                now = time.monotonic()
+                if state.first_at is None:
+                    state.first_at = now
+                state.deadline = min(state.first_at + self.max_wait, now + self.window)
+                self._seq += 1
+                heapq.heappush(self._timers, (state.deadline, self._seq, sender_id))
+                self._cond.notify()
+                flush_now = False
+        
+        if flush_now:
+            self._flush(sender_id)
+    
+    def done(self, sender_id: str):
+        """Mark a sender's batch as finished and dispatch anything that arrived meanwhile"""
+        with self._cond:
+            state = self._states.get(sender_id)
+            if state is None:
+                return
+            state.in_flight = False
+            if not state.pending:
+                del self._states[sender_id]
+                return
+        
+        # These messages already waited for the previous reply
+        self._flush(sender_id)
+    
+    def _flush(self, sender_id: str):
+        """Dispatch a sender's pending messages as one batch"""
+        with self._cond:
+            state = self._states.get(sender_id)
+            if state is None or state.in_flight or not state.pending:
+                return
+            messages, state.pending = state.pending, []
+            state.in_flight = True
+            state.first_at = state.deadline = None
+            self._batches += 1
+            self._merged += len(messages) - 1
+        
+        if self.dispatch(sender_id, messages):
+            return
+        
+        # Could not be queued: put the messages back and try again shortly
+        with self._cond:
+            state.in_flight = False
+            state.pending = messages + state.pending
+            state.deadline = time.monotonic() + max(self.window, 1.0)
+            self._seq += 1
+            heapq.heappush(self._timers, (state.deadline, self._seq, sender_id))
+            self._cond.notify()
+    
+    def _run(self):
+        """Flush senders whose debounce window has closed"""
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                if not self._timers:
+                    self._cond.wait()
+                    continue
+                deadline, _, sender_id = self._timers[0]
+                wait = deadline - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(timeout=wait)
+                    continue
+                heapq.heappop(self._timers)
+                
+                # Skip timers superseded by a later message
+                state = self._states.get(sender_id)
+                if state is None or state.deadline != deadline:
+                    continue
+            
+            self._flush(sender_id)
+    
+    def close(self):
+        """Stop debouncing and dispatch everything pending right away"""
+        with self._cond:
+            self._closed = True
+            self._timers.clear()
+            senders = list(self._states)
+            self._cond.notify_all()
+        
+        for sender_id in senders:
+            self._flush(sender_id)
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+    
+    def stats(self) -> dict:
+        """Batching counters"""
+        with self._cond:
+            return {
+                "senders": len(self._states),
+                "in_flight": sum(1 for s in self._states.values() if s.in_flight),
+                "batches": self._batches,
+                "merged_messages": self._merged,
+            }
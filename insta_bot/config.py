@@ -19,16 +19,141 @@ class Config:
     # Gemini Configuration
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
     GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
+    # Models tried in order when the main one fails or its circuit is open (comma separated)
+    GEMINI_FALLBACK_MODELS = [m.strip() for m in os.getenv("GEMINI_FALLBACK_MODELS", "").split(",") if m.strip()]
+    GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "20"))
+    GEMINI_DEADLINE = float(os.getenv("GEMINI_DEADLINE", "45"))
+    GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "false").lower() == "true"
+    GEMINI_HEDGE_QUANTILE = float(os.getenv("GEMINI_HEDGE_QUANTILE", "0.95"))
+    GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+    GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", "30"))
+    GEMINI_CALL_THREADS = int(os.getenv("GEMINI_CALL_THREADS", "32"))
+    # Server-side context cache for long system prompts (needs a model that supports caching)
+    GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() == "true"
+    GEMINI_CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+    GEMINI_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "4096"))
     
     # Bot Configuration
     BOT_NAME = os.getenv("BOT_NAME", "Assistant")
     BOT_INSTRUCTIONS = os.getenv("BOT_INSTRUCTIONS", "You are a helpful Instagram assistant.")
     
+    # Multi-tenant mode: JSON file listing accounts, their tokens and personas
+    TENANTS_FILE = os.getenv("TENANTS_FILE", "")
+    TENANT_CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", "500"))
+    
+    # Context window (how much history is sent to Gemini per reply)
+    CONTEXT_MAX_MESSAGES = int(os.getenv("CONTEXT_MAX_MESSAGES", "20"))
+    CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "2000"))
+    SUMMARY_EVERY_MESSAGES = int(os.getenv("SUMMARY_EVERY_MESSAGES", "10"))
+    SUMMARY_MAX_MESSAGES = int(os.getenv("SUMMARY_MAX_MESSAGES", "100"))
+    SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+    # Full-text index over past messages; relevant older turns are added to the context
+    HISTORY_SEARCH = os.getenv("HISTORY_SEARCH", "false").lower() == "true"
+    HISTORY_SEARCH_TOP_K = int(os.getenv("HISTORY_SEARCH_TOP_K", "3"))
+    # Live chat sessions reused across turns, 0 disables
+    CHAT_SESSION_POOL_SIZE = int(os.getenv("CHAT_SESSION_POOL_SIZE", "1000"))
+    CHAT_SESSION_HEADROOM = int(os.getenv("CHAT_SESSION_HEADROOM", "6"))
+    
     # API Configuration
     GRAPH_API_URL = "https://graph.instagram.com/v21.0"
+    HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+    HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+    HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+    
+    # Outbound send scheduling (Graph API rate limits)
+    SEND_RATE = float(os.getenv("SEND_RATE", "20"))
+    SEND_BURST = float(os.getenv("SEND_BURST", "40"))
+    SEND_RECIPIENT_RATE = float(os.getenv("SEND_RECIPIENT_RATE", "1"))
+    SEND_RECIPIENT_BURST = float(os.getenv("SEND_RECIPIENT_BURST", "3"))
+    SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "4"))
+    SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "8"))
+    SEND_BACKOFF_BASE = float(os.getenv("SEND_BACKOFF_BASE", "1"))
+    SEND_BACKOFF_MAX = float(os.getenv("SEND_BACKOFF_MAX", "300"))
+    SEND_USAGE_THRESHOLD = float(os.getenv("SEND_USAGE_THRESHOLD", "80"))
+    SEND_LEASE_SECONDS = float(os.getenv("SEND_LEASE_SECONDS", "60"))
     
     # Database
     DB_PATH = os.getenv("DB_PATH", "./conversations.db")
+    DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+    DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+    DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+    DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "128"))
+    
+    # Conversation store backend: sqlite, memory or redis
+    STORE_BACKEND = os.getenv("STORE_BACKEND", "sqlite")
+    REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    REDIS_KEY_PREFIX = os.getenv("REDIS_KEY_PREFIX", "insta_bot:")
+    REDIS_MAX_MESSAGES = int(os.getenv("REDIS_MAX_MESSAGES", "200"))
+    REDIS_TTL = int(os.getenv("REDIS_TTL", str(30 * 24 * 3600)))
+    
+    # Write-behind: buffer new messages and write them in batches (off by default)
+    WRITE_BEHIND = os.getenv("WRITE_BEHIND", "false").lower() == "true"
+    WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "200"))
+    WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.05"))
+    WRITE_BEHIND_JOURNAL = os.getenv("WRITE_BEHIND_JOURNAL", "")
+    WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "true").lower() == "true"
+    WRITE_BEHIND_ID_BLOCK = int(os.getenv("WRITE_BEHIND_ID_BLOCK", "1000"))
+    
+    # History retention (0 disables a limit); run with `instachatdmbot retention`
+    RETENTION_MAX_MESSAGES = int(os.getenv("RETENTION_MAX_MESSAGES", "0"))
+    RETENTION_MAX_AGE_DAYS = float(os.getenv("RETENTION_MAX_AGE_DAYS", "0"))
+    RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+    RETENTION_ARCHIVE = os.getenv("RETENTION_ARCHIVE", "true").lower() == "true"
+    RETENTION_PAUSE = float(os.getenv("RETENTION_PAUSE", "0.05"))
+    
+    # In-memory history cache (0 bytes disables it)
+    HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    HISTORY_CACHE_TTL = float(os.getenv("HISTORY_CACHE_TTL", "300"))
+    HISTORY_CACHE_MESSAGES = int(os.getenv("HISTORY_CACHE_MESSAGES", "50"))
+    HISTORY_CACHE_VALIDATE = os.getenv("HISTORY_CACHE_VALIDATE", "true").lower() == "true"
+    
+    # Send replies sentence by sentence while they are generated
+    STREAM_REPLIES = os.getenv("STREAM_REPLIES", "false").lower() == "true"
+    STREAM_CHUNK_CHARS = int(os.getenv("STREAM_CHUNK_CHARS", "300"))
+    # A streamed reply ends after this many messages' worth of text (MAX_REPLY_LENGTH each)
+    STREAM_MAX_MESSAGES = int(os.getenv("STREAM_MAX_MESSAGES", "3"))
+    
+    # Reply cache for repeated questions (off by default)
+    REPLY_CACHE_ENABLED = os.getenv("REPLY_CACHE_ENABLED", "false").lower() == "true"
+    REPLY_CACHE_TTL = float(os.getenv("REPLY_CACHE_TTL", "3600"))
+    REPLY_CACHE_MAX_ENTRIES = int(os.getenv("REPLY_CACHE_MAX_ENTRIES", "5000"))
+    REPLY_CACHE_THRESHOLD = float(os.getenv("REPLY_CACHE_THRESHOLD", "0.85"))
+    REPLY_CACHE_MAX_HISTORY = int(os.getenv("REPLY_CACHE_MAX_HISTORY", "0"))
+    
+    # Metrics (/metrics); set METRICS_DIR to aggregate gunicorn workers
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_DIR = os.getenv("METRICS_DIR", "")
+    METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+    
+    # Background processing
+    WORKER_THREADS = int(os.getenv("WORKER_THREADS", "4"))
+    WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+    SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "30"))
+    DEDUP_TTL = float(os.getenv("DEDUP_TTL", str(24 * 3600)))
+    DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "100000"))
+    # Sender names and usernames, fetched in the background for personalized replies
+    PROFILE_CACHE_ENABLED = os.getenv("PROFILE_CACHE_ENABLED", "true").lower() == "true"
+    PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", str(7 * 24 * 3600)))
+    PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+    PROFILE_BATCH_SIZE = int(os.getenv("PROFILE_BATCH_SIZE", "50"))
+    PROFILE_BATCH_WAIT = float(os.getenv("PROFILE_BATCH_WAIT", "0.2"))
+    PROFILE_RETRY_AFTER = float(os.getenv("PROFILE_RETRY_AFTER", "3600"))
+    # Photos, voice messages and story replies, described by the model
+    ATTACHMENTS_ENABLED = os.getenv("ATTACHMENTS_ENABLED", "true").lower() == "true"
+    # Attachment URLs come from the webhook body: only Meta's CDN hosts are fetched
+    ATTACHMENT_HOSTS = os.getenv("ATTACHMENT_HOSTS", "lookaside.fbsbx.com,.fbcdn.net,.cdninstagram.com")
+    ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(25 * 1024 * 1024)))
+    ATTACHMENT_INLINE_BYTES = int(os.getenv("ATTACHMENT_INLINE_BYTES", str(4 * 1024 * 1024)))
+    ATTACHMENT_WORKERS = int(os.getenv("ATTACHMENT_WORKERS", "4"))
+    ATTACHMENT_QUEUE_SIZE = int(os.getenv("ATTACHMENT_QUEUE_SIZE", "200"))
+    ATTACHMENT_CACHE_SIZE = int(os.getenv("ATTACHMENT_CACHE_SIZE", "5000"))
+    ATTACHMENT_TMP_DIR = os.getenv("ATTACHMENT_TMP_DIR", "")
+    ATTACHMENT_DESCRIPTION_TOKENS = int(os.getenv("ATTACHMENT_DESCRIPTION_TOKENS", "300"))
+    ATTACHMENT_PROCESSING_TIMEOUT = float(os.getenv("ATTACHMENT_PROCESSING_TIMEOUT", "60"))
+    COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "1.0"))
+    COALESCE_MAX_WAIT = float(os.getenv("COALESCE_MAX_WAIT", "4.0"))
+    # Async server (`run --server async`): replies generated at once
+    ASYNC_MAX_REPLIES = int(os.getenv("ASYNC_MAX_REPLIES", "1000"))
     
     @classmethod
     def validate(cls):
@@ -39,6 +164,9 @@ class Config:
             "INSTAGRAM_ACCESS_TOKEN": cls.INSTAGRAM_ACCESS_TOKEN,
             "VERIFY_TOKEN": cls.VERIFY_TOKEN,
         }
+        # In multi-tenant mode each account's token comes from the tenants file
+        if cls.TENANTS_FILE:
+            del required["INSTAGRAM_ACCESS_TOKEN"]
         
         missing = [key for key, value in required.items() if not value]
         
@@ -0,0 +1,61 @@
+"""Bounded context window for conversation history sent to Gemini"""
+import logging
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Rough per-message overhead for role markers and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap local token estimate (~4 characters per token for Gemini tokenizers)
+    
+    Good enough for budgeting; avoids a count_tokens round trip per message.
+    """
+    if not text:
+        return 0
+    return (len(text) + 3) // 4
+
+
+class ContextWindow:
+    """Select the recent tail of a conversation that fits a message and token budget"""
+    
+    def __init__(self, max_messages: int = None, max_tokens: int = None, summary_every: int = None):
+        """
+        Initialize the context window
+        
+        Args:
+            max_messages: Maximum number of recent messages to send
+            max_tokens: Estimated token budget for the recent messages
+            summary_every: Refresh the rolling summary once this many messages
+                have fallen out of the window since the last refresh (0 disables)
+        """
+        self.max_messages = max_messages or Config.CONTEXT_MAX_MESSAGES
+        self.max_tokens = max_tokens or Config.CONTEXT_MAX_TOKENS
+        self.summary_every = Config.SUMMARY_EVERY_MESSAGES if summary_every is None else summary_every
+    
+    def fit(self, history: list) -> list:
+        """Return the newest messages of `history` that fit the budget, oldest first"""
+        selected = []
+        tokens = 0
+        
+        for msg in reversed(history[-self.max_messages:]):
+            cost = estimate_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS
+            if selected and tokens + cost > self.max_tokens:
+                break
+            selected.append(msg)
+            tokens += cost
+        
+        selected.reverse()
+        
+        # Gemini expects the history to open with a user turn
+        while selected and selected[0]["role"] != "user":
+            selected.pop(0)
+        
+        return selected
+    
+    def needs_summary(self, unsummarized_count: int) -> bool:
+        """Whether enough messages fell out of the window to refresh the summary"""
+        return bool(self.summary_every) and unsummarized_count >= self.summary_every
@@ -1,101 +1,656 @@
 """Conversation storage and retrieval"""
 import json
+import math
+import re
 import sqlite3
 import logging
+import threading
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import Counter
 from datetime import datetime
+from . import metrics, porter
 from .config import Config
+from .history_cache import HistoryCache
+from .write_behind import WriteBehindBuffer
 
 logger = logging.getLogger(__name__)
 
+# Bumped whenever _initialize_db needs to migrate existing data
+SCHEMA_VERSION = 2
 
-class ConversationStore:
+# Search terms per query; common words only add matches, not relevance
+MAX_SEARCH_TERMS = 12
+# Most recent matching messages ranked per search
+SEARCH_CANDIDATES = 100
+# Words as FTS5's unicode61 tokenizer splits them
+TOKEN = re.compile(r"[^\W_]+")
+# Stems remembered between searches; DMs reuse a small vocabulary
+STEM_CACHE_SIZE = 50000
+# Words the index matched in a candidate, as marked by highlight(messages_fts, 1, char(1), char(2))
+MARKED = re.compile("\x01([^\x02]*)\x02")
+STOPWORDS = frozenset("""
+    a an and are as at be but by can could did do does for from had has have how i if in is it its just me
+    my no not of on or our so that the their them then there they this to too us was we were what when
+    where which who why will with would you your yes ok okay hi hey hello thanks please
+""".split())
+
+
+def _search_terms(text: str) -> list:
+    """Distinct words worth searching for, longest first when there are too many"""
+    terms = []
+    for word in TOKEN.findall(text.lower()):
+        if len(word) > 1 and word not in STOPWORDS and word not in terms:
+            terms.append(word)
+    if len(terms) > MAX_SEARCH_TERMS:
+        terms = sorted(terms, key=len, reverse=True)[:MAX_SEARCH_TERMS]
+    return terms
+
+
+def _fts_quote(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+_stems = {}
+
+
+def _stem(word: str) -> str:
+    """A lowercase word as the index stores it (unicode61 drops diacritics, then Porter stems)"""
+    stem = _stems.get(word)
+    if stem is None:
+        if len(_stems) >= STEM_CACHE_SIZE:
+            _stems.clear()
+        folded = word
+        if not word.isascii():
+            folded = "".join(c for c in unicodedata.normalize("NFKD", word) if not unicodedata.combining(c))
+        stem = _stems[word] = porter.stem(folded) if folded.isascii() else folded
+    return stem
+
+
+def _bm25(highlighted: list, k1: float = 1.2, b: float = 0.75) -> list:
+    """
+    BM25 score of each candidate, with statistics taken from the candidates themselves
+    
+    The index marks the words it matched, so scoring agrees with it on
+    stemming and tokenization; the marked words are only stemmed here to
+    tell the query terms apart.
+    """
+    if not highlighted:
+        return []
+    
+    counts = []
+    for text in highlighted:
+        matched = {}
+        for word in MARKED.findall(text):
+            stem = _stem(word.lower())
+            matched[stem] = matched.get(stem, 0) + 1
+        # Whitespace-separated words: close enough to the token count for length normalization
+        counts.append((text.count(" ") + 1, matched))
+    
+    average = sum(length for length, _ in counts) / len(counts) or 1
+    frequency = Counter(stem for _, matched in counts for stem in matched)
+    idf = {stem: math.log(1 + (len(counts) - n + 0.5) / (n + 0.5)) for stem, n in frequency.items()}
+    return [
+        sum(
+            idf[stem] * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / average))
+            for stem, tf in matched.items()
+        )
+        for length, matched in counts
+    ]
+
+
+class ConnectionManager:
+    """Long-lived, per-thread SQLite connections with WAL and tuned pragmas"""
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._generation = 0
+    
+    def connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.generation != self._generation:
+            conn = self._open()
+            with self._lock:
+                self._connections.append(conn)
+                self._local.conn = conn
+                self._local.generation = self._generation
+        return conn
+    
+    def _open(self) -> sqlite3.Connection:
+        """Open a connection and apply pragmas"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=Config.DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=Config.DB_STATEMENT_CACHE,
+        )
+        # Only takes effect on a new database; lets retention return free pages to the filesystem
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {int(Config.DB_BUSY_TIMEOUT_MS)}")
+        conn.execute(f"PRAGMA cache_size = -{int(Config.DB_CACHE_SIZE_KB)}")
+        conn.execute(f"PRAGMA mmap_size = {int(Config.DB_MMAP_SIZE)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+    
+    def close(self):
+        """Close every connection opened so far (threads reconnect lazily if reused)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+        
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Error closing database connection: {e}")
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class BaseConversationStore(ABC):
+    """
+    Interface shared by the conversation store backends
+    
+    Message ids increase across all users, so they can be compared with the
+    since/before bounds of get_history and the summary_upto marker.
+    """
+    
+    # In-process history cache, if the backend keeps one
+    cache = None
+    
+    @abstractmethod
+    def add_message(self, user_id: str, role: str, content: str, username: str = None) -> int:
+        """
+        Add a message to conversation history
+        
+        Returns:
+            The id of the new message, or None on error
+        """
+    
+    @abstractmethod
+    def get_history(self, user_id: str, limit: int = None, since: int = None, before: int = None,
+                    transform=None, oldest: bool = False) -> list:
+        """
+        Get conversation history for a user, oldest first
+        
+        Args:
+            user_id: Instagram user ID
+            limit: Only return the most recent `limit` messages
+            since: Only return messages with an id greater than this
+            before: Only return messages with an id less than this
+            transform: Optional function applied to each message
+            oldest: Apply `limit` from the oldest matching message instead
+        
+        The returned messages may be shared with a cache and must not be modified.
+        """
+    
+    @abstractmethod
+    def get_summary(self, user_id: str) -> tuple:
+        """
+        Get the rolling summary of older messages
+        
+        Returns:
+            (summary, summary_upto) where summary_upto is the id of the last
+            message the summary covers; ("", 0) if there is none
+        """
+    
+    @abstractmethod
+    def save_summary(self, user_id: str, summary: str, summary_upto: int):
+        """Store the rolling summary covering messages up to summary_upto"""
+    
+    @abstractmethod
+    def clear_history(self, user_id: str):
+        """Clear conversation history for a user"""
+    
+    def search_history(self, user_id: str, query: str, limit: int = 5, before: int = None) -> list:
+        """
+        Find a user's past messages most relevant to `query`
+        
+        Args:
+            user_id: Instagram user ID
+            query: Text to match, usually the new message
+            limit: Maximum messages returned
+            before: Only search messages with an id less than this
+        
+        Returns:
+            Matching messages, oldest first; backends without a search index return []
+        """
+        return []
+    
+    def close(self):
+        """Release connections held by the backend"""
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def create_store(backend: str = None, **kwargs) -> BaseConversationStore:
+    """
+    Create the conversation store selected by Config.STORE_BACKEND
+    
+    Args:
+        backend: "sqlite", "memory" or "redis" (default: from config)
+        **kwargs: Passed to the backend's constructor
+    """
+    backend = (backend or Config.STORE_BACKEND).lower()
+    if backend == "sqlite":
+        return ConversationStore(**kwargs)
+    if backend == "memory":
+        from .memory_store import MemoryConversationStore
+        return MemoryConversationStore(**kwargs)
+    if backend == "redis":
+        from .redis_store import RedisConversationStore
+        return RedisConversationStore(**kwargs)
+    raise ValueError(f"Unknown STORE_BACKEND: {backend} (expected sqlite, memory or redis)")
+
+
+class ConversationStore(BaseConversationStore):
     """Manage conversation history in SQLite database"""
     
-    def __init__(self, db_path: str = None):
+    def __init__(self, db_path: str = None, write_behind: bool = None):
+        """
+        Initialize the store
+        
+        Args:
+            db_path: SQLite database file (default: from config)
+            write_behind: Buffer new messages and write them in batches (default: from config)
+        """
         self.db_path = db_path or Config.DB_PATH
+        self.db = ConnectionManager(self.db_path)
+        self.cache = HistoryCache() if Config.HISTORY_CACHE_MAX_BYTES > 0 else None
+        self.search_enabled = False
         self._initialize_db()
+        if Config.HISTORY_SEARCH:
+            self._initialize_search()
+        
+        self.writer = None
+        if Config.WRITE_BEHIND if write_behind is None else write_behind:
+            self.writer = WriteBehindBuffer(self.db)
+            self.writer.start()
+    
+    def close(self):
+        """Flush buffered messages and close all database connections"""
+        if self.writer is not None:
+            self.writer.close()
+        self.db.close()
     
     def _initialize_db(self):
         """Create database tables if they don't exist"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS conversations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT UNIQUE NOT NULL,
-                    username TEXT,
-                    messages TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            with self.db.connection() as conn:
+                cursor = conn.cursor()
+                
+                # Hold the write lock so concurrent workers don't migrate twice
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS conversations (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id TEXT UNIQUE NOT NULL,
+                        username TEXT,
+                        messages TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
+                # One row per message; conversations.messages is only kept for migration
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS messages (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id TEXT NOT NULL,
+                        role TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        timestamp TEXT NOT NULL
+                    )
+                """)
+                cursor.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages (user_id, id)"
                 )
-            """)
-            
-            conn.commit()
-            conn.close()
+                
+                version = cursor.execute("PRAGMA user_version").fetchone()[0]
+                if version < 1:
+                    self._migrate_message_blobs(cursor)
+                if version < 2:
+                    self._add_summary_columns(cursor)
+                cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
             logger.info(f"✅ Database initialized at {self.db_path}")
         except Exception as e:
             logger.error(f"Error initializing database: {e}")
     
-    def add_message(self, user_id: str, role: str, content: str, username: str = None):
-        """Add a message to conversation history"""
+    def _initialize_search(self):
+        """
+        Keep a full-text index over message content (SQLite FTS5, BM25 ranking)
+        
+        The index reads content from the messages table and is maintained by
+        triggers, so each insert or delete updates it incrementally; history
+        is only scanned once, when the index is first created.
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            message = {
-                "role": role,
-                "content": content,
-                "timestamp": datetime.now().isoformat()
-            }
+            with self.db.connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                exists = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+                ).fetchone()
+                conn.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                        user_id, content, content = 'messages', content_rowid = 'id', tokenize = 'porter unicode61'
+                    )
+                """)
+                conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                        INSERT INTO messages_fts (rowid, user_id, content) VALUES (new.id, new.user_id, new.content);
+                    END
+                """)
+                conn.execute("""
+                    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                        INSERT INTO messages_fts (messages_fts, rowid, user_id, content)
+                        VALUES ('delete', old.id, old.user_id, old.content);
+                    END
+                """)
+                if not exists:
+                    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+                    # One segment: searches read each term's posting list in one piece
+                    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+                    logger.info("✅ Indexed existing messages for history search")
+            self.search_enabled = True
+        except sqlite3.OperationalError as e:
+            # SQLite builds without FTS5
+            logger.warning(f"⚠️ History search disabled: {e}")
+    
+    def _migrate_message_blobs(self, cursor):
+        """Move legacy JSON blobs from conversations.messages into the messages table"""
+        rows = cursor.execute(
+            "SELECT user_id, messages FROM conversations WHERE messages != '[]' ORDER BY id"
+        ).fetchall()
+        
+        migrated = 0
+        for user_id, blob in rows:
+            try:
+                messages = json.loads(blob)
+            except ValueError:
+                logger.warning(f"Skipping unreadable history for user {user_id}")
+                continue
             
-            cursor.execute("SELECT messages FROM conversations WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
+            cursor.executemany(
+                "INSERT INTO messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                [
+                    (user_id, m.get("role", "user"), m.get("content", ""),
+                     m.get("timestamp") or datetime.now().isoformat())
+                    for m in messages
+                ]
+            )
+            cursor.execute("UPDATE conversations SET messages = '[]' WHERE user_id = ?", (user_id,))
+            migrated += len(messages)
+        
+        if migrated:
+            logger.info(f"✅ Migrated {migrated} messages from {len(rows)} conversations")
+    
+    def _add_summary_columns(self, cursor):
+        """Add rolling summary columns to conversations"""
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(conversations)")}
+        if "summary" not in columns:
+            cursor.execute("ALTER TABLE conversations ADD COLUMN summary TEXT")
+        if "summary_upto" not in columns:
+            cursor.execute("ALTER TABLE conversations ADD COLUMN summary_upto INTEGER NOT NULL DEFAULT 0")
+    
+    def add_message(self, user_id: str, role: str, content: str, username: str = None) -> int:
+        """
+        Add a message to conversation history
+        
+        Returns:
+            The id of the new message, or None on error
+        """
+        try:
+            timestamp = datetime.now().isoformat()
+            if self.writer is not None:
+                return self._buffer_message(user_id, role, content, username, timestamp)
             
-            if result:
-                messages = json.loads(result[0])
-                messages.append(message)
-                cursor.execute(
-                    "UPDATE conversations SET messages = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
-                    (json.dumps(messages), user_id)
+            with metrics.DB_SECONDS.time(op="write"), self.db.connection() as conn:
+                cursor = conn.execute(
+                    "INSERT INTO messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                    (user_id, role, content, timestamp)
                 )
-            else:
-                cursor.execute(
-                    "INSERT INTO conversations (user_id, username, messages) VALUES (?, ?, ?)",
-                    (user_id, username, json.dumps([message]))
+                message_id = cursor.lastrowid
+                conn.execute(
+                    """
+                    INSERT INTO conversations (user_id, username, messages) VALUES (?, ?, '[]')
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        username = COALESCE(excluded.username, username),
+                        updated_at = CURRENT_TIMESTAMP
+                    """,
+                    (user_id, username)
                 )
             
-            conn.commit()
-            conn.close()
+            if self.cache is not None:
+                self.cache.append(
+                    user_id, {"id": message_id, "role": role, "content": content, "timestamp": timestamp}
+                )
+            return message_id
         except Exception as e:
+            metrics.ERRORS.inc(component="store")
             logger.error(f"Error adding message: {e}")
+            return None
     
-    def get_history(self, user_id: str) -> list:
-        """Get conversation history for a user"""
+    def get_history(self, user_id: str, limit: int = None, since: int = None, before: int = None,
+                    transform=None, oldest: bool = False) -> list:
+        """
+        Get conversation history for a user, oldest first
+        
+        Args:
+            user_id: Instagram user ID
+            limit: Only return the most recent `limit` messages
+            since: Only return messages with an id greater than this
+            before: Only return messages with an id less than this
+            transform: Optional function applied to each message; results are
+                cached alongside the history so repeated calls are cheap
+            oldest: Apply `limit` from the oldest matching message instead
+                (read from the database: the cache only holds the recent tail)
+        
+        The returned messages may be shared with the cache and must not be modified.
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT messages FROM conversations WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            conn.close()
+            if self.cache is not None and not oldest:
+                cached = self._get_cached_history(user_id, limit, since, before, transform)
+                if cached is not None:
+                    return cached
             
-            if result:
-                return json.loads(result[0])
-            return []
+            history = self._query_history(user_id, limit, since, before, oldest)
+            if transform is not None:
+                return [transform(msg) for msg in history]
+            return history
         except Exception as e:
+            metrics.ERRORS.inc(component="store")
             logger.error(f"Error getting history: {e}")
             return []
     
+    def _buffer_message(self, user_id: str, role: str, content: str, username: str, timestamp: str) -> int:
+        """Hand a message to the write-behind buffer; it is readable right away"""
+        message_id = self.writer.next_id()
+        message = {"id": message_id, "role": role, "content": content, "timestamp": timestamp}
+        self.writer.append({**message, "user_id": user_id, "username": username})
+        if self.cache is not None:
+            self.cache.append(user_id, message)
+        return message_id
+    
+    def _get_cached_history(self, user_id: str, limit, since, before, transform):
+        """Serve a history query from the cache, loading the user's recent tail on a miss"""
+        cached_last_id = self.cache.last_id(user_id)
+        if cached_last_id is not None and Config.HISTORY_CACHE_VALIDATE:
+            # Another process may have written, or retention removed old messages;
+            # max(id) and min(id) are one index probe each
+            with metrics.DB_SECONDS.time(op="read"):
+                row = self.db.connection().execute(
+                    "SELECT (SELECT MAX(id) FROM messages WHERE user_id = ?), "
+                    "(SELECT MIN(id) FROM messages WHERE user_id = ?)",
+                    (user_id, user_id)
+                ).fetchone()
+            latest, oldest = row[0] or 0, row[1]
+            if self.writer is not None:
+                latest = max([latest] + [msg["id"] for msg in self.writer.pending(user_id)])
+            cached_first_id = self.cache.first_id(user_id)
+            if latest != cached_last_id or (oldest is not None and cached_first_id and oldest > cached_first_id):
+                self.cache.invalidate(user_id)
+                cached_last_id = None
+        
+        result = self.cache.get(user_id, limit, since, before, transform)
+        if result is None and cached_last_id is None:
+            tail = self._query_history(user_id, limit=self.cache.max_messages)
+            self.cache.load(user_id, tail, complete=len(tail) < self.cache.max_messages)
+            result = self.cache.get(user_id, limit, since, before, transform, count=False)
+        return result
+    
+    def _query_history(self, user_id: str, limit: int = None, since: int = None, before: int = None,
+                       oldest: bool = False) -> list:
+        """Read messages from the database, oldest first"""
+        query = "SELECT id, role, content, timestamp FROM messages WHERE user_id = ?"
+        params = [user_id]
+        if since is not None:
+            query += " AND id > ?"
+            params.append(since)
+        if before is not None:
+            query += " AND id < ?"
+            params.append(before)
+        query += " ORDER BY id" if oldest else " ORDER BY id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        
+        with metrics.DB_SECONDS.time(op="read"):
+            rows = self.db.connection().execute(query, params).fetchall()
+        
+        history = [
+            {"id": row[0], "role": row[1], "content": row[2], "timestamp": row[3]}
+            for row in (rows if oldest else reversed(rows))
+        ]
+        if self.writer is not None:
+            history = self._with_pending(history, user_id, limit, since, before, oldest)
+        return history
+    
+    def _with_pending(self, history: list, user_id: str, limit, since, before, oldest: bool = False) -> list:
+        """Merge buffered messages that are not written yet into a query result"""
+        pending = [
+            {"id": msg["id"], "role": msg["role"], "content": msg["content"], "timestamp": msg["timestamp"]}
+            for msg in self.writer.pending(user_id)
+            if (since is None or msg["id"] > since) and (before is None or msg["id"] < before)
+        ]
+        if not pending:
+            return history
+        # A batch flushed between the query and now shows up in both
+        merged = {msg["id"]: msg for msg in history}
+        merged.update((msg["id"], msg) for msg in pending)
+        history = [merged[message_id] for message_id in sorted(merged)]
+        if limit is None:
+            return history
+        return history[:limit] if oldest else history[-limit:]
+    
+    def search_history(self, user_id: str, query: str, limit: int = 5, before: int = None) -> list:
+        """
+        Find a user's past messages most relevant to `query`, oldest first
+        
+        The index only supplies the user's most recent matching messages
+        (SEARCH_CANDIDATES of them), with the matched words marked; those are
+        ranked here with BM25 and only the best are read from the messages
+        table. SQLite's bm25() would read every term's whole posting list to
+        compute its statistics, which costs milliseconds for long conversations.
+        """
+        terms = _search_terms(query)
+        if not self.search_enabled or not terms:
+            return []
+        
+        # The user_id column narrows the match to the user's posting lists; the
+        # equality drops other users whose ids share a token ("t1:u1" for "u1")
+        match = f"user_id : {_fts_quote(user_id)} AND ({' OR '.join(_fts_quote(term) for term in terms)})"
+        candidates = (
+            "SELECT rowid, highlight(messages_fts, 1, char(1), char(2)) FROM messages_fts "
+            "WHERE messages_fts MATCH ? AND user_id = ?"
+        )
+        params = [match, user_id]
+        if before is not None:
+            candidates += " AND rowid < ?"
+            params.append(before)
+        candidates += " ORDER BY rowid DESC LIMIT ?"
+        params.append(SEARCH_CANDIDATES)
+        
+        try:
+            with metrics.DB_SECONDS.time(op="search"):
+                conn = self.db.connection()
+                found = conn.execute(candidates, params).fetchall()
+                # Every candidate matched the index; the score only orders them, newer first on ties
+                scored = sorted(
+                    zip(_bm25([text for _, text in found]), found), key=lambda pair: (-pair[0], -pair[1][0])
+                )
+                ids = [rowid for _, (rowid, _) in scored[:limit]]
+                rows = conn.execute(
+                    f"SELECT id, role, content, timestamp FROM messages WHERE id IN ({', '.join('?' * len(ids))}) "
+                    "ORDER BY id",
+                    ids
+                ).fetchall() if ids else []
+        except Exception as e:
+            metrics.ERRORS.inc(component="store")
+            logger.error(f"Error searching history: {e}")
+            return []
+        
+        return [{"id": row[0], "role": row[1], "content": row[2], "timestamp": row[3]} for row in rows]
+    
+    def get_summary(self, user_id: str) -> tuple:
+        """
+        Get the rolling summary of older messages
+        
+        Returns:
+            (summary, summary_upto) where summary_upto is the id of the last
+            message the summary covers; ("", 0) if there is none
+        """
+        try:
+            with metrics.DB_SECONDS.time(op="read"):
+                row = self.db.connection().execute(
+                    "SELECT summary, summary_upto FROM conversations WHERE user_id = ?", (user_id,)
+                ).fetchone()
+            if row:
+                return row[0] or "", row[1] or 0
+            return "", 0
+        except Exception as e:
+            logger.error(f"Error getting summary: {e}")
+            return "", 0
+    
+    def save_summary(self, user_id: str, summary: str, summary_upto: int):
+        """Store the rolling summary covering messages up to summary_upto"""
+        try:
+            with metrics.DB_SECONDS.time(op="write"), self.db.connection() as conn:
+                conn.execute(
+                    "UPDATE conversations SET summary = ?, summary_upto = ? WHERE user_id = ?",
+                    (summary, summary_upto, user_id)
+                )
+        except Exception as e:
+            logger.error(f"Error saving summary: {e}")
+    
     def clear_history(self, user_id: str):
         """Clear conversation history for a user"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
-            conn.commit()
-            conn.close()
+            # Buffered messages have to reach the table before they can be deleted
+            if self.writer is not None:
+                self.writer.flush()
+            with self.db.connection() as conn:
+                conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+                conn.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
+            if self.cache is not None:
+                self.cache.invalidate(user_id)
             logger.info(f"Cleared history for user {user_id}")
         except Exception as e:
             logger.error(f"Error clearing history: {e}")
+
+
+# Explicit name for the default backend
+SQLiteConversationStore = ConversationStore
@@ -0,0 +1,173 @@
+"""Webhook event deduplication"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from .config import Config
+from .conversation_store import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+# Expired keys are purged from SQLite once per this many new events
+PURGE_EVERY = 1000
+
+
+class EventDeduplicator:
+    """
+    Drop webhook events Meta has already delivered
+    
+    The webhook request only checks recently seen keys in an in-memory LRU
+    (seen). Keys are recorded in a SQLite table with TTL expiry from the
+    worker that processes the event (record), which catches redeliveries
+    across restarts and worker processes without a write on the request path.
+    """
+    
+    def __init__(self, db_path: str = None, ttl: float = None, capacity: int = None):
+        """
+        Initialize the deduplicator
+        
+        Args:
+            db_path: SQLite database for seen event keys (default: from config)
+            ttl: Seconds an event key is remembered
+            capacity: Maximum keys kept in memory
+        """
+        self.db = ConnectionManager(db_path or Config.DB_PATH)
+        self.ttl = ttl or Config.DEDUP_TTL
+        self.capacity = capacity or Config.DEDUP_CACHE_SIZE
+        
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self.duplicates = 0
+        
+        self._initialize_db()
+    
+    def _initialize_db(self):
+        """Create the seen events table"""
+        try:
+            with self.db.connection() as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS processed_events (
+                        event_key TEXT PRIMARY KEY,
+                        seen_at REAL NOT NULL
+                    ) WITHOUT ROWID
+                """)
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_processed_events_seen_at ON processed_events (seen_at)"
+                )
+        except Exception as e:
+            logger.error(f"Error initializing dedup table: {e}")
+    
+    @staticmethod
+    def event_key(messaging_event: dict) -> str:
+        """Identify an event by message mid, falling back to sender and timestamp"""
+        for field in ("message", "postback", "reaction"):
+            mid = (messaging_event.get(field) or {}).get("mid")
+            if mid:
+                return mid
+        
+        sender_id = messaging_event.get("sender", {}).get("id")
+        timestamp = messaging_event.get("timestamp")
+        if sender_id and timestamp:
+            return f"{sender_id}:{timestamp}"
+        return None
+    
+    def seen(self, key: str) -> bool:
+        """
+        Check and remember an event key in memory
+        
+        Returns:
+            True if this process saw the key within the TTL (a redelivery)
+        """
+        if key is None:
+            return False
+        
+        now = time.time()
+        with self._lock:
+            seen_at = self._recent.get(key)
+            if seen_at is not None and now - seen_at < self.ttl:
+                self._recent.move_to_end(key)
+                self.duplicates += 1
+                return True
+            
+            self._recent[key] = now
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.capacity:
+                self._recent.popitem(last=False)
+        return False
+    
+    def record(self, key: str) -> bool:
+        """
+        Record an event key in the database before the event is processed
+        
+        Returns:
+            True if the key was recorded within the TTL by another process or
+            before a restart (a redelivery)
+        """
+        if key is None:
+            return False
+        
+        now = time.time()
+        try:
+            with self.db.connection() as conn:
+                # Inserts a new key or revives an expired one; no-op for a live duplicate
+                cursor = conn.execute(
+                    """
+                    INSERT INTO processed_events (event_key, seen_at) VALUES (?, ?)
+                    ON CONFLICT(event_key) DO UPDATE SET seen_at = excluded.seen_at
+                    WHERE seen_at < ?
+                    """,
+                    (key, now, now - self.ttl)
+                )
+            duplicate = cursor.rowcount == 0
+        except Exception as e:
+            # Processing twice beats dropping a message
+            logger.error(f"Error checking event {key}: {e}")
+            duplicate = False
+        
+        purge = False
+        with self._lock:
+            if duplicate:
+                self.duplicates += 1
+            else:
+                self._inserts += 1
+                purge = self._inserts % PURGE_EVERY == 0
+        
+        if purge:
+            self._purge(now)
+        return duplicate
+    
+    def forget(self, key: str):
+        """Un-remember a key whose event could not be queued, so a redelivery is accepted"""
+        if key is None:
+            return
+        # Queued events are recorded in the database only when a worker picks them up
+        with self._lock:
+            self._recent.pop(key, None)
+    
+    def _purge(self, now: float):
+        """Delete expired keys in one bounded batch"""
+        try:
+            with self.db.connection() as conn:
+                conn.execute(
+                    """
+                    DELETE FROM processed_events WHERE event_key IN (
+                        SELECT event_key FROM processed_events WHERE seen_at < ? LIMIT ?
+                    )
+                    """,
+                    (now - self.ttl, PURGE_EVERY * 2)
+                )
+        except Exception as e:
+            logger.error(f"Error purging dedup table: {e}")
+    
+    def stats(self) -> dict:
+        """Redelivery counters"""
+        with self._lock:
+            return {
+                "duplicates_dropped": self.duplicates,
+                "tracked_in_memory": len(self._recent),
+            }
+    
+    def close(self):
+        """Close database connections"""
+        self.db.close()
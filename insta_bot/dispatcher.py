@@ -0,0 +1,171 @@
+"""Background worker pool for processing webhook events off the request path"""
+import logging
+import queue
+import threading
+import time
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Sentinel telling a worker thread to exit
+_STOP = object()
+
+
+class MessageDispatcher:
+    """Bounded in-process job queue drained by a pool of worker threads"""
+    
+    def __init__(self, workers: int = None, max_queue_size: int = None, name: str = "insta-bot-worker"):
+        """
+        Initialize the dispatcher
+        
+        Args:
+            workers: Number of worker threads (default: from config)
+            max_queue_size: Maximum number of queued jobs before submit() rejects
+            name: Prefix for worker thread names
+        """
+        self.workers = workers or Config.WORKER_THREADS
+        self.max_queue_size = max_queue_size if max_queue_size is not None else Config.WORKER_QUEUE_SIZE
+        self.name = name
+        
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._accepting = False
+        self._busy = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._failed = 0
+        self._max_depth = 0
+        self._max_wait = 0.0
+        self._total_wait = 0.0
+    
+    def start(self):
+        """Start the worker threads"""
+        with self._lock:
+            if self._accepting:
+                return
+            self._accepting = True
+        
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        
+        logger.info(f"✅ Dispatcher started with {self.workers} workers (queue size {self.max_queue_size})")
+    
+    def submit(self, fn, *args) -> bool:
+        """
+        Queue a job for a worker thread
+        
+        Returns:
+            True if the job was queued, False if the queue is full or shutting down
+        """
+        if not self._accepting:
+            with self._lock:
+                self._rejected += 1
+            return False
+        
+        try:
+            self._queue.put_nowait((fn, args, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            logger.warning(f"⚠️ Dispatcher queue full ({self.max_queue_size}), rejecting job")
+            return False
+        
+        with self._lock:
+            self._submitted += 1
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+        return True
+    
+    def _run(self):
+        """Worker loop"""
+        while True:
+            job = self._queue.get()
+            try:
+                if job is _STOP:
+                    return
+                
+                fn, args, enqueued_at = job
+                waited = time.monotonic() - enqueued_at
+                with self._lock:
+                    self._busy += 1
+                    self._total_wait += waited
+                    self._max_wait = max(self._max_wait, waited)
+                
+                try:
+                    fn(*args)
+                    with self._lock:
+                        self._completed += 1
+                except Exception as e:
+                    with self._lock:
+                        self._failed += 1
+                    logger.error(f"Error in dispatcher job: {e}")
+                finally:
+                    with self._lock:
+                        self._busy -= 1
+            finally:
+                self._queue.task_done()
+    
+    def stats(self) -> dict:
+        """Queue depth and backpressure counters"""
+        with self._lock:
+            started = self._completed + self._failed + self._busy
+            return {
+                "workers": self.workers,
+                "busy_workers": self._busy,
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self.max_queue_size,
+                "max_queue_depth": self._max_depth,
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_wait_ms": round(self._total_wait / started * 1000, 2) if started else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 2),
+            }
+    
+    def shutdown(self, drain: bool = True, timeout: float = None):
+        """
+        Stop accepting jobs and stop the workers
+        
+        Args:
+            drain: Finish queued jobs before stopping (otherwise they are discarded)
+            timeout: Maximum seconds to wait for the workers (default: from config)
+        """
+        with self._lock:
+            if not self._accepting:
+                return
+            self._accepting = False
+        
+        timeout = Config.SHUTDOWN_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        
+        if not drain:
+            discarded = 0
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._queue.task_done()
+                discarded += 1
+            if discarded:
+                logger.warning(f"⚠️ Discarded {discarded} queued jobs on shutdown")
+        
+        for _ in self._threads:
+            try:
+                self._queue.put(_STOP, timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Full:
+                break
+        
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        
+        alive = [t for t in self._threads if t.is_alive()]
+        if alive:
+            logger.warning(f"⚠️ {len(alive)} workers still busy after {timeout}s shutdown timeout")
+        else:
+            logger.info("✅ Dispatcher drained and stopped")
+        self._threads = alive
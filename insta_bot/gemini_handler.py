@@ -1,16 +1,173 @@
 """Gemini AI handler for generating responses"""
-import google.generativeai as genai
+import asyncio
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from .config import Config
-from .conversation_store import ConversationStore
+from .chat_sessions import ChatSessionPool, PooledSession, turn_text
+from .chunking import MAX_REPLY_LENGTH, ReplyChunker, strip_prefixes, truncate
+from . import metrics, resilience
+from .context_window import ContextWindow, estimate_tokens
+from .conversation_store import BaseConversationStore, create_store
+from .profile_cache import ProfileCache
+from .reply_cache import ReplyCache, namespace_for
 
 logger = logging.getLogger(__name__)
 
+FALLBACK_REPLY = "Sorry, I couldn't generate a response right now. Try again!"
+
+# Recalled older messages are cut to this length so they can't crowd out the recent tail
+RECALL_MAX_CHARS = 500
+
+
+def _record_tokens(response, chat_history: list, prompt: str, reply: str):
+    """Record token counts, from Gemini's usage metadata when it is available"""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    response_tokens = getattr(usage, "candidates_token_count", None)
+    if not prompt_tokens:
+        prompt_tokens = estimate_tokens(prompt) + sum(estimate_tokens(turn_text(turn)) for turn in chat_history)
+    if not response_tokens:
+        response_tokens = estimate_tokens(reply)
+    metrics.PROMPT_TOKENS.observe(prompt_tokens)
+    metrics.RESPONSE_TOKENS.observe(response_tokens)
+    
+    cached_tokens = getattr(usage, "cached_content_token_count", None)
+    if cached_tokens:
+        metrics.CACHED_PROMPT_TOKENS.observe(cached_tokens)
+
+
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 500,
+}
+
+# (model name, system instruction) -> monotonic time its context cache must be renewed
+_context_caches = {}
+# One renewal at a time per key; concurrent requests keep using the current model
+_renewal_locks = {}
+_renewal_locks_lock = threading.Lock()
+
+
+def _renewal_lock(key: tuple) -> threading.Lock:
+    with _renewal_locks_lock:
+        return _renewal_locks.setdefault(key, threading.Lock())
+
+
+def _build_model(model_name: str, system_instruction: str = None):
+    """
+    Create a GenerativeModel with the persona as its system instruction
+    
+    With GEMINI_CONTEXT_CACHE, long system instructions are stored in a
+    server-side context cache, so their tokens aren't billed in full on
+    every request.
+    """
+    # Imported on first use: the SDK takes most of the package's import time
+    import google.generativeai as genai
+    genai.configure(api_key=Config.GEMINI_API_KEY)
+    
+    if system_instruction and Config.GEMINI_CONTEXT_CACHE \
+            and estimate_tokens(system_instruction) >= Config.GEMINI_CONTEXT_CACHE_MIN_TOKENS:
+        key = (model_name, system_instruction)
+        try:
+            cached = genai.caching.CachedContent.create(
+                model=model_name,
+                system_instruction=system_instruction,
+                ttl=timedelta(seconds=Config.GEMINI_CONTEXT_CACHE_TTL),
+            )
+            # Renewed a little before the cache expires
+            _context_caches[key] = time.monotonic() + Config.GEMINI_CONTEXT_CACHE_TTL * 0.9
+            logger.info(f"✅ System instruction cached for {model_name}")
+            return genai.GenerativeModel.from_cached_content(cached, generation_config=GENERATION_CONFIG)
+        except Exception as e:
+            # Models without caching support, or an instruction below the model's minimum size.
+            # The uncached model is kept until the next renewal instead of retrying every request
+            _context_caches[key] = time.monotonic() + Config.GEMINI_CONTEXT_CACHE_TTL * 0.9
+            logger.warning(f"⚠️ Context caching unavailable for {model_name}: {e}")
+    
+    return genai.GenerativeModel(
+        model_name=model_name,
+        generation_config=GENERATION_CONFIG,
+        system_instruction=system_instruction,
+    )
+
+
+def _to_contents(history: list) -> list:
+    """Chat turns as the SDK's Content objects, which start_chat takes without converting again"""
+    from google.generativeai.types import content_types
+    return content_types.to_contents(history)
+
+
+def _upload_media(path: str, mime_type: str):
+    """Upload a file through the File API and wait until the model can read it"""
+    import google.generativeai as genai
+    genai.configure(api_key=Config.GEMINI_API_KEY)
+    
+    upload = genai.upload_file(path, mime_type=mime_type)
+    # Video and audio are processed server-side before they can be used
+    deadline = time.monotonic() + Config.ATTACHMENT_PROCESSING_TIMEOUT
+    while upload.state.name == "PROCESSING":
+        if time.monotonic() >= deadline:
+            _delete_upload(upload)
+            raise TimeoutError(f"{upload.name} was not processed within {Config.ATTACHMENT_PROCESSING_TIMEOUT}s")
+        time.sleep(1)
+        upload = genai.get_file(upload.name)
+    if upload.state.name != "ACTIVE":
+        _delete_upload(upload)
+        raise RuntimeError(f"{upload.name} could not be processed ({upload.state.name})")
+    return upload
+
+
+def _delete_upload(upload):
+    """Delete an uploaded file now rather than leave it for the File API's expiry"""
+    import google.generativeai as genai
+    try:
+        genai.delete_file(upload.name)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not delete uploaded file {upload.name}: {e}")
+
+
+def _describe_profile(profile: dict) -> str:
+    """What the model is told about the user, from their cached profile"""
+    if not profile:
+        return ""
+    lines = []
+    if profile.get("name"):
+        lines.append(f"Name: {profile['name']}")
+    if profile.get("username"):
+        lines.append(f"Instagram username: @{profile['username']}")
+    return "\n".join(lines)
+
+
+def _recall_turns(recalled: list) -> list:
+    """The chat turns presenting recalled older messages to the model"""
+    lines = "\n".join(
+        f"{'User' if m['role'] == 'user' else 'You'} ({m['timestamp'][:10]}): {m['content'][:RECALL_MAX_CHARS]}"
+        for m in recalled
+    )
+    return [
+        {"role": "user", "parts": [f"[RELEVANT EARLIER MESSAGES]\n{lines}\n[END RELEVANT MESSAGES]"]},
+        {"role": "model", "parts": ["Got it."]},
+    ]
+
+
+def _with_gemini_format(msg: dict) -> tuple:
+    """Pair a stored message with its Gemini chat format (cached by the store)"""
+    role = "user" if msg["role"] == "user" else "model"
+    return msg, {"role": role, "parts": [msg["content"]]}
+
 
 class GeminiHandler:
     """Handle Gemini AI interactions"""
     
-    def __init__(self, system_prompt: str = None, model: str = None, conversation_store: ConversationStore = None):
+    def __init__(self, system_prompt: str = None, model: str = None, conversation_store: BaseConversationStore = None,
+                 context_window: ContextWindow = None, reply_cache: ReplyCache = None, models: dict = None,
+                 summary_executor: ThreadPoolExecutor = None, fallback_models: list = None,
+                 sessions: ChatSessionPool = None, profiles: ProfileCache = None):
         """
         Initialize Gemini handler
         
@@ -18,84 +175,588 @@ class GeminiHandler:
             system_prompt: Custom system prompt (instructions for the bot)
             model: Gemini model to use (default: from config)
             conversation_store: Conversation store instance
+            context_window: Limits on how much history is sent per reply
+            reply_cache: Cache for repeated questions (default: enabled by REPLY_CACHE_ENABLED)
+            models: GenerativeModels by (name, system instruction) to share; missing ones are created and added
+            summary_executor: Shared executor for summary refreshes (default: a private thread)
+            fallback_models: Models tried in order when `model` fails (default: from config)
+            sessions: Pool of chat sessions reused across turns (default: enabled by CHAT_SESSION_POOL_SIZE)
+            profiles: Cache of senders' names and usernames, used to personalize replies
         """
         self.api_key = Config.GEMINI_API_KEY
         self.model_name = model or Config.GEMINI_MODEL
+        self.fallback_models = Config.GEMINI_FALLBACK_MODELS if fallback_models is None else fallback_models
         self.system_prompt = system_prompt or Config.BOT_INSTRUCTIONS
-        self.conversation_store = conversation_store or ConversationStore()
-        
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel(
-            model_name=self.model_name,
-            generation_config={
-                "temperature": 0.7,
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": 500,
-            },
+        self.conversation_store = conversation_store or create_store()
+        self.context_window = context_window or ContextWindow()
+        
+        # Cached replies are only valid for the persona that produced them
+        if reply_cache is None and Config.REPLY_CACHE_ENABLED:
+            reply_cache = ReplyCache()
+        self.reply_cache = reply_cache
+        self.cache_namespace = namespace_for(self.model_name, self.system_prompt)
+        
+        # Summaries are refreshed off the reply path, one at a time per user
+        self._owns_executor = summary_executor is None
+        self._summary_executor = summary_executor or ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="insta-bot-summary"
         )
+        self._summarizing = set()
+        self._summary_lock = threading.Lock()
+        
+        # Models are created on first use, keeping construction (and worker boot) cheap
+        self.models = {} if models is None else models
+        
+        # Live chat sessions skip rebuilding and re-converting the history every turn
+        if sessions is None and Config.CHAT_SESSION_POOL_SIZE > 0:
+            sessions = ChatSessionPool()
+        self.sessions = sessions
+        self.profiles = profiles
+        
         logger.info(f"✅ Gemini initialized with model: {self.model_name}")
     
-    def _build_chat_history(self, user_id: str) -> list:
-        """Build chat history in Gemini format"""
-        history = self.conversation_store.get_history(user_id)
+    @property
+    def model(self):
+        """GenerativeModel for `model_name` with this persona, created on first use"""
+        return self._get_model(self.model_name)
+    
+    @model.setter
+    def model(self, generative_model):
+        self.models[(self.model_name, self.system_prompt)] = generative_model
+    
+    def _get_model(self, model_name: str, persona: bool = True):
+        """The model by name, with the system prompt as its instruction (persona) or without"""
+        key = (model_name, self.system_prompt if persona else None)
+        model = self.models.get(key)
+        if model is None or _context_caches.get(key, float("inf")) <= time.monotonic():
+            # New, or its context cache is about to expire
+            lock = _renewal_lock(key)
+            if model is not None and not lock.acquire(blocking=False):
+                # Another request is renewing it; the current cache is still valid for a while
+                return model
+            if model is None:
+                lock.acquire()
+            try:
+                model = self.models.get(key)
+                if model is None or _context_caches.get(key, float("inf")) <= time.monotonic():
+                    model = _build_model(*key)
+                    self.models[key] = model
+            finally:
+                lock.release()
+        return model
+    
+    def _model_chain(self, hedge: bool):
+        """
+        Yield (upstream, timeout, hedge_after) for each model to try, in order
+        
+        Models whose circuit is open are skipped, and the chain stops at
+        GEMINI_DEADLINE. Every yielded attempt must be recorded on its upstream,
+        including one that fails while the model is being built.
+        """
+        deadline = time.monotonic() + Config.GEMINI_DEADLINE
+        for model_name in [self.model_name] + self.fallback_models:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            upstream = resilience.get_upstream(model_name)
+            if not upstream.breaker.allow():
+                continue
+            
+            hedge_after = None
+            if hedge and Config.GEMINI_HEDGE:
+                hedge_after = upstream.latency.quantile(Config.GEMINI_HEDGE_QUANTILE)
+            yield upstream, min(Config.GEMINI_TIMEOUT, remaining), hedge_after
+    
+    def _model_failed(self, upstream: resilience.Upstream, error: Exception):
+        upstream.record_failure()
+        metrics.GEMINI_FAILURES.inc(model=upstream.name)
+        logger.warning(f"⚠️ {upstream.name} failed: {error}")
+    
+    def _model_answered(self, upstream: resilience.Upstream, seconds: float):
+        upstream.record_success(seconds)
+        if upstream.name != self.model_name:
+            logger.info(f"↪️ Answered by fallback model {upstream.name}")
+    
+    def _call_model(self, call, hedge: bool = True, persona: bool = True):
+        """
+        Run call(model, timeout) against the main model, then the fallbacks
+        
+        Each model gets GEMINI_TIMEOUT seconds (and, with GEMINI_HEDGE, a second
+        attempt once it is slower than its recent p95). With `persona`, the
+        models carry the system prompt as their system instruction.
+        
+        Returns:
+            The first successful response
+        """
+        error = None
+        for upstream, timeout, hedge_after in self._model_chain(hedge):
+            try:
+                model = self._get_model(upstream.name, persona)
+                start = time.monotonic()
+                response = resilience.call_with_deadline(
+                    lambda: call(model, timeout), timeout, hedge_after, upstream.name
+                )
+            except Exception as e:
+                self._model_failed(upstream, e)
+                error = e
+                continue
+            self._model_answered(upstream, time.monotonic() - start)
+            return response
+        
+        raise error or resilience.CircuitOpenError("No Gemini model is available")
+    
+    async def _call_model_async(self, call, hedge: bool = True):
+        """Like _call_model, for call(model, timeout) returning an awaitable"""
+        error = None
+        for upstream, timeout, hedge_after in self._model_chain(hedge):
+            try:
+                model = self._get_model(upstream.name)
+                start = time.monotonic()
+                response = await resilience.call_with_deadline_async(
+                    lambda: call(model, timeout), timeout, hedge_after, upstream.name
+                )
+            except Exception as e:
+                self._model_failed(upstream, e)
+                error = e
+                continue
+            self._model_answered(upstream, time.monotonic() - start)
+            return response
+        
+        raise error or resilience.CircuitOpenError("No Gemini model is available")
+    
+    def _build_chat_history(self, user_id: str, before: int = None, query: str = None, headroom: int = 0,
+                            profile: dict = None) -> tuple:
+        """
+        Build chat history in Gemini format
+        
+        Only the recent tail that fits the context window is sent; older
+        messages are represented by the stored rolling summary and, with
+        HISTORY_SEARCH, by the older messages most relevant to `query`.
+        
+        Args:
+            headroom: Messages left free in a full window, so a pooled session
+                built from it can take a few exchanges before it is rebuilt
+            profile: The user's name and username, added ahead of the history
+        
+        Returns:
+            (gemini_history, number of conversation messages in it, id bound
+            of the recall search or None if there was none, whether recall
+            turns were added)
+        """
+        rows = self.conversation_store.get_history(
+            user_id, limit=self.context_window.max_messages, before=before, transform=_with_gemini_format
+        )
+        history = [msg for msg, _ in rows]
+        recent = self.context_window.fit(history)
+        summary, summary_upto = self.conversation_store.get_summary(user_id)
+        
+        # Some messages are outside the window: keep the summary up to date
+        recalled = []
+        recall_before = None
+        if len(recent) < len(history) or len(history) == self.context_window.max_messages:
+            if headroom:
+                recent = recent[min(headroom, max(len(recent) - 2, 0)):]
+                while recent and recent[0]["role"] != "user":
+                    recent.pop(0)
+            window_start = recent[0]["id"] if recent else before
+            self._schedule_summary(user_id, summary, summary_upto, window_start)
+            if query and Config.HISTORY_SEARCH_TOP_K > 0 and window_start is not None:
+                recall_before = window_start
+                recalled = self._recall(user_id, query, window_start)
+        
         gemini_history = []
+        about = _describe_profile(profile)
+        if about:
+            gemini_history.append({"role": "user", "parts": [f"[ABOUT THE USER]\n{about}\n[END ABOUT THE USER]"]})
+            gemini_history.append({"role": "model", "parts": ["Got it."]})
         
-        for msg in history:
-            role = "user" if msg["role"] == "user" else "model"
+        if summary:
             gemini_history.append({
-                "role": role,
-                "parts": [msg["content"]]
+                "role": "user",
+                "parts": [f"[SUMMARY OF EARLIER CONVERSATION]\n{summary}\n[END SUMMARY]"]
             })
+            gemini_history.append({"role": "model", "parts": ["Got it."]})
+        
+        if recalled:
+            gemini_history.extend(_recall_turns(recalled))
+        
+        # fit() keeps a suffix of the history, so reuse the matching formatted messages
+        gemini_history.extend(formatted for _, formatted in rows[len(rows) - len(recent):])
+        
+        return gemini_history, len(recent), recall_before, bool(recalled)
+    
+    def _recall(self, user_id: str, query: str, before: int) -> list:
+        """Older messages relevant to `query`, from those stored before `before`"""
+        return self.conversation_store.search_history(user_id, query, limit=Config.HISTORY_SEARCH_TOP_K, before=before)
+    
+    def _schedule_summary(self, user_id: str, summary: str, summary_upto: int, window_start: int):
+        """Refresh the rolling summary in the background once enough messages aged out"""
+        if not self.context_window.summary_every or window_start is None:
+            return
+        
+        with self._summary_lock:
+            if user_id in self._summarizing:
+                return
+            self._summarizing.add(user_id)
+        
+        aged_out = self._aged_out(user_id, summary_upto, window_start)
+        if not self.context_window.needs_summary(len(aged_out)):
+            with self._summary_lock:
+                self._summarizing.discard(user_id)
+            return
         
-        return gemini_history
+        self._summary_executor.submit(self._refresh_summary, user_id, summary, aged_out, window_start)
+    
+    def _aged_out(self, user_id: str, summary_upto: int, window_start: int) -> list:
+        """The oldest messages not in the summary yet, at most SUMMARY_MAX_MESSAGES"""
+        return self.conversation_store.get_history(
+            user_id, limit=Config.SUMMARY_MAX_MESSAGES, since=summary_upto, before=window_start, oldest=True
+        )
+    
+    def _refresh_summary(self, user_id: str, summary: str, messages: list, window_start: int):
+        """
+        Fold aged-out messages into the rolling summary, oldest first, and store it
+        
+        A conversation far behind (after an import, or while summaries were
+        off) is folded one batch at a time until it has caught up.
+        """
+        try:
+            while self.context_window.needs_summary(len(messages)):
+                transcript = "\n".join(
+                    f"{'User' if m['role'] == 'user' else 'You'}: {m['content']}" for m in messages
+                )
+                prompt = (
+                    "Update the summary of this Instagram DM conversation. Keep names, facts, "
+                    "preferences and open questions; drop small talk. Answer with the summary only.\n\n"
+                    f"Current summary:\n{summary or '(none)'}\n\n"
+                    f"New messages:\n{transcript}"
+                )
+                with metrics.GEMINI_SECONDS.time(kind="summary"):
+                    # Summaries are off the reply path: no point hedging them
+                    response = self._call_model(
+                        lambda model, timeout: model.generate_content(
+                            prompt,
+                            generation_config={"max_output_tokens": Config.SUMMARY_MAX_TOKENS},
+                            request_options={"timeout": timeout},
+                        ),
+                        hedge=False,
+                        persona=False,
+                    )
+                # The summary covers exactly up to the last message folded in
+                summary, summary_upto = response.text.strip(), messages[-1]["id"]
+                self.conversation_store.save_summary(user_id, summary, summary_upto)
+                logger.info(f"📝 Summarized {len(messages)} older messages for {user_id}")
+                messages = self._aged_out(user_id, summary_upto, window_start)
+        except Exception as e:
+            metrics.ERRORS.inc(component="summary")
+            logger.error(f"Error refreshing summary: {e}")
+        finally:
+            with self._summary_lock:
+                self._summarizing.discard(user_id)
+    
+    def describe_media(self, prompt: str, mime_type: str, data: bytes = None, path: str = None) -> str:
+        """
+        Describe an attachment with the model, from its bytes or a file
+        
+        Bytes are sent inline with the request; a file (larger attachments)
+        is uploaded through the File API and deleted afterwards.
+        
+        Returns:
+            The model's description
+        """
+        upload = None
+        try:
+            if data is not None:
+                media = {"mime_type": mime_type, "data": data}
+            else:
+                upload = media = _upload_media(path, mime_type)
+            with metrics.GEMINI_SECONDS.time(kind="attachment"):
+                response = self._call_model(
+                    lambda model, timeout: model.generate_content(
+                        [media, prompt],
+                        generation_config={"max_output_tokens": Config.ATTACHMENT_DESCRIPTION_TOKENS},
+                        request_options={"timeout": timeout},
+                    ),
+                    hedge=False,
+                    persona=False,
+                )
+            return response.text.strip()
+        finally:
+            if upload is not None:
+                _delete_upload(upload)
+    
+    def close(self):
+        """Wait for pending background summaries"""
+        if self._owns_executor:
+            self._summary_executor.shutdown(wait=True)
+    
+    def _prepare(self, user_id: str, user_message: str) -> tuple:
+        """
+        Store the user's message and build what the model needs to answer it
+        
+        The system prompt is the model's system instruction, so the message
+        is sent as is and the persona stays in context however long the
+        conversation gets.
+        
+        Returns:
+            (chat_history, cacheable, session); session is the pooled chat
+            session to extend with the reply, or None without a pool
+        """
+        # Prefetched in the background; the username is stored with the conversation
+        profile = self.profiles.get(user_id) if self.profiles is not None else None
+        
+        # Save user message
+        message_id = self.conversation_store.add_message(
+            user_id, "user", user_message, username=profile.get("username") if profile else None
+        )
+        
+        # Only the stored conversation counts: the profile preamble is not part of it
+        previous = []
+        if self.reply_cache is not None or self.sessions is not None:
+            previous = self.conversation_store.get_history(
+                user_id, limit=max(Config.REPLY_CACHE_MAX_HISTORY, 0) + 1, before=message_id
+            )
+        
+        # Answers to standalone questions don't depend on the conversation so far. They are
+        # served to every user, so they are generated without this user's profile
+        cacheable = self.reply_cache is not None and len(previous) <= Config.REPLY_CACHE_MAX_HISTORY
+        if cacheable:
+            profile = None
+        
+        session = self._checkout_session(user_id, previous) if self.sessions is not None else None
+        if session is not None and session.personalized != (profile is not None):
+            # The profile arrived after the session was built, or this turn is answered without it
+            session = None
+        if session is not None and session.recall_before is not None:
+            # What is relevant depends on the new message: search again
+            recalled = self._recall(user_id, user_message, session.recall_before)
+            if recalled and session.recalled:
+                session.replace_recall(_recall_turns(recalled))
+            elif recalled or session.recalled:
+                # Recall turns would have to be added or removed
+                session = None
+        if session is not None:
+            chat_history = session.history
+        else:
+            # Get recent conversation history, excluding the message we just added
+            chat_history, messages, recall_before, recalled = self._build_chat_history(
+                user_id, before=message_id, query=user_message,
+                headroom=Config.CHAT_SESSION_HEADROOM if self.sessions is not None else 0, profile=profile
+            )
+            if self.sessions is not None:
+                # Converted to the SDK's format once, then reused while the session lives
+                session = PooledSession(chat_history, messages, convert=_to_contents)
+                session.personalized = profile is not None
+                session.recall_before = recall_before
+                session.recalled = recalled
+                chat_history = session.history
+        
+        return chat_history, cacheable, session
+    
+    def _checkout_session(self, user_id: str, previous: list) -> PooledSession:
+        """The user's pooled session, if it holds everything up to the `previous` messages"""
+        return self.sessions.checkout(
+            user_id,
+            previous[-1]["id"] if previous else None,
+            self.context_window.max_messages,
+            self.context_window.max_tokens,
+        )
+    
+    def _cached_reply(self, user_id: str, user_message: str) -> str:
+        """Return and store a cached reply, or None"""
+        cached = self.reply_cache.lookup(self.cache_namespace, user_message)
+        if cached is not None:
+            self.conversation_store.add_message(user_id, "assistant", cached)
+        return cached
     
     def generate_reply(self, user_id: str, user_message: str) -> str:
         """Generate a reply to the user's message"""
         try:
-            # Save user message
-            self.conversation_store.add_message(user_id, "user", user_message)
+            chat_history, cacheable, session = self._prepare(user_id, user_message)
             
-            # Get conversation history
-            chat_history = self._build_chat_history(user_id)
+            if cacheable:
+                cached = self._cached_reply(user_id, user_message)
+                if cached is not None:
+                    return cached
             
-            # Remove last message (we just added it) for context window
-            if chat_history:
-                chat_history = chat_history[:-1]
+            # Generate response; each attempt gets its own chat session
+            with metrics.GEMINI_SECONDS.time(kind="reply"):
+                response = self._call_model(
+                    lambda model, timeout: model.start_chat(history=chat_history).send_message(
+                        user_message, request_options={"timeout": timeout}
+                    )
+                )
+            return self._finish_reply(user_id, user_message, response, chat_history, cacheable, session)
             
-            # Start chat session
-            chat = self.model.start_chat(history=chat_history)
+        except Exception as e:
+            metrics.ERRORS.inc(component="gemini")
+            metrics.FALLBACK_REPLIES.inc()
+            logger.error(f"Error generating reply: {e}")
+            return FALLBACK_REPLY
+    
+    async def generate_reply_async(self, user_id: str, user_message: str) -> str:
+        """
+        Generate a reply without blocking the event loop
+        
+        Gemini is called through the SDK's async API; conversation store work
+        runs in the loop's default thread pool.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            chat_history, cacheable, session = await loop.run_in_executor(None, self._prepare, user_id, user_message)
             
-            # Build prompt with system instructions
-            if not chat_history:
-                prompt = (
-                    f"[SYSTEM INSTRUCTIONS]\n"
-                    f"{self.system_prompt}\n"
-                    f"[END SYSTEM INSTRUCTIONS]\n\n"
-                    f"User message: {user_message}"
+            if cacheable:
+                cached = await loop.run_in_executor(None, self._cached_reply, user_id, user_message)
+                if cached is not None:
+                    return cached
+            
+            with metrics.GEMINI_SECONDS.time(kind="reply"):
+                response = await self._call_model_async(
+                    lambda model, timeout: model.start_chat(history=chat_history).send_message_async(
+                        user_message, request_options={"timeout": timeout}
+                    )
                 )
-            else:
-                prompt = user_message
+            return await loop.run_in_executor(
+                None, self._finish_reply, user_id, user_message, response, chat_history, cacheable, session
+            )
             
-            # Generate response
-            response = chat.send_message(prompt)
-            reply = response.text.strip()
+        except Exception as e:
+            metrics.ERRORS.inc(component="gemini")
+            metrics.FALLBACK_REPLIES.inc()
+            logger.error(f"Error generating reply: {e}")
+            return FALLBACK_REPLY
+    
+    def _finish_reply(self, user_id: str, user_message: str, response, chat_history: list, cacheable: bool,
+                      session: PooledSession = None) -> str:
+        """Clean up, store and cache a generated reply"""
+        reply = truncate(strip_prefixes(response.text.strip()))
+        _record_tokens(response, chat_history, user_message, reply)
+        
+        # Save bot response
+        reply_id = self.conversation_store.add_message(user_id, "assistant", reply)
+        self._keep_session(user_id, session, user_message, reply, reply_id)
+        
+        if cacheable:
+            self.reply_cache.store(self.cache_namespace, user_message, reply)
+        
+        return reply
+    
+    def _keep_session(self, user_id: str, session: PooledSession, user_message: str, reply: str, reply_id: int):
+        """Return a session to the pool with the exchange that was just stored"""
+        if session is None or reply_id is None:
+            return
+        session.append(user_message, reply, reply_id)
+        self.sessions.store(user_id, session)
+    
+    def stream_reply(self, user_id: str, user_message: str):
+        """
+        Generate a reply as a stream of messages
+        
+        Yields each message as soon as a sentence boundary is reached, so the
+        first part can be sent while the rest is still being generated. The
+        full reply is stored once the stream ends.
+        """
+        sent = []
+        try:
+            chat_history, cacheable, session = self._prepare(user_id, user_message)
             
-            # Clean up any prefixes
-            prefixes = ["Reply:", "Response:", "Me:", "Message:", "Him:"]
-            for prefix in prefixes:
-                if reply.lower().startswith(prefix.lower()):
-                    reply = reply[len(prefix):].strip()
+            if cacheable:
+                cached = self._cached_reply(user_id, user_message)
+                if cached is not None:
+                    yield cached
+                    return
+            
+            # The deadline and fallbacks cover the wait for the first part
+            start = time.perf_counter()
+            response = self._call_model(
+                lambda model, timeout: model.start_chat(history=chat_history).send_message(
+                    user_message, stream=True, request_options={"timeout": timeout}
+                )
+            )
             
-            # Limit length
-            if len(reply) > 990:
-                reply = reply[:987] + "..."
+            chunker = ReplyChunker()
+            for part in response:
+                for chunk in chunker.feed(part.text):
+                    if not sent:
+                        metrics.GEMINI_SECONDS.observe(time.perf_counter() - start, kind="stream_first_chunk")
+                    sent.append(chunk)
+                    yield chunk
+                if chunker.done:
+                    # Over the total length: stop reading rather than generate what won't be sent
+                    break
+            for chunk in chunker.finish():
+                sent.append(chunk)
+                yield chunk
+            metrics.GEMINI_SECONDS.observe(time.perf_counter() - start, kind="stream")
+            _record_tokens(response, chat_history, user_message, " ".join(sent))
             
-            # Save bot response
-            self.conversation_store.add_message(user_id, "assistant", reply)
+        except Exception as e:
+            metrics.ERRORS.inc(component="gemini")
+            logger.error(f"Error streaming reply: {e}")
+            if not sent:
+                metrics.FALLBACK_REPLIES.inc()
+                yield FALLBACK_REPLY
+                return
+        
+        if sent:
+            self._save_streamed(user_id, user_message, sent, cacheable, session)
+    
+    async def stream_reply_async(self, user_id: str, user_message: str):
+        """Async version of stream_reply, yielding messages as they are generated"""
+        loop = asyncio.get_running_loop()
+        sent = []
+        try:
+            chat_history, cacheable, session = await loop.run_in_executor(None, self._prepare, user_id, user_message)
             
-            return reply
+            if cacheable:
+                cached = await loop.run_in_executor(None, self._cached_reply, user_id, user_message)
+                if cached is not None:
+                    yield cached
+                    return
+            
+            start = time.perf_counter()
+            response = await self._call_model_async(
+                lambda model, timeout: model.start_chat(history=chat_history).send_message_async(
+                    user_message, stream=True, request_options={"timeout": timeout}
+                )
+            )
+            
+            chunker = ReplyChunker()
+            async for part in response:
+                for chunk in chunker.feed(part.text):
+                    if not sent:
+                        metrics.GEMINI_SECONDS.observe(time.perf_counter() - start, kind="stream_first_chunk")
+                    sent.append(chunk)
+                    yield chunk
+                if chunker.done:
+                    # Over the total length: stop reading rather than generate what won't be sent
+                    break
+            for chunk in chunker.finish():
+                sent.append(chunk)
+                yield chunk
+            metrics.GEMINI_SECONDS.observe(time.perf_counter() - start, kind="stream")
+            _record_tokens(response, chat_history, user_message, " ".join(sent))
             
         except Exception as e:
-            logger.error(f"Error generating reply: {e}")
-            return "Sorry, I couldn't generate a response right now. Try again!"
+            metrics.ERRORS.inc(component="gemini")
+            logger.error(f"Error streaming reply: {e}")
+            if not sent:
+                metrics.FALLBACK_REPLIES.inc()
+                yield FALLBACK_REPLY
+                return
+        
+        if sent:
+            await loop.run_in_executor(None, self._save_streamed, user_id, user_message, sent, cacheable, session)
+    
+    def _save_streamed(self, user_id: str, user_message: str, sent: list, cacheable: bool,
+                       session: PooledSession = None):
+        """Store (and cache) a streamed reply once it is complete"""
+        reply = " ".join(sent)
+        try:
+            reply_id = self.conversation_store.add_message(user_id, "assistant", reply)
+            self._keep_session(user_id, session, user_message, reply, reply_id)
+            # Cache hits are sent as a single message
+            if cacheable and len(reply) <= MAX_REPLY_LENGTH:
+                self.reply_cache.store(self.cache_namespace, user_message, reply)
+        except Exception as e:
+            logger.error(f"Error saving streamed reply: {e}")
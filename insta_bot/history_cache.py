@@ -0,0 +1,212 @@
+"""In-memory cache of recent conversation history per user"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Approximate fixed cost of one cached message dict (keys, ints, object headers)
+MESSAGE_OVERHEAD_BYTES = 240
+
+
+def _message_size(message: dict) -> int:
+    """Approximate memory used by a cached message"""
+    return MESSAGE_OVERHEAD_BYTES + len(message.get("content") or "") + len(message.get("timestamp") or "")
+
+
+class _Entry:
+    """Cached tail of one user's history"""
+    
+    __slots__ = ("messages", "complete", "size", "expires_at", "views")
+    
+    def __init__(self, messages: list, complete: bool, expires_at: float):
+        self.messages = messages
+        self.complete = complete
+        self.size = sum(_message_size(m) for m in messages)
+        self.expires_at = expires_at
+        # transform -> list of transformed messages, aligned with a prefix of self.messages
+        self.views = {}
+
+
+class HistoryCache:
+    """LRU/TTL cache of the most recent messages per user, bounded by memory"""
+    
+    def __init__(self, max_bytes: int = None, ttl: float = None, max_messages: int = None):
+        """
+        Initialize the cache
+        
+        Args:
+            max_bytes: Approximate memory budget for all cached histories
+            ttl: Seconds before a cached history is reloaded from the database
+            max_messages: Number of recent messages kept per user
+        """
+        self.max_bytes = max_bytes or Config.HISTORY_CACHE_MAX_BYTES
+        self.ttl = ttl or Config.HISTORY_CACHE_TTL
+        self.max_messages = max_messages or Config.HISTORY_CACHE_MESSAGES
+        
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, user_id: str, limit: int = None, since: int = None, before: int = None,
+            transform=None, count: bool = True) -> list:
+        """
+        Return cached messages matching a get_history() query
+        
+        Returns:
+            The messages (or transform(message) for each), or None if the
+            cache can't answer the query
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry.expires_at < time.monotonic():
+                self._remove(user_id)
+                entry = None
+            
+            result = None
+            if entry is not None:
+                result = self._select(entry, limit, since, before, transform)
+                if result is not None:
+                    self._entries.move_to_end(user_id)
+            
+            if count:
+                if result is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            return result
+    
+    def _select(self, entry: _Entry, limit, since, before, transform):
+        """Slice an entry for a query, or None if older messages would be needed"""
+        messages = entry.messages
+        start, end = 0, len(messages)
+        
+        if before is not None:
+            while end > 0 and messages[end - 1]["id"] >= before:
+                end -= 1
+        if since is not None:
+            while start < end and messages[start]["id"] <= since:
+                start += 1
+        
+        # If some cached messages are at or before `since`, everything after it is cached
+        if limit is not None and end - start >= limit:
+            start = end - limit
+        elif not (entry.complete or start > 0):
+            return None
+        
+        if transform is None:
+            return messages[start:end]
+        
+        view = entry.views.setdefault(transform, [])
+        if len(view) < len(messages):
+            view.extend(transform(m) for m in messages[len(view):])
+        return view[start:end]
+    
+    def load(self, user_id: str, messages: list, complete: bool):
+        """
+        Cache the most recent messages of a user
+        
+        Args:
+            messages: Recent messages, oldest first
+            complete: True if these are all of the user's messages
+        """
+        entry = _Entry(list(messages[-self.max_messages:]), complete, time.monotonic() + self.ttl)
+        if len(messages) > self.max_messages:
+            entry.complete = False
+        
+        with self._lock:
+            self._remove(user_id)
+            self._entries[user_id] = entry
+            self._bytes += entry.size
+            self._evict()
+    
+    def append(self, user_id: str, message: dict):
+        """Write-through: add a newly stored message to a cached history"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            
+            last_id = entry.messages[-1]["id"] if entry.messages else None
+            if message["id"] is not None and last_id is not None:
+                # Already cached: the history was loaded after the message was stored
+                if message["id"] == last_id:
+                    return
+                # Out-of-order appends from concurrent writers: reload next time
+                if message["id"] < last_id:
+                    self._remove(user_id)
+                    return
+            
+            entry.messages.append(message)
+            entry.size += _message_size(message)
+            self._bytes += _message_size(message)
+            
+            overflow = len(entry.messages) - self.max_messages
+            if overflow > 0:
+                for dropped in entry.messages[:overflow]:
+                    entry.size -= _message_size(dropped)
+                    self._bytes -= _message_size(dropped)
+                del entry.messages[:overflow]
+                for view in entry.views.values():
+                    del view[:overflow]
+                entry.complete = False
+            
+            self._evict()
+    
+    def last_id(self, user_id: str):
+        """Id of the newest cached message for a user, or None if not cached"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            return entry.messages[-1]["id"] if entry.messages else 0
+    
+    def first_id(self, user_id: str):
+        """Id of the oldest cached message for a user, or None if not cached"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            return entry.messages[0]["id"] if entry.messages else 0
+    
+    def invalidate(self, user_id: str):
+        """Drop a user's cached history"""
+        with self._lock:
+            self._remove(user_id)
+    
+    def clear(self):
+        """Drop all cached histories"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def _remove(self, user_id: str):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+    
+    def _evict(self):
+        """Evict least recently used histories until under the memory budget"""
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
+    
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters and memory use"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
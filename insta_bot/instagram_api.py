@@ -1,75 +1,277 @@
 """Instagram API wrapper for sending and receiving messages"""
 import requests
 import logging
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from . import metrics
 from .config import Config
 
 logger = logging.getLogger(__name__)
 
+# Transient upstream errors worth retrying
+RETRY_STATUSES = (500, 502, 503, 504)
+
+PROFILE_FIELDS = "name,username,profile_pic"
+
+
+def create_session(pool_size: int = None, max_retries: int = None, backoff: float = None) -> requests.Session:
+    """
+    Create a keep-alive HTTP session for the Graph API
+    
+    Connection failures are retried for every method (nothing was sent yet);
+    5xx responses are only retried for GETs so messages are never sent twice.
+    """
+    pool_size = pool_size or Config.HTTP_POOL_SIZE
+    max_retries = Config.HTTP_MAX_RETRIES if max_retries is None else max_retries
+    backoff = Config.HTTP_BACKOFF if backoff is None else backoff
+    
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _message_payload(recipient_id: str, text: str) -> dict:
+    return {
+        "recipient": {"id": recipient_id},
+        "message": {"text": text},
+    }
+
+
+def _quick_replies_payload(recipient_id: str, text: str, replies: list) -> dict:
+    return {
+        "recipient": {"id": recipient_id},
+        "message": {
+            "text": text,
+            "quick_replies": [
+                {
+                    "content_type": "text",
+                    "title": r["title"],
+                    "payload": r.get("payload", r["title"]),
+                }
+                for r in replies[:13]  # Max 13 replies
+            ],
+        },
+    }
+
 
 class InstagramAPI:
     """Handle all Instagram Graph API interactions"""
     
-    def __init__(self, access_token: str = None):
+    def __init__(self, access_token: str = None, session: requests.Session = None):
+        """
+        Initialize the API client
+        
+        Args:
+            access_token: Page access token (default: from config)
+            session: Shared HTTP session (default: a new pooled session)
+        """
         self.access_token = access_token or Config.INSTAGRAM_ACCESS_TOKEN
         self.base_url = Config.GRAPH_API_URL
+        self._session = session
+        self._session_lock = threading.Lock()
+    
+    @property
+    def session(self) -> requests.Session:
+        """Pooled HTTP session, created on first use"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = create_session()
+        return self._session
+    
+    def post_message(self, recipient_id: str, text: str) -> requests.Response:
+        """
+        Send a text message and return the raw response
+        
+        Unlike send_message, HTTP errors are not swallowed, so callers can
+        inspect status codes and rate-limit headers. Network errors raise
+        requests.exceptions.RequestException.
+        """
+        return self._post_messages(_message_payload(recipient_id, text))
+    
+    def _post_messages(self, payload: dict) -> requests.Response:
+        """POST to the messages endpoint, recording latency and status"""
+        url = f"{self.base_url}/me/messages"
+        params = {"access_token": self.access_token}
+        start = time.perf_counter()
+        try:
+            response = self.session.post(url, json=payload, params=params, timeout=30)
+        except requests.exceptions.RequestException:
+            metrics.GRAPH_RESPONSES.inc(status="error")
+            raise
+        finally:
+            metrics.GRAPH_SEND_SECONDS.observe(time.perf_counter() - start)
+        metrics.GRAPH_RESPONSES.inc(status=response.status_code)
+        return response
     
     def send_message(self, recipient_id: str, text: str) -> dict:
         """Send a text message to a user"""
-        url = f"{self.base_url}/me/messages"
-        payload = {
-            "recipient": {"id": recipient_id},
-            "message": {"text": text},
+        try:
+            response = self.post_message(recipient_id, text)
+            response.raise_for_status()
+            logger.info(f"✅ Message sent to {recipient_id}")
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            logger.error(f"❌ Failed to send message: {e}")
+            return {"error": str(e)}
+    
+    def send_quick_replies(self, recipient_id: str, text: str, replies: list) -> dict:
+        """Send message with quick reply buttons"""
+        try:
+            response = self._post_messages(_quick_replies_payload(recipient_id, text, replies))
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            logger.error(f"❌ Failed to send quick replies: {e}")
+            return {"error": str(e)}
+    
+    def get_user_profile(self, user_id: str) -> dict:
+        """Get user profile information"""
+        url = f"{self.base_url}/{user_id}"
+        params = {
+            "fields": PROFILE_FIELDS,
+            "access_token": self.access_token,
+        }
+        
+        try:
+            response = self.session.get(url, params=params, timeout=10)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Could not fetch profile: {e}")
+            return {}
+    
+    def get_user_profiles(self, user_ids: list) -> dict:
+        """
+        Get several user profiles in one request (the Graph API's ?ids= lookup)
+        
+        Falls back to one request per user if the batched lookup is refused.
+        
+        Returns:
+            Profiles by user id; users that could not be fetched are missing
+        """
+        if len(user_ids) == 1:
+            profile = self.get_user_profile(user_ids[0])
+            return {user_ids[0]: profile} if profile else {}
+        
+        params = {
+            "ids": ",".join(user_ids),
+            "fields": PROFILE_FIELDS,
+            "access_token": self.access_token,
         }
+        try:
+            response = self.session.get(f"{self.base_url}/", params=params, timeout=10)
+            response.raise_for_status()
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"⚠️ Batched profile lookup failed, fetching one by one: {e}")
+        
+        profiles = {}
+        for user_id in user_ids:
+            profile = self.get_user_profile(user_id)
+            if profile:
+                profiles[user_id] = profile
+        return profiles
+    
+    def close(self):
+        """Close pooled connections"""
+        if self._session is not None:
+            self._session.close()
+
+
+class AsyncInstagramAPI:
+    """Async Graph API client with the same methods as InstagramAPI (requires httpx)"""
+    
+    def __init__(self, access_token: str = None, client=None):
+        """
+        Initialize the async API client
+        
+        Args:
+            access_token: Page access token (default: from config)
+            client: Shared httpx.AsyncClient (default: a new pooled client)
+        """
+        self.access_token = access_token or Config.INSTAGRAM_ACCESS_TOKEN
+        self.base_url = Config.GRAPH_API_URL
+        
+        if client is None:
+            try:
+                import httpx
+            except ImportError as e:
+                raise ImportError(
+                    "AsyncInstagramAPI requires httpx: pip install 'instachatdmbot[async]'"
+                ) from e
+            
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=Config.HTTP_POOL_SIZE,
+                    max_keepalive_connections=Config.HTTP_POOL_SIZE,
+                ),
+                # Transport retries only cover connection failures, so sends are never duplicated
+                transport=httpx.AsyncHTTPTransport(retries=Config.HTTP_MAX_RETRIES),
+                timeout=30,
+            )
+        self.client = client
+    
+    async def send_message(self, recipient_id: str, text: str) -> dict:
+        """Send a text message to a user"""
+        url = f"{self.base_url}/me/messages"
+        payload = _message_payload(recipient_id, text)
         params = {"access_token": self.access_token}
         
         try:
-            response = requests.post(url, json=payload, params=params, timeout=30)
+            response = await self.client.post(url, json=payload, params=params)
             response.raise_for_status()
             logger.info(f"✅ Message sent to {recipient_id}")
             return response.json()
-        except requests.exceptions.RequestException as e:
+        except Exception as e:
             logger.error(f"❌ Failed to send message: {e}")
             return {"error": str(e)}
     
-    def send_quick_replies(self, recipient_id: str, text: str, replies: list) -> dict:
+    async def send_quick_replies(self, recipient_id: str, text: str, replies: list) -> dict:
         """Send message with quick reply buttons"""
         url = f"{self.base_url}/me/messages"
-        payload = {
-            "recipient": {"id": recipient_id},
-            "message": {
-                "text": text,
-                "quick_replies": [
-                    {
-                        "content_type": "text",
-                        "title": r["title"],
-                        "payload": r.get("payload", r["title"]),
-                    }
-                    for r in replies[:13]  # Max 13 replies
-                ],
-            },
-        }
+        payload = _quick_replies_payload(recipient_id, text, replies)
         params = {"access_token": self.access_token}
         
         try:
-            response = requests.post(url, json=payload, params=params, timeout=30)
+            response = await self.client.post(url, json=payload, params=params)
             response.raise_for_status()
             return response.json()
-        except requests.exceptions.RequestException as e:
+        except Exception as e:
             logger.error(f"❌ Failed to send quick replies: {e}")
             return {"error": str(e)}
     
-    def get_user_profile(self, user_id: str) -> dict:
+    async def get_user_profile(self, user_id: str) -> dict:
         """Get user profile information"""
         url = f"{self.base_url}/{user_id}"
         params = {
-            "fields": "name,profile_pic",
+            "fields": PROFILE_FIELDS,
             "access_token": self.access_token,
         }
         
         try:
-            response = requests.get(url, params=params, timeout=10)
+            response = await self.client.get(url, params=params, timeout=10)
             response.raise_for_status()
             return response.json()
-        except requests.exceptions.RequestException as e:
+        except Exception as e:
             logger.error(f"Could not fetch profile: {e}")
             return {}
+    
+    async def aclose(self):
+        """Close pooled connections"""
+        await self.client.aclose()
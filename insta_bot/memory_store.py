@@ -0,0 +1,77 @@
+"""In-memory conversation store for tests and benchmarks"""
+import itertools
+import logging
+import threading
+from datetime import datetime
+from .conversation_store import BaseConversationStore
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryConversationStore(BaseConversationStore):
+    """Keep conversation history in process memory (lost on restart)"""
+    
+    def __init__(self, max_messages: int = None):
+        """
+        Initialize the store
+        
+        Args:
+            max_messages: Keep only this many recent messages per user (default: unlimited)
+        """
+        self.max_messages = max_messages
+        self._ids = itertools.count(1)
+        self._messages = {}
+        self._conversations = {}
+        self._lock = threading.Lock()
+    
+    def add_message(self, user_id: str, role: str, content: str, username: str = None) -> int:
+        timestamp = datetime.now().isoformat()
+        with self._lock:
+            message_id = next(self._ids)
+            messages = self._messages.setdefault(user_id, [])
+            messages.append({"id": message_id, "role": role, "content": content, "timestamp": timestamp})
+            if self.max_messages and len(messages) > self.max_messages:
+                del messages[:len(messages) - self.max_messages]
+            
+            conversation = self._conversations.setdefault(
+                user_id, {"username": None, "summary": "", "summary_upto": 0}
+            )
+            if username is not None:
+                conversation["username"] = username
+        return message_id
+    
+    def get_history(self, user_id: str, limit: int = None, since: int = None, before: int = None,
+                    transform=None, oldest: bool = False) -> list:
+        with self._lock:
+            history = [
+                msg for msg in self._messages.get(user_id, ())
+                if (since is None or msg["id"] > since) and (before is None or msg["id"] < before)
+            ]
+        if limit is not None:
+            if limit <= 0:
+                history = []
+            else:
+                history = history[:limit] if oldest else history[-limit:]
+        if transform is not None:
+            return [transform(msg) for msg in history]
+        return history
+    
+    def get_summary(self, user_id: str) -> tuple:
+        with self._lock:
+            conversation = self._conversations.get(user_id)
+            if conversation:
+                return conversation["summary"], conversation["summary_upto"]
+            return "", 0
+    
+    def save_summary(self, user_id: str, summary: str, summary_upto: int):
+        with self._lock:
+            conversation = self._conversations.get(user_id)
+            if conversation is not None:
+                conversation["summary"] = summary
+                conversation["summary_upto"] = summary_upto
+    
+    def clear_history(self, user_id: str):
+        with self._lock:
+            self._messages.pop(user_id, None)
+            self._conversations.pop(user_id, None)
+        logger.info(f"Cleared history for user {user_id}")
@@ -0,0 +1,310 @@
+"""Prometheus-style metrics for the request path"""
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+class _Metric:
+    """
+    Base for metrics aggregated in per-thread shards
+    
+    Each thread updates its own dict without locking; shards are only summed
+    when metrics are collected, so recording stays cheap under load. When a
+    thread exits its shard is folded into a shared total and dropped, so
+    short-lived threads don't accumulate.
+    """
+    
+    kind = None
+    
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = {}
+        self._retired = {}
+        # Reentrant: a shard can be retired by garbage collection while the lock is held
+        self._lock = threading.RLock()
+    
+    def _shard(self) -> dict:
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            holder = self._local.holder = _ShardHolder()
+            with self._lock:
+                self._shards[id(holder.shard)] = holder.shard
+            # The thread-local holder goes away with its thread
+            weakref.finalize(holder, self._retire, holder.shard)
+        return holder.shard
+    
+    def _retire(self, shard: dict):
+        """Fold an exited thread's shard into the shared total"""
+        with self._lock:
+            self._shards.pop(id(shard), None)
+            for key, value in shard.items():
+                self._retired[key] = self._merge(self._retired.get(key), value)
+    
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+    
+    def collect(self) -> dict:
+        """Sum every thread's values: {label values: value}"""
+        with self._lock:
+            shards = list(self._shards.values())
+            totals = dict(self._retired)
+        for shard in shards:
+            for key, value in list(shard.items()):
+                totals[key] = self._merge(totals.get(key), value)
+        return totals
+    
+    def _merge(self, total, value):
+        raise NotImplementedError
+
+
+class _ShardHolder:
+    """Thread-local owner of a shard; its finalizer retires the shard"""
+    
+    __slots__ = ("shard", "__weakref__")
+    
+    def __init__(self):
+        self.shard = {}
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    
+    kind = "counter"
+    
+    def inc(self, amount: float = 1, **labels):
+        if not Config.METRICS_ENABLED:
+            return
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+    
+    def _merge(self, total, value):
+        return (total or 0) + value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed buckets"""
+    
+    kind = "histogram"
+    
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+    
+    def observe(self, value: float, **labels):
+        if not Config.METRICS_ENABLED:
+            return
+        shard = self._shard()
+        key = self._key(labels)
+        # Per-bucket counts (last slot is +Inf), then sum and count
+        state = shard.get(key)
+        if state is None:
+            state = shard[key] = [0] * (len(self.buckets) + 3)
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+    
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    
+    def _merge(self, total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+
+class Registry:
+    """Metrics of this process, plus snapshots written by sibling worker processes"""
+    
+    def __init__(self):
+        self._metrics = []
+        self._writer = None
+        self._stop = threading.Event()
+    
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+    
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+    
+    def snapshot(self) -> dict:
+        """This process's values in a JSON-friendly form"""
+        return {
+            metric.name: [[list(key), value] for key, value in metric.collect().items()]
+            for metric in self._metrics
+        }
+    
+    def _snapshot_path(self, pid: int = None) -> str:
+        return os.path.join(Config.METRICS_DIR, f"metrics-{pid or os.getpid()}.json")
+    
+    def write_snapshot(self):
+        """Publish this process's values for the other workers (multi-process mode)"""
+        if not Config.METRICS_DIR:
+            return
+        path = self._snapshot_path()
+        tmp_path = f"{path}.tmp"
+        try:
+            os.makedirs(Config.METRICS_DIR, exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics snapshot: {e}")
+    
+    def start_writer(self):
+        """Write snapshots periodically so any worker can serve /metrics for all of them"""
+        if not Config.METRICS_DIR or self._writer is not None:
+            return
+        
+        def run():
+            while not self._stop.wait(Config.METRICS_FLUSH_INTERVAL):
+                self.write_snapshot()
+        
+        self._writer = threading.Thread(target=run, name="insta-bot-metrics", daemon=True)
+        self._writer.start()
+    
+    def stop_writer(self):
+        """Stop the snapshot thread after a final write"""
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.join(timeout=1.0)
+            self._writer = None
+        self.write_snapshot()
+    
+    def _merged(self) -> dict:
+        """Values of this process, merged with the other processes' snapshots"""
+        merged = {metric.name: metric.collect() for metric in self._metrics}
+        if not Config.METRICS_DIR:
+            return merged
+        
+        own = self._snapshot_path()
+        by_name = {metric.name: metric for metric in self._metrics}
+        for path in glob.glob(os.path.join(Config.METRICS_DIR, "metrics-*.json")):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, series in snapshot.items():
+                metric = by_name.get(name)
+                if metric is None:
+                    continue
+                values = merged[name]
+                for key, value in series:
+                    key = tuple(key)
+                    values[key] = metric._merge(values.get(key), value)
+        return merged
+    
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        merged = self._merged()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for key, value in sorted(merged[metric.name].items()):
+                labels = list(zip(metric.labelnames, key))
+                if metric.kind == "counter":
+                    lines.append(f"{metric.name}{_labels(labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), value):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else _number(bound)
+                    lines.append(f"{metric.name}_bucket{_labels(labels + [('le', le)])} {cumulative}")
+                lines.append(f"{metric.name}_sum{_labels(labels)} {_number(value[-2])}")
+                lines.append(f"{metric.name}_count{_labels(labels)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(pairs: list) -> str:
+    if not pairs:
+        return ""
+    escaped = (
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+
+WEBHOOK_SECONDS = REGISTRY.histogram(
+    "insta_bot_webhook_seconds", "Time to handle a webhook POST"
+)
+GEMINI_SECONDS = REGISTRY.histogram(
+    "insta_bot_gemini_seconds", "Gemini request latency", ("kind",)
+)
+PROMPT_TOKENS = REGISTRY.histogram(
+    "insta_bot_prompt_tokens", "Tokens sent to Gemini per request", buckets=TOKEN_BUCKETS
+)
+RESPONSE_TOKENS = REGISTRY.histogram(
+    "insta_bot_response_tokens", "Tokens generated by Gemini per request", buckets=TOKEN_BUCKETS
+)
+CACHED_PROMPT_TOKENS = REGISTRY.histogram(
+    "insta_bot_cached_prompt_tokens", "Prompt tokens served from Gemini's context cache per request",
+    buckets=TOKEN_BUCKETS
+)
+CHAT_SESSIONS = REGISTRY.counter(
+    "insta_bot_chat_sessions_total", "Pooled chat session lookups by result (hit, miss, stale, full)", ("result",)
+)
+GRAPH_SEND_SECONDS = REGISTRY.histogram(
+    "insta_bot_graph_send_seconds", "Graph API send latency"
+)
+GRAPH_RESPONSES = REGISTRY.counter(
+    "insta_bot_graph_responses_total", "Graph API send responses by HTTP status", ("status",)
+)
+DB_SECONDS = REGISTRY.histogram(
+    "insta_bot_db_seconds", "Conversation store read and write time", ("op",)
+)
+ERRORS = REGISTRY.counter(
+    "insta_bot_errors_total", "Errors by component", ("component",)
+)
+GEMINI_FAILURES = REGISTRY.counter(
+    "insta_bot_gemini_failures_total", "Failed or timed-out Gemini calls by model", ("model",)
+)
+HEDGED_REQUESTS = REGISTRY.counter(
+    "insta_bot_hedged_requests_total", "Hedged upstream calls by the attempt that answered first",
+    ("upstream", "winner")
+)
+PROFILE_FETCHES = REGISTRY.counter(
+    "insta_bot_profile_fetches_total", "User profiles requested from the Graph API by result", ("result",)
+)
+ATTACHMENTS = REGISTRY.counter(
+    "insta_bot_attachments_total", "Message attachments by type and result", ("kind", "result")
+)
+FALLBACK_REPLIES = REGISTRY.counter(
+    "insta_bot_fallback_replies_total", "Fallback replies sent because generation failed"
+)
@@ -0,0 +1,131 @@
+"""
+Porter stemmer, as SQLite FTS5's porter tokenizer applies it
+
+History search ranks the index's candidates in Python; stemming words the
+same way the index does keeps the two in agreement about which words match.
+"""
+VOWELS = frozenset("aeiou")
+
+
+def _consonant(word: str, i: int) -> bool:
+    """Whether word[i] is a consonant; "y" is one unless it follows a consonant"""
+    if word[i] in VOWELS:
+        return False
+    if word[i] == "y":
+        return i == 0 or not _consonant(word, i - 1)
+    return True
+
+
+def _measure(stem: str) -> int:
+    """Porter's m: the number of vowel-consonant sequences in the stem"""
+    m = 0
+    vowel = False
+    for i in range(len(stem)):
+        if _consonant(stem, i):
+            if vowel:
+                m += 1
+            vowel = False
+        else:
+            vowel = True
+    return m
+
+
+def _has_vowel(stem: str) -> bool:
+    return any(not _consonant(stem, i) for i in range(len(stem)))
+
+
+def _double_consonant(word: str) -> bool:
+    return len(word) >= 2 and word[-1] == word[-2] and _consonant(word, len(word) - 1)
+
+
+def _cvc(word: str) -> bool:
+    """Ends consonant-vowel-consonant, the last not w, x or y"""
+    return (
+        len(word) >= 3 and _consonant(word, len(word) - 3) and not _consonant(word, len(word) - 2)
+        and _consonant(word, len(word) - 1) and word[-1] not in "wxy"
+    )
+
+
+# Steps 2 and 3: suffix replacements, applied when the stem has m > 0
+STEP2 = (
+    ("ational", "ate"), ("tional", "tion"), ("enci", "ence"), ("anci", "ance"), ("izer", "ize"),
+    ("bli", "ble"), ("alli", "al"), ("entli", "ent"), ("eli", "e"), ("ousli", "ous"), ("ization", "ize"),
+    ("ation", "ate"), ("ator", "ate"), ("alism", "al"), ("iveness", "ive"), ("fulness", "ful"),
+    ("ousness", "ous"), ("aliti", "al"), ("iviti", "ive"), ("biliti", "ble"), ("logi", "log"),
+)
+STEP3 = (
+    ("icate", "ic"), ("ative", ""), ("alize", "al"), ("iciti", "ic"), ("ical", "ic"), ("ful", ""), ("ness", ""),
+)
+# Step 4: suffixes removed when the stem has m > 1
+STEP4 = (
+    "al", "ance", "ence", "er", "ic", "able", "ible", "ant", "ement", "ment", "ent", "ion", "ou", "ism", "ate",
+    "iti", "ous", "ive", "ize",
+)
+
+STEP4_LONGEST_FIRST = sorted(STEP4, key=len, reverse=True)
+
+
+def _replace(word: str, rules: tuple, min_measure: int) -> str:
+    """Apply the rule for the longest matching suffix, if its stem is long enough"""
+    best = None
+    for suffix, replacement in rules:
+        if word.endswith(suffix) and (best is None or len(suffix) > len(best[0])):
+            best = (suffix, replacement)
+    if best is None:
+        return word
+    stem = word[:-len(best[0])]
+    return stem + best[1] if _measure(stem) > min_measure else word
+
+
+def stem(word: str) -> str:
+    """The Porter stem of a lowercase ASCII word (words under three letters are kept)"""
+    if len(word) < 3:
+        return word
+    
+    # Step 1a
+    if word.endswith("sses"):
+        word = word[:-2]
+    elif word.endswith("ies") and len(word) > 3:
+        word = word[:-2]
+    elif word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    
+    # Step 1b
+    if word.endswith("eed") and len(word) > 3:
+        if _measure(word[:-3]) > 0:
+            word = word[:-1]
+    else:
+        for suffix in ("ed", "ing"):
+            if word.endswith(suffix) and _has_vowel(word[:-len(suffix)]):
+                word = word[:-len(suffix)]
+                if word.endswith(("at", "bl", "iz")):
+                    word += "e"
+                elif _double_consonant(word) and word[-1] not in "lsz":
+                    word = word[:-1]
+                elif _measure(word) == 1 and _cvc(word):
+                    word += "e"
+                break
+    
+    # Step 1c
+    if word.endswith("y") and _has_vowel(word[:-1]):
+        word = word[:-1] + "i"
+    
+    word = _replace(word, STEP2, 0)
+    word = _replace(word, STEP3, 0)
+    
+    # Step 4
+    for suffix in STEP4_LONGEST_FIRST:
+        if word.endswith(suffix):
+            stem = word[:-len(suffix)]
+            if _measure(stem) > 1 and (suffix != "ion" or stem.endswith(("s", "t"))):
+                word = stem
+            break
+    
+    # Step 5
+    if word.endswith("e"):
+        m = _measure(word[:-1])
+        if m > 1 or (m == 1 and not _cvc(word[:-1])):
+            word = word[:-1]
+    if word.endswith("ll") and _measure(word) > 1:
+        word = word[:-1]
+    return word
@@ -0,0 +1,210 @@
+"""Cache of Instagram user profiles, fetched off the reply path"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from . import metrics
+from .config import Config
+from .conversation_store import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileCache:
+    """
+    Names and usernames of the people the bot talks to
+    
+    Lookups only read an in-memory LRU, so they never wait on the Graph API.
+    Unknown or expired senders are queued by prefetch() and a background
+    thread resolves them in batches: first from a SQLite table with TTL
+    expiry (shared across restarts and workers), then from the Graph API.
+    A sender's profile is usually ready by the time their reply is built.
+    """
+    
+    def __init__(self, db_path: str = None, ttl: float = None, capacity: int = None, batch_size: int = None,
+                 batch_wait: float = None, retry_after: float = None):
+        """
+        Initialize the cache
+        
+        Args:
+            db_path: SQLite database for fetched profiles (default: from config)
+            ttl: Seconds a fetched profile is used before it is fetched again
+            capacity: Maximum profiles kept in memory
+            batch_size: Most profiles resolved per batch
+            batch_wait: Seconds to wait for more senders before fetching a batch
+            retry_after: Seconds before a profile that could not be fetched is tried again
+        """
+        self.db = ConnectionManager(db_path or Config.DB_PATH)
+        self.ttl = ttl or Config.PROFILE_CACHE_TTL
+        self.capacity = capacity or Config.PROFILE_CACHE_SIZE
+        self.batch_size = batch_size or Config.PROFILE_BATCH_SIZE
+        self.batch_wait = Config.PROFILE_BATCH_WAIT if batch_wait is None else batch_wait
+        self.retry_after = retry_after or Config.PROFILE_RETRY_AFTER
+        
+        # key -> (profile or None, expires_at)
+        self._profiles = OrderedDict()
+        # key -> (Graph user id, InstagramAPI) waiting to be resolved
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._stats = {"hits": 0, "misses": 0, "loaded": 0, "fetched": 0, "failed": 0}
+        
+        self._initialize_db()
+    
+    def _initialize_db(self):
+        """Create the profiles table"""
+        try:
+            with self.db.connection() as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS profiles (
+                        user_id TEXT PRIMARY KEY,
+                        username TEXT,
+                        name TEXT,
+                        fetched_at REAL NOT NULL
+                    ) WITHOUT ROWID
+                """)
+        except Exception as e:
+            logger.error(f"Error initializing profiles table: {e}")
+    
+    def start(self):
+        """Start the fetch thread"""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="insta-bot-profiles", daemon=True)
+        self._thread.start()
+    
+    def get(self, key: str) -> dict:
+        """
+        A cached profile, without blocking
+        
+        Args:
+            key: Conversation id the profile was prefetched under
+        
+        Returns:
+            Dict with username and name (either may be None), or None if unknown
+        """
+        with self._cond:
+            entry = self._profiles.get(key)
+            if entry is None or entry[0] is None:
+                self._stats["misses"] += 1
+                return None
+            self._profiles.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+    
+    def prefetch(self, key: str, user_id: str, api):
+        """
+        Queue a profile for fetching unless a fresh one is cached
+        
+        Args:
+            key: Conversation id to cache the profile under
+            user_id: Instagram-scoped id of the user
+            api: InstagramAPI of the account the user wrote to
+        """
+        with self._cond:
+            entry = self._profiles.get(key)
+            if entry is not None and entry[1] > time.time():
+                return
+            if key in self._pending or not self._running:
+                return
+            self._pending[key] = (user_id, api)
+            self._cond.notify()
+    
+    def _run(self):
+        """Resolve queued profiles in batches"""
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: not self._running or self._pending)
+                if not self._running:
+                    return
+            
+            # Senders often arrive in bursts; give the batch a moment to fill
+            time.sleep(self.batch_wait)
+            with self._cond:
+                batch = []
+                while self._pending and len(batch) < self.batch_size:
+                    key, (user_id, api) = self._pending.popitem(last=False)
+                    batch.append((key, user_id, api))
+            
+            try:
+                self._resolve(batch)
+            except Exception as e:
+                metrics.ERRORS.inc(component="profiles")
+                logger.error(f"Error resolving {len(batch)} profiles: {e}")
+    
+    def _resolve(self, batch: list):
+        """Load a batch from SQLite and fetch whatever is missing or expired from the Graph API"""
+        now = time.time()
+        keys = [key for key, _, _ in batch]
+        with self.db.connection() as conn:
+            rows = conn.execute(
+                f"SELECT user_id, username, name, fetched_at FROM profiles WHERE user_id IN "
+                f"({', '.join('?' * len(keys))})",
+                keys
+            ).fetchall()
+        stored = {row[0]: row for row in rows if now - row[3] < self.ttl}
+        
+        fetch = {}
+        for key, user_id, api in batch:
+            row = stored.get(key)
+            if row is not None:
+                self._remember(key, {"username": row[1], "name": row[2]}, row[3] + self.ttl)
+                self._stats["loaded"] += 1
+            else:
+                fetch.setdefault(api, []).append((key, user_id))
+        
+        # One Graph request per account and batch
+        fetched = []
+        for api, users in fetch.items():
+            profiles = api.get_user_profiles([user_id for _, user_id in users])
+            for key, user_id in users:
+                profile = profiles.get(user_id)
+                if profile is None:
+                    # Not retried until retry_after; replies go on without a name
+                    metrics.PROFILE_FETCHES.inc(result="error")
+                    self._stats["failed"] += 1
+                    self._remember(key, None, now + self.retry_after)
+                    continue
+                metrics.PROFILE_FETCHES.inc(result="ok")
+                self._stats["fetched"] += 1
+                profile = {"username": profile.get("username"), "name": profile.get("name")}
+                self._remember(key, profile, now + self.ttl)
+                fetched.append((key, profile["username"], profile["name"], now))
+        
+        if fetched:
+            with self.db.connection() as conn:
+                conn.executemany(
+                    """
+                    INSERT INTO profiles (user_id, username, name, fetched_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        username = excluded.username, name = excluded.name, fetched_at = excluded.fetched_at
+                    """,
+                    fetched
+                )
+            logger.info(f"👤 Fetched {len(fetched)} profiles")
+    
+    def _remember(self, key: str, profile: dict, expires_at: float):
+        with self._cond:
+            previous = self._profiles.get(key)
+            # A failed refresh keeps the profile we already had
+            if profile is None and previous is not None and previous[0] is not None:
+                profile = previous[0]
+            self._profiles[key] = (profile, expires_at)
+            self._profiles.move_to_end(key)
+            while len(self._profiles) > self.capacity:
+                self._profiles.popitem(last=False)
+    
+    def stats(self) -> dict:
+        """Lookup and fetch counters"""
+        with self._cond:
+            return {**self._stats, "cached": len(self._profiles), "pending": len(self._pending)}
+    
+    def close(self):
+        """Stop the fetch thread (queued profiles are dropped) and close database connections"""
+        with self._cond:
+            self._running = False
+            self._pending.clear()
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=Config.SHUTDOWN_TIMEOUT)
+        self.db.close()
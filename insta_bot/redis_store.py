@@ -0,0 +1,145 @@
+"""Redis conversation store shared by every bot process and host"""
+import json
+import logging
+from datetime import datetime
+from .config import Config
+from .conversation_store import BaseConversationStore
+
+logger = logging.getLogger(__name__)
+
+# Takes the next id and appends the message in one step, so messages sit in id
+# order even when several processes add to the same conversation.
+# KEYS: id counter, history list, conversation hash
+# ARGV: message JSON without its id, messages kept, ttl (0: none), updated_at[, username]
+ADD_MESSAGE_SCRIPT = """
+local id = redis.call('INCR', KEYS[1])
+redis.call('RPUSH', KEYS[2], '{"id": ' .. id .. ', ' .. string.sub(ARGV[1], 2))
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[2]), -1)
+redis.call('HSET', KEYS[3], 'updated_at', ARGV[4])
+if ARGV[5] then
+    redis.call('HSET', KEYS[3], 'username', ARGV[5])
+end
+if tonumber(ARGV[3]) > 0 then
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    redis.call('EXPIRE', KEYS[3], ARGV[3])
+end
+return id
+"""
+
+
+class RedisConversationStore(BaseConversationStore):
+    """
+    Keep conversation history in Redis (or any server speaking its protocol)
+    
+    Each user's messages are a capped list that expires after a period of
+    inactivity; message ids come from one shared counter, taken in the same
+    server-side script that appends the message.
+    """
+    
+    def __init__(self, url: str = None, client=None, max_messages: int = None, ttl: int = None,
+                 prefix: str = None):
+        """
+        Initialize the store
+        
+        Args:
+            url: Server URL, e.g. redis://localhost:6379/0 (default: from config)
+            client: Existing redis.Redis-compatible client (default: one created from url)
+            max_messages: Messages kept per user; older ones are trimmed
+            ttl: Seconds of inactivity before a conversation expires (0 keeps it forever)
+            prefix: Prefix for every key, so several bots can share a server
+        """
+        self.max_messages = max_messages or Config.REDIS_MAX_MESSAGES
+        self.ttl = Config.REDIS_TTL if ttl is None else ttl
+        self.prefix = Config.REDIS_KEY_PREFIX if prefix is None else prefix
+        self._owns_client = client is None
+        
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise ImportError(
+                    "RedisConversationStore requires redis: pip install 'instachatdmbot[redis]'"
+                ) from e
+            client = redis.Redis.from_url(url or Config.REDIS_URL, decode_responses=True)
+        self.client = client
+        self._add_message = client.register_script(ADD_MESSAGE_SCRIPT)
+    
+    def _history_key(self, user_id: str) -> str:
+        return f"{self.prefix}history:{user_id}"
+    
+    def _conversation_key(self, user_id: str) -> str:
+        return f"{self.prefix}conversation:{user_id}"
+    
+    def add_message(self, user_id: str, role: str, content: str, username: str = None) -> int:
+        try:
+            timestamp = datetime.now().isoformat()
+            message = json.dumps({"role": role, "content": content, "timestamp": timestamp})
+            args = [message, self.max_messages, self.ttl or 0, timestamp]
+            if username is not None:
+                args.append(username)
+            
+            keys = [f"{self.prefix}message_id", self._history_key(user_id), self._conversation_key(user_id)]
+            return int(self._add_message(keys=keys, args=args))
+        except Exception as e:
+            logger.error(f"Error adding message: {e}")
+            return None
+    
+    def get_history(self, user_id: str, limit: int = None, since: int = None, before: int = None,
+                    transform=None, oldest: bool = False) -> list:
+        try:
+            if limit is not None and limit <= 0:
+                return []
+            
+            # Without id bounds only the tail (or head) is needed
+            start, end = 0, -1
+            if limit is not None and since is None and before is None:
+                start, end = (0, limit - 1) if oldest else (-limit, -1)
+            rows = self.client.lrange(self._history_key(user_id), start, end)
+            
+            history = [json.loads(row) for row in rows]
+            if since is not None or before is not None:
+                history = [
+                    msg for msg in history
+                    if (since is None or msg["id"] > since) and (before is None or msg["id"] < before)
+                ]
+                if limit is not None:
+                    history = history[:limit] if oldest else history[-limit:]
+            
+            if transform is not None:
+                return [transform(msg) for msg in history]
+            return history
+        except Exception as e:
+            logger.error(f"Error getting history: {e}")
+            return []
+    
+    def get_summary(self, user_id: str) -> tuple:
+        try:
+            summary, summary_upto = self.client.hmget(
+                self._conversation_key(user_id), "summary", "summary_upto"
+            )
+            return summary or "", int(summary_upto or 0)
+        except Exception as e:
+            logger.error(f"Error getting summary: {e}")
+            return "", 0
+    
+    def save_summary(self, user_id: str, summary: str, summary_upto: int):
+        try:
+            conversation_key = self._conversation_key(user_id)
+            # Like the SQLite store, a cleared conversation gets no summary
+            if not self.client.exists(conversation_key):
+                return
+            self.client.hset(conversation_key, mapping={"summary": summary, "summary_upto": summary_upto})
+        except Exception as e:
+            logger.error(f"Error saving summary: {e}")
+    
+    def clear_history(self, user_id: str):
+        try:
+            self.client.delete(self._history_key(user_id), self._conversation_key(user_id))
+            logger.info(f"Cleared history for user {user_id}")
+        except Exception as e:
+            logger.error(f"Error clearing history: {e}")
+    
+    def close(self):
+        """Close the client if this store created it"""
+        if self._owns_client:
+            self.client.close()
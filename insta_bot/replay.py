@@ -0,0 +1,406 @@
+"""
+Offline replay of recorded webhook traffic
+
+    instachatdmbot replay webhooks.ndjson --concurrency 32 --output replies.ndjson
+
+Each line of the input is a webhook payload as Meta posted it (or a single
+messaging event). Events go through InstagramBot._handle_message and
+GeminiHandler exactly as live traffic does, but replies are collected by a
+dry-run sink instead of being sent, profiles are not fetched and the
+conversation store is in memory unless another one is chosen.
+
+Use it to backfill history, reprocess traffic or compare prompts and models
+against real conversations.
+"""
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from . import metrics
+from .attachments import AttachmentProcessor
+from .bot import InstagramBot
+from .coalescer import MessageCoalescer
+from .config import Config
+from .conversation_store import create_store
+from .gemini_handler import FALLBACK_REPLY, GeminiHandler
+from .instagram_api import InstagramAPI
+from .tenants import TenantRegistry
+
+logger = logging.getLogger(__name__)
+
+# Events buffered per worker; the input is read no faster than it is replayed
+WORKER_QUEUE_SIZE = 100
+
+
+class DryRunSink:
+    """
+    Takes the send scheduler's place: replies are counted and optionally written to NDJSON
+    
+    The fallback reply sent when Gemini fails is counted apart from real
+    replies, as are replies that could not be generated at all, and the
+    event being replayed on the thread is marked as failed.
+    """
+    
+    def __init__(self, output: str = None):
+        """
+        Args:
+            output: File the replies are appended to, one JSON object per line
+        """
+        self._file = open(output, "a", encoding="utf-8") if output else None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.replies = 0
+        self.fallbacks = 0
+        self.errors = 0
+    
+    def submit(self, recipient_id: str, text: str, tenant_id: str = None) -> bool:
+        """Record a reply (same signature as SendScheduler.submit)"""
+        fallback = text == FALLBACK_REPLY
+        if fallback:
+            self._local.failed = True
+        with self._lock:
+            if fallback:
+                self.fallbacks += 1
+            else:
+                self.replies += 1
+            if self._file is not None:
+                self._file.write(json.dumps({
+                    "line": getattr(self._local, "line", None),
+                    "tenant_id": tenant_id,
+                    "recipient_id": recipient_id,
+                    "text": text,
+                    "fallback": fallback,
+                }, ensure_ascii=False) + "\n")
+        return True
+    
+    def error(self):
+        """Record a reply that failed without sending anything"""
+        self._local.failed = True
+        with self._lock:
+            self.errors += 1
+    
+    def replaying(self, line: int):
+        """Attribute replies submitted from this thread to an input line"""
+        self._local.line = line
+        self._local.failed = False
+    
+    def failed(self) -> bool:
+        """Whether the event replayed on this thread got a fallback reply or an error"""
+        return getattr(self._local, "failed", False)
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class _InlineAttachments(AttachmentProcessor):
+    """Attachments described on the calling thread, so replay keeps each sender's order"""
+    
+    def submit(self, attachments: list, text: str, callback) -> bool:
+        callback(self.describe_message(attachments, text))
+        return True
+
+
+class ReplayBot(InstagramBot):
+    """
+    The bot's message pipeline without the webhook server or the outbound queue
+    
+    Replies are generated on the calling thread and go to the sink. Messages
+    are not merged: every replayed message gets its own reply, as long as a
+    sender's events are handled in order by one thread at a time.
+    """
+    
+    def __init__(self, sink: DryRunSink, custom_instructions: str = None, gemini_model: str = None,
+                 store: str = "memory", attachments: bool = False):
+        """
+        Initialize the bot
+        
+        Args:
+            sink: Receives the replies
+            custom_instructions: Custom system prompt for the AI
+            gemini_model: Gemini model to use
+            store: Conversation store backend the replay writes to
+            attachments: Download and describe attachments (recorded URLs may have expired)
+        """
+        # Nothing is sent, so only Gemini has to be configured
+        if not Config.GEMINI_API_KEY:
+            raise ValueError("Missing required config: GEMINI_API_KEY")
+        
+        self.conversation_store = create_store(store)
+        self.instagram_api = InstagramAPI()
+        self.profiles = None
+        self.gemini_handler = GeminiHandler(
+            system_prompt=custom_instructions or Config.BOT_INSTRUCTIONS,
+            model=gemini_model or Config.GEMINI_MODEL,
+            conversation_store=self.conversation_store,
+        )
+        self.attachments = None
+        if attachments:
+            self.attachments = _InlineAttachments(self.gemini_handler.describe_media, self.instagram_api.session)
+        
+        self.tenants = None
+        if Config.TENANTS_FILE:
+            self.tenants = TenantRegistry.load(
+                Config.TENANTS_FILE,
+                conversation_store=self.conversation_store,
+                session=self.instagram_api.session,
+                reply_cache=self.gemini_handler.reply_cache,
+                models=self.gemini_handler.models,
+                chat_sessions=self.gemini_handler.sessions,
+            )
+        
+        self.send_scheduler = sink
+        # No debounce window: each message is replied to before the next one is read
+        self.coalescer = MessageCoalescer(self._dispatch_reply, window=0)
+        self._shutting_down = False
+    
+    def _dispatch_reply(self, key: tuple, messages: list) -> bool:
+        if not self._reply(key, messages):
+            self.send_scheduler.error()
+        return True
+    
+    def shutdown(self, timeout: float = None):
+        """Wait for background summaries and close connections"""
+        self._close_attachments()
+        self.gemini_handler.close()
+        if self.tenants is not None:
+            self.tenants.close()
+        self.instagram_api.close()
+        self.conversation_store.close()
+
+
+def _events(payload: dict) -> list:
+    """(messaging event, webhook entry id) pairs in a recorded payload"""
+    if "entry" in payload:
+        return [
+            (event, entry.get("id"))
+            for entry in payload.get("entry", [])
+            for event in entry.get("messaging", [])
+        ]
+    # A bare messaging event
+    if "sender" in payload:
+        return [(payload, None)]
+    return []
+
+
+def _open(path: str):
+    # Archives written by `retention --archive-file` are gzipped NDJSON
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _percentile(ordered: list, q: float) -> float:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ReplayRunner:
+    """
+    Stream an NDJSON file of webhook payloads through a bot on a pool of threads
+    
+    Events are sharded by sender, so each sender's messages are replayed in
+    order by the same worker while different senders run in parallel. The
+    checkpoint records the first line not yet fully replayed (and its byte
+    offset); a resumed run seeks there, so lines finished just before an
+    interruption may be replayed twice.
+    """
+    
+    def __init__(self, bot: ReplayBot, concurrency: int = 8, checkpoint: str = None,
+                 checkpoint_every: int = 1000, limit: int = None):
+        """
+        Initialize the runner
+        
+        Args:
+            bot: Bot whose pipeline the events go through
+            concurrency: Worker threads (replies generated at once)
+            checkpoint: File progress is saved to
+            checkpoint_every: Lines read between checkpoint saves
+            limit: Stop after this many lines
+        """
+        self.bot = bot
+        self.concurrency = max(1, concurrency)
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.limit = limit
+        
+        self._lock = threading.Lock()
+        # Events still running per line, and lines finished ahead of the watermark
+        self._remaining = {}
+        self._finished = {}
+        self._next_line = 0
+        self._next_offset = 0
+        self._latencies = []
+        self._stopping = False
+        self._stats = {"lines": 0, "events": 0, "invalid": 0, "failed": 0}
+    
+    def run(self, path: str, resume: bool = False) -> dict:
+        """
+        Replay a file and wait for every event to finish
+        
+        Args:
+            path: NDJSON input (.gz is decompressed)
+            resume: Continue from the checkpoint, if there is one for this input
+        
+        Returns:
+            Summary with counts, throughput and per-event latency
+        """
+        start_line, start_offset = self._load_checkpoint(path) if resume else (0, 0)
+        self._next_line, self._next_offset = start_line, start_offset
+        if start_line:
+            logger.info(f"⏩ Resuming {path} at line {start_line}")
+        
+        queues = [queue.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(self.concurrency)]
+        workers = [
+            threading.Thread(target=self._work, args=(q,), name=f"insta-bot-replay-{i}", daemon=True)
+            for i, q in enumerate(queues)
+        ]
+        for worker in workers:
+            worker.start()
+        
+        started = time.perf_counter()
+        interrupted = False
+        try:
+            with _open(path) as f:
+                f.seek(start_offset)
+                offset = start_offset
+                line_no = start_line
+                for raw in f:
+                    if self.limit is not None and line_no - start_line >= self.limit:
+                        break
+                    offset += len(raw)
+                    self._dispatch(queues, line_no, raw, offset)
+                    line_no += 1
+                    if self.checkpoint and line_no % self.checkpoint_every == 0:
+                        self._save_checkpoint(path)
+        except KeyboardInterrupt:
+            # Events already queued are dropped; the checkpoint still points before them
+            interrupted = True
+            self._stopping = True
+            logger.warning("⚠️ Replay interrupted, saving checkpoint")
+        finally:
+            for q in queues:
+                q.put(None)
+            for worker in workers:
+                worker.join()
+            if self.checkpoint:
+                self._save_checkpoint(path)
+        
+        return self._summary(time.perf_counter() - started, start_line, interrupted)
+    
+    def _dispatch(self, queues: list, line_no: int, raw: bytes, end_offset: int):
+        """Queue a line's events on their senders' workers"""
+        self._stats["lines"] += 1
+        try:
+            events = _events(json.loads(raw)) if raw.strip() else []
+        except ValueError:
+            self._stats["invalid"] += 1
+            events = []
+        
+        with self._lock:
+            self._remaining[line_no] = [len(events), end_offset]
+        if not events:
+            self._line_done(line_no)
+            return
+        
+        self._stats["events"] += len(events)
+        for event, account_id in events:
+            sender_id = (event.get("sender") or {}).get("id")
+            queues[hash(sender_id) % len(queues)].put((line_no, event, account_id))
+    
+    def _work(self, q: queue.Queue):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            if self._stopping:
+                continue
+            
+            line_no, event, account_id = item
+            sink = self.bot.send_scheduler
+            sink.replaying(line_no)
+            start = time.perf_counter()
+            failed = False
+            try:
+                # The recording is the operator's own; attachment hosts are still checked
+                self.bot._handle_message(event, account_id, signed=True)
+                failed = sink.failed()
+            except Exception as e:
+                metrics.ERRORS.inc(component="replay")
+                logger.error(f"Error replaying line {line_no}: {e}")
+                failed = True
+            if failed:
+                with self._lock:
+                    self._stats["failed"] += 1
+            seconds = time.perf_counter() - start
+            
+            with self._lock:
+                self._latencies.append(seconds)
+                self._remaining[line_no][0] -= 1
+                finished = self._remaining[line_no][0] == 0
+            if finished:
+                self._line_done(line_no)
+    
+    def _line_done(self, line_no: int):
+        """Advance the checkpoint past every line finished so far, in order"""
+        with self._lock:
+            self._finished[line_no] = self._remaining.pop(line_no)[1]
+            while self._next_line in self._finished:
+                self._next_offset = self._finished.pop(self._next_line)
+                self._next_line += 1
+    
+    def _load_checkpoint(self, path: str) -> tuple:
+        """(line, byte offset) to resume from, or (0, 0)"""
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return 0, 0
+        with open(self.checkpoint) as f:
+            saved = json.load(f)
+        if saved.get("input") != os.path.abspath(path):
+            logger.warning(f"⚠️ Checkpoint {self.checkpoint} is for {saved.get('input')}, starting over")
+            return 0, 0
+        return saved["line"], saved["offset"]
+    
+    def _save_checkpoint(self, path: str):
+        """Write the checkpoint atomically"""
+        with self._lock:
+            saved = {
+                "input": os.path.abspath(path),
+                "line": self._next_line,
+                "offset": self._next_offset,
+                "saved_at": time.time(),
+            }
+        tmp_path = f"{self.checkpoint}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(saved, f)
+        os.replace(tmp_path, self.checkpoint)
+    
+    def _summary(self, seconds: float, start_line: int, interrupted: bool) -> dict:
+        with self._lock:
+            ordered = sorted(self._latencies)
+            replayed = len(ordered)
+        
+        def ms(value):
+            return round(value * 1000, 1) if value is not None else None
+        
+        return {
+            **self._stats,
+            "replayed": replayed,
+            "replies": self.bot.send_scheduler.replies,
+            "fallback_replies": self.bot.send_scheduler.fallbacks,
+            "reply_errors": self.bot.send_scheduler.errors,
+            "resumed_from": start_line,
+            "checkpoint_line": self._next_line,
+            "interrupted": interrupted,
+            "seconds": round(seconds, 2),
+            "events_per_second": round(replayed / seconds, 1) if seconds > 0 else None,
+            "latency_ms": {
+                "p50": ms(_percentile(ordered, 0.5)),
+                "p95": ms(_percentile(ordered, 0.95)),
+                "p99": ms(_percentile(ordered, 0.99)),
+                "max": ms(ordered[-1] if ordered else None),
+            },
+        }
@@ -0,0 +1,152 @@
+"""Reply cache for frequently asked questions"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from .config import Config
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+# Character n-gram size for similarity matching
+NGRAM = 3
+
+
+def normalize(text: str) -> str:
+    """Canonical form of a message: case, accents, punctuation and spacing folded"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    text = _NON_WORD.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def _ngrams(normalized: str) -> frozenset:
+    padded = f" {normalized} "
+    return frozenset(padded[i:i + NGRAM] for i in range(max(len(padded) - NGRAM + 1, 1)))
+
+
+def namespace_for(*parts: str) -> str:
+    """Cache namespace for a persona (e.g. model name and system prompt)"""
+    return hashlib.sha1("\x00".join(p or "" for p in parts).encode("utf-8")).hexdigest()[:16]
+
+
+class _Entry:
+    __slots__ = ("reply", "grams", "expires_at")
+    
+    def __init__(self, reply: str, grams: frozenset, expires_at: float):
+        self.reply = reply
+        self.grams = grams
+        self.expires_at = expires_at
+
+
+class ReplyCache:
+    """
+    Cache replies by normalized message, with n-gram similarity fallback
+    
+    Entries are namespaced (per persona) so different system prompts never
+    share answers. Exact matches on the normalized text are tried first,
+    then the most similar cached message by trigram Jaccard similarity.
+    """
+    
+    def __init__(self, ttl: float = None, max_entries: int = None, threshold: float = None):
+        """
+        Initialize the cache
+        
+        Args:
+            ttl: Seconds a cached reply stays valid
+            max_entries: Maximum cached replies across all namespaces (LRU eviction)
+            threshold: Minimum similarity (0-1) for a non-exact match; 1 disables fuzzy matching
+        """
+        self.ttl = ttl or Config.REPLY_CACHE_TTL
+        self.max_entries = max_entries or Config.REPLY_CACHE_MAX_ENTRIES
+        self.threshold = threshold or Config.REPLY_CACHE_THRESHOLD
+        
+        self._entries = OrderedDict()
+        self._index = {}
+        self._lock = threading.Lock()
+        self._stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "evictions": 0}
+    
+    def lookup(self, namespace: str, message: str) -> str:
+        """Return a cached reply for a message, or None"""
+        normalized = normalize(message)
+        if not normalized:
+            return None
+        
+        now = time.monotonic()
+        with self._lock:
+            key = (namespace, normalized)
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self._stats["exact_hits"] += 1
+                return entry.reply
+            
+            if self.threshold < 1:
+                match = self._most_similar(namespace, _ngrams(normalized), now)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self._stats["similar_hits"] += 1
+                    return self._entries[match].reply
+            
+            self._stats["misses"] += 1
+            return None
+    
+    def _most_similar(self, namespace: str, grams: frozenset, now: float):
+        """Key of the most similar live entry above the threshold (lock held)"""
+        overlap = {}
+        for gram in grams:
+            for key in self._index.get((namespace, gram), ()):
+                overlap[key] = overlap.get(key, 0) + 1
+        
+        best_key, best_score = None, self.threshold
+        for key, shared in overlap.items():
+            entry = self._entries[key]
+            score = shared / (len(grams) + len(entry.grams) - shared)
+            if score >= best_score and entry.expires_at > now:
+                best_key, best_score = key, score
+        return best_key
+    
+    def store(self, namespace: str, message: str, reply: str):
+        """Cache the reply generated for a message"""
+        normalized = normalize(message)
+        if not normalized or not reply:
+            return
+        
+        key = (namespace, normalized)
+        entry = _Entry(reply, _ngrams(normalized), time.monotonic() + self.ttl)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            for gram in entry.grams:
+                self._index.setdefault((namespace, gram), set()).add(key)
+            
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+    
+    def _remove(self, key):
+        """Drop an entry and its index postings (lock held)"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        namespace = key[0]
+        for gram in entry.grams:
+            postings = self._index.get((namespace, gram))
+            if postings is not None:
+                postings.discard(key)
+                if not postings:
+                    del self._index[(namespace, gram)]
+    
+    def stats(self) -> dict:
+        """Hit rate counters"""
+        with self._lock:
+            hits = self._stats["exact_hits"] + self._stats["similar_hits"]
+            lookups = hits + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,251 @@
+"""Deadlines, hedged requests and circuit breakers for upstream calls"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from . import metrics
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Successful calls needed before the latency quantile is trusted for hedging
+MIN_LATENCY_SAMPLES = 20
+
+
+class CircuitOpenError(Exception):
+    """Raised when no upstream is available because every circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing upstream for a while
+    
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls are refused for `reset_timeout` seconds. Then a single trial call
+    is let through (half-open); its outcome closes or re-opens the circuit.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, name: str, failure_threshold: int = None, reset_timeout: float = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or Config.GEMINI_BREAKER_FAILURES
+        self.reset_timeout = Config.GEMINI_BREAKER_RESET if reset_timeout is None else reset_timeout
+        
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+    
+    def allow(self) -> bool:
+        """Whether a call may be made now; every allowed call must be recorded"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+            # Half-open: one trial call at a time
+            if self._trial:
+                return False
+            self._trial = True
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"✅ Circuit for {self.name} closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial = False
+    
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"⚠️ Circuit for {self.name} opened after {self._failures} failures")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class LatencyWindow:
+    """Durations of the most recent successful calls"""
+    
+    def __init__(self, size: int = 200):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+    
+    def add(self, seconds: float):
+        with self._lock:
+            self._values.append(seconds)
+    
+    def quantile(self, q: float) -> float:
+        """The q-quantile of recent latencies, or None until there are enough samples"""
+        with self._lock:
+            if len(self._values) < MIN_LATENCY_SAMPLES:
+                return None
+            ordered = sorted(self._values)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Upstream:
+    """Health of one upstream (a Gemini model): its circuit breaker and recent latencies"""
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker(name)
+        self.latency = LatencyWindow()
+    
+    def record_success(self, seconds: float):
+        self.breaker.record_success()
+        self.latency.add(seconds)
+    
+    def record_failure(self):
+        self.breaker.record_failure()
+    
+    def stats(self) -> dict:
+        p95 = self.latency.quantile(0.95)
+        return {
+            "circuit": self.breaker.state,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+_upstreams = {}
+_executor = None
+_lock = threading.Lock()
+
+
+def get_upstream(name: str) -> Upstream:
+    """The shared health record for an upstream, so every handler sees the same circuit"""
+    with _lock:
+        upstream = _upstreams.get(name)
+        if upstream is None:
+            upstream = _upstreams[name] = Upstream(name)
+        return upstream
+
+
+def upstream_stats() -> dict:
+    """Circuit state and p95 latency per upstream"""
+    with _lock:
+        upstreams = list(_upstreams.values())
+    return {upstream.name: upstream.stats() for upstream in upstreams}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    # Shared by all handlers; a call abandoned at its deadline keeps its
+    # thread until the HTTP request's own timeout ends it
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=Config.GEMINI_CALL_THREADS, thread_name_prefix="insta-bot-gemini"
+            )
+        return _executor
+
+
+def call_with_deadline(fn, timeout: float, hedge_after: float = None, name: str = ""):
+    """
+    Run fn() on a worker thread, waiting at most `timeout` seconds
+    
+    With `hedge_after`, an identical second attempt is started if the first
+    hasn't finished by then, and whichever succeeds first wins.
+    
+    Raises:
+        TimeoutError: No attempt finished in time
+        Exception: The last attempt's error, if every attempt failed
+    """
+    executor = _get_executor()
+    start = time.monotonic()
+    deadline = start + timeout
+    hedge_at = start + hedge_after if hedge_after is not None else None
+    first = executor.submit(fn)
+    pending = {first}
+    hedged = False
+    error = None
+    
+    while pending:
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        until = deadline if hedge_at is None else min(deadline, hedge_at)
+        done, pending = wait(pending, timeout=max(until - now, 0), return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                error = e
+                continue
+            if hedged:
+                metrics.HEDGED_REQUESTS.inc(upstream=name, winner="primary" if future is first else "hedge")
+            return result
+        
+        if hedge_at is not None and pending and time.monotonic() >= hedge_at:
+            pending.add(executor.submit(fn))
+            hedge_at = None
+            hedged = True
+    
+    if hedged:
+        metrics.HEDGED_REQUESTS.inc(upstream=name, winner="none")
+    if error is not None and not pending:
+        raise error
+    raise TimeoutError(f"{name or 'Call'} did not answer within {timeout:.1f}s")
+
+
+async def call_with_deadline_async(fn, timeout: float, hedge_after: float = None, name: str = ""):
+    """
+    Await fn() for at most `timeout` seconds, hedging like call_with_deadline
+    
+    Unlike threads, attempts still running when this returns are cancelled.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    hedge_at = start + hedge_after if hedge_after is not None else None
+    first = asyncio.ensure_future(fn())
+    pending = {first}
+    hedged = False
+    error = None
+    
+    try:
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            until = deadline if hedge_at is None else min(deadline, hedge_at)
+            done, pending = await asyncio.wait(
+                pending, timeout=max(until - now, 0), return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                if hedged:
+                    metrics.HEDGED_REQUESTS.inc(upstream=name, winner="primary" if task is first else "hedge")
+                return task.result()
+            
+            if hedge_at is not None and pending and time.monotonic() >= hedge_at:
+                pending.add(asyncio.ensure_future(fn()))
+                hedge_at = None
+                hedged = True
+    finally:
+        for task in pending:
+            task.cancel()
+    
+    if hedged:
+        metrics.HEDGED_REQUESTS.inc(upstream=name, winner="none")
+    if error is not None and not pending:
+        raise error
+    raise TimeoutError(f"{name or 'Call'} did not answer within {timeout:.1f}s")
@@ -0,0 +1,249 @@
+"""History retention: expire old messages, archive them compressed and reclaim space"""
+import gzip
+import json
+import logging
+import time
+import zlib
+from datetime import datetime, timedelta
+from itertools import groupby
+from .config import Config
+from .conversation_store import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+# Free pages released per incremental vacuum step
+VACUUM_PAGES = 2000
+
+
+class RetentionJob:
+    """
+    Enforce per-user message limits and a maximum message age
+    
+    Work is done in small batches, each in its own short write transaction,
+    so the job can run while the bot is serving traffic. Removed messages
+    are archived (zlib-compressed JSON per user and batch) unless disabled.
+    Bot processes notice removals through HISTORY_CACHE_VALIDATE; a history
+    cache in this process can be passed to have its users invalidated.
+    """
+    
+    def __init__(self, db_path: str = None, max_messages: int = None, max_age_days: float = None,
+                 batch_size: int = None, archive: bool = None, archive_file: str = None, pause: float = None,
+                 cache=None):
+        """
+        Initialize the job
+        
+        Args:
+            db_path: SQLite database (default: from config)
+            max_messages: Messages kept per user, 0 for no limit
+            max_age_days: Messages older than this are removed, 0 for no limit
+            batch_size: Messages removed per transaction
+            archive: Keep removed messages in the messages_archive table
+            archive_file: Also append removed messages to this gzipped NDJSON file
+            pause: Seconds to sleep between batches, giving writers room
+            cache: HistoryCache whose users are invalidated when their messages are removed
+        """
+        self.db = ConnectionManager(db_path or Config.DB_PATH)
+        self.max_messages = Config.RETENTION_MAX_MESSAGES if max_messages is None else max_messages
+        self.max_age_days = Config.RETENTION_MAX_AGE_DAYS if max_age_days is None else max_age_days
+        self.batch_size = batch_size or Config.RETENTION_BATCH_SIZE
+        self.archive = Config.RETENTION_ARCHIVE if archive is None else archive
+        self.archive_file = archive_file
+        self.pause = Config.RETENTION_PAUSE if pause is None else pause
+        self.cache = cache
+        
+        self._report = None
+    
+    def run(self, vacuum: bool = True, full_vacuum: bool = False) -> dict:
+        """
+        Apply the retention rules
+        
+        Args:
+            vacuum: Return freed pages to the filesystem with incremental VACUUM
+            full_vacuum: Run a one-off blocking VACUUM that also switches the
+                database to incremental auto-vacuum, if it isn't already
+        
+        Returns:
+            Counts of removed and archived messages and bytes reclaimed
+        """
+        self._report = {
+            "expired": 0,
+            "trimmed": 0,
+            "archived_messages": 0,
+            "archive_bytes": 0,
+            "bytes_before": self._database_bytes(),
+        }
+        started = time.monotonic()
+        self._initialize_archive()
+        
+        if self.max_age_days:
+            self._expire_old()
+        if self.max_messages:
+            self._trim_users()
+        
+        if full_vacuum:
+            self._full_vacuum()
+        elif vacuum:
+            self._incremental_vacuum()
+        
+        report = self._report
+        report["bytes_after"] = self._database_bytes()
+        report["bytes_reclaimed"] = max(report["bytes_before"] - report["bytes_after"], 0)
+        report["seconds"] = round(time.monotonic() - started, 2)
+        logger.info(
+            f"🧹 Retention removed {report['expired'] + report['trimmed']} messages, "
+            f"reclaimed {report['bytes_reclaimed']} bytes"
+        )
+        return report
+    
+    def _initialize_archive(self):
+        if not self.archive:
+            return
+        with self.db.connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages_archive (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    first_id INTEGER NOT NULL,
+                    last_id INTEGER NOT NULL,
+                    message_count INTEGER NOT NULL,
+                    archived_at TEXT NOT NULL,
+                    data BLOB NOT NULL
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_messages_archive_user_id ON messages_archive (user_id, first_id)"
+            )
+    
+    def _expire_old(self):
+        """Remove messages older than max_age_days, oldest first"""
+        cutoff = (datetime.now() - timedelta(days=self.max_age_days)).isoformat()
+        after = 0
+        while True:
+            # Ids grow with time, so expired messages sit at the start of the table: walk
+            # the primary key up to the first message that is still fresh (timestamp has no index)
+            rows = self.db.connection().execute(
+                "SELECT id, timestamp FROM messages WHERE id > ? ORDER BY id LIMIT ?", (after, self.batch_size)
+            ).fetchall()
+            expired = [message_id for message_id, timestamp in rows if timestamp < cutoff]
+            if expired:
+                self._report["expired"] += self._remove_batch(
+                    """
+                    SELECT id, user_id, role, content, timestamp FROM messages
+                    WHERE id > ? AND id <= ? AND timestamp < ? ORDER BY id
+                    """,
+                    (after, expired[-1], cutoff),
+                )
+            if len(expired) < self.batch_size:
+                return
+            after = expired[-1]
+            time.sleep(self.pause)
+    
+    def _trim_users(self):
+        """Remove each user's messages beyond the newest max_messages"""
+        users = self.db.connection().execute(
+            "SELECT user_id FROM messages GROUP BY user_id HAVING COUNT(*) > ?", (self.max_messages,)
+        ).fetchall()
+        
+        for (user_id,) in users:
+            while True:
+                removed = self._remove_batch(
+                    """
+                    SELECT id, user_id, role, content, timestamp FROM messages
+                    WHERE user_id = ? AND id <= (
+                        SELECT id FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+                    )
+                    ORDER BY id LIMIT ?
+                    """,
+                    (user_id, user_id, self.max_messages, self.batch_size),
+                )
+                self._report["trimmed"] += removed
+                if removed < self.batch_size:
+                    break
+                time.sleep(self.pause)
+    
+    def _remove_batch(self, query: str, params: tuple) -> int:
+        """Archive and delete the rows selected by query in one short transaction"""
+        conn = self.db.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(query, params).fetchall()
+            if not rows:
+                return 0
+            
+            if self.archive:
+                self._archive_rows(conn, rows)
+            if self.archive_file:
+                self._append_archive_file(rows)
+            conn.executemany("DELETE FROM messages WHERE id = ?", [(row[0],) for row in rows])
+        
+        if self.cache is not None:
+            for user_id in {row[1] for row in rows}:
+                self.cache.invalidate(user_id)
+        return len(rows)
+    
+    def _archive_rows(self, conn, rows: list):
+        """Store rows as one compressed blob per user"""
+        archived_at = datetime.now().isoformat()
+        for user_id, group in groupby(sorted(rows, key=lambda r: (r[1], r[0])), key=lambda r: r[1]):
+            messages = [
+                {"id": row[0], "role": row[2], "content": row[3], "timestamp": row[4]} for row in group
+            ]
+            blob = zlib.compress(json.dumps(messages, ensure_ascii=False).encode("utf-8"), 9)
+            conn.execute(
+                """
+                INSERT INTO messages_archive (user_id, first_id, last_id, message_count, archived_at, data)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (user_id, messages[0]["id"], messages[-1]["id"], len(messages), archived_at, blob)
+            )
+            self._report["archived_messages"] += len(messages)
+            self._report["archive_bytes"] += len(blob)
+    
+    def _append_archive_file(self, rows: list):
+        # Each append adds a gzip member; readers see one continuous NDJSON stream
+        with gzip.open(self.archive_file, "at", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(
+                    {"id": row[0], "user_id": row[1], "role": row[2], "content": row[3], "timestamp": row[4]},
+                    ensure_ascii=False
+                ) + "\n")
+    
+    def _incremental_vacuum(self):
+        """Release free pages a slice at a time (needs auto_vacuum = INCREMENTAL)"""
+        conn = self.db.connection()
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if mode != 2:
+            logger.warning("⚠️ auto_vacuum is not INCREMENTAL; run once with full_vacuum to enable it")
+            return
+        
+        while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+            conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()
+            time.sleep(self.pause)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    
+    def _full_vacuum(self):
+        """Rebuild the database file, enabling incremental auto-vacuum (blocks writers)"""
+        conn = self.db.connection()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    
+    def _database_bytes(self) -> int:
+        """Size of the database file (free pages included until they are vacuumed)"""
+        conn = self.db.connection()
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        return page_size * page_count
+    
+    def close(self):
+        """Close database connections"""
+        self.db.close()
+
+
+def read_archive(user_id: str, db_path: str = None) -> list:
+    """Return a user's archived messages, oldest first"""
+    with ConnectionManager(db_path or Config.DB_PATH) as db:
+        rows = db.connection().execute(
+            "SELECT data FROM messages_archive WHERE user_id = ? ORDER BY first_id", (user_id,)
+        ).fetchall()
+    return [message for (blob,) in rows for message in json.loads(zlib.decompress(blob))]
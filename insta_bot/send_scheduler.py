@@ -0,0 +1,488 @@
+"""Rate-limit aware outbound message scheduler"""
+import heapq
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+import requests
+from .config import Config
+from .conversation_store import ConnectionManager
+from .instagram_api import InstagramAPI
+
+logger = logging.getLogger(__name__)
+
+# Graph API error codes that mean "slow down" rather than "this request is bad"
+RATE_LIMIT_CODES = {4, 17, 32, 613}
+
+# Headers reporting rate-limit usage as percentages of the allowance
+USAGE_HEADERS = ("x-app-usage", "x-business-use-case-usage", "x-page-usage")
+
+
+class TokenBucket:
+    """Token bucket allowing `rate` events per second with bursts up to `capacity`"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def take(self, now: float = None) -> float:
+        """
+        Take a token if one is available
+        
+        Returns:
+            0 if a token was taken, otherwise seconds until one is available
+        """
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+    
+    def is_full(self, now: float = None) -> bool:
+        self._refill(time.monotonic() if now is None else now)
+        return self.tokens >= self.capacity
+
+
+def _usage_percent(headers) -> float:
+    """Highest usage percentage reported in the Graph API usage headers"""
+    highest = 0.0
+    for name in USAGE_HEADERS:
+        raw = headers.get(name)
+        if not raw:
+            continue
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            continue
+        
+        # x-business-use-case-usage maps ids to lists of usage dicts
+        entries = [data] if isinstance(data, dict) and "call_count" in data else []
+        if isinstance(data, dict) and not entries:
+            for value in data.values():
+                entries.extend(value if isinstance(value, list) else [value])
+        
+        for entry in entries:
+            if isinstance(entry, dict):
+                for key in ("call_count", "total_time", "total_cputime"):
+                    try:
+                        highest = max(highest, float(entry.get(key) or 0))
+                    except (TypeError, ValueError):
+                        pass
+    return highest
+
+
+def _regain_seconds(headers) -> float:
+    """Seconds until access is regained, from x-business-use-case-usage (0 if unknown)"""
+    raw = headers.get("x-business-use-case-usage")
+    if not raw:
+        return 0.0
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return 0.0
+    
+    minutes = 0.0
+    for value in data.values() if isinstance(data, dict) else []:
+        for entry in value if isinstance(value, list) else [value]:
+            if isinstance(entry, dict):
+                try:
+                    minutes = max(minutes, float(entry.get("estimated_time_to_regain_access") or 0))
+                except (TypeError, ValueError):
+                    pass
+    return minutes * 60
+
+
+class _Outbound:
+    """A queued outbound message"""
+    
+    __slots__ = ("id", "recipient_id", "text", "attempts", "tenant_id")
+    
+    def __init__(self, message_id: int, recipient_id: str, text: str, attempts: int = 0, tenant_id: str = None):
+        self.id = message_id
+        self.recipient_id = recipient_id
+        self.text = text
+        self.attempts = attempts
+        self.tenant_id = tenant_id
+    
+    @property
+    def key(self) -> str:
+        """Queue key: the recipient, scoped to the sending account in multi-tenant mode"""
+        if self.tenant_id is None:
+            return self.recipient_id
+        return f"{self.tenant_id}:{self.recipient_id}"
+
+
+class SendScheduler:
+    """
+    Queue outbound messages and send them within Graph API rate limits
+    
+    Messages are persisted before sending and deleted once delivered, so
+    replies survive rate limiting and restarts. Each recipient's messages
+    are sent in order, one at a time.
+    """
+    
+    def __init__(self, instagram_api: InstagramAPI, db_path: str = None, concurrency: int = None, api_for=None):
+        """
+        Initialize the scheduler
+        
+        Args:
+            instagram_api: Client used to deliver messages
+            api_for: Called with a tenant id to get that account's client (multi-tenant mode)
+            db_path: SQLite database for the persisted queue (default: from config)
+            concurrency: Number of sender threads (default: from config)
+        """
+        self.instagram_api = instagram_api
+        self.api_for = api_for
+        self.db = ConnectionManager(db_path or Config.DB_PATH)
+        self.concurrency = concurrency or Config.SEND_CONCURRENCY
+        # Identifies this process's claim on persisted messages
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        
+        self._global = TokenBucket(Config.SEND_RATE, Config.SEND_BURST)
+        self._buckets = {}
+        self._pending = {}
+        self._ready = []
+        self._seq = 0
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._usage = 0.0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+        self._stats = {"sent": 0, "retried": 0, "rate_limited": 0, "dropped": 0}
+        
+        self._initialize_db()
+    
+    def _initialize_db(self):
+        """Create the outbound queue table"""
+        with self.db.connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbound_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    recipient_id TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    owner TEXT,
+                    claimed_at REAL NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    tenant_id TEXT
+                )
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(outbound_messages)")}
+            if "tenant_id" not in columns:
+                conn.execute("ALTER TABLE outbound_messages ADD COLUMN tenant_id TEXT")
+    
+    def start(self):
+        """Recover persisted messages and start the sender threads"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        
+        self._recover()
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name=f"insta-bot-sender-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        
+        housekeeper = threading.Thread(target=self._housekeeping, name="insta-bot-sender-lease", daemon=True)
+        housekeeper.start()
+        self._threads.append(housekeeper)
+        logger.info(f"✅ Send scheduler started ({Config.SEND_RATE}/s, {self.concurrency} senders)")
+    
+    def submit(self, recipient_id: str, text: str, tenant_id: str = None) -> bool:
+        """Persist a message and queue it for delivery (from tenant_id's account, if given)"""
+        try:
+            with self.db.connection() as conn:
+                cursor = conn.execute(
+                    """
+                    INSERT INTO outbound_messages (recipient_id, text, owner, claimed_at, tenant_id)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (recipient_id, text, self.owner, time.time(), tenant_id)
+                )
+            message = _Outbound(cursor.lastrowid, recipient_id, text, tenant_id=tenant_id)
+        except Exception as e:
+            logger.error(f"Error persisting outbound message: {e}")
+            message = _Outbound(None, recipient_id, text, tenant_id=tenant_id)
+        
+        with self._cond:
+            self._enqueue(message)
+        return True
+    
+    def _enqueue(self, message: _Outbound):
+        """Add a message to its recipient's queue (lock held)"""
+        queue = self._pending.get(message.key)
+        if queue is None:
+            queue = self._pending[message.key] = deque()
+            self._schedule(message.key, time.monotonic())
+        queue.append(message)
+        self._cond.notify()
+    
+    def _schedule(self, recipient_id: str, due: float):
+        """Make a recipient eligible for sending at `due` (lock held)"""
+        self._seq += 1
+        heapq.heappush(self._ready, (due, self._seq, recipient_id))
+        self._cond.notify()
+    
+    def _next(self):
+        """Wait for a recipient whose next message can be sent now"""
+        with self._cond:
+            while self._running:
+                now = time.monotonic()
+                if not self._ready:
+                    self._cond.wait(timeout=1.0)
+                    continue
+                
+                due, _, recipient_id = self._ready[0]
+                wait = max(due, self._paused_until) - now
+                if wait > 0:
+                    self._cond.wait(timeout=min(wait, 1.0))
+                    continue
+                heapq.heappop(self._ready)
+                
+                bucket = self._buckets.get(recipient_id)
+                if bucket is None:
+                    bucket = self._buckets[recipient_id] = TokenBucket(
+                        Config.SEND_RECIPIENT_RATE, Config.SEND_RECIPIENT_BURST
+                    )
+                wait = bucket.take(now)
+                if wait:
+                    self._schedule(recipient_id, now + wait)
+                    continue
+                wait = self._global.take(now)
+                if wait:
+                    bucket.tokens += 1
+                    self._schedule(recipient_id, now + wait)
+                    continue
+                
+                self._in_flight += 1
+                return self._pending[recipient_id][0]
+            return None
+    
+    def _run(self):
+        """Sender loop"""
+        while True:
+            message = self._next()
+            if message is None:
+                return
+            try:
+                outcome, delay = self._deliver(message)
+            except Exception as e:
+                logger.error(f"Error sending message: {e}")
+                outcome, delay = "retry", self._backoff(message.attempts)
+            self._finish(message, outcome, delay)
+    
+    def _deliver(self, message: _Outbound) -> tuple:
+        """
+        Send one message
+        
+        Returns:
+            (outcome, retry_delay) where outcome is "sent", "retry", "rate_limited" or "failed"
+        """
+        instagram_api = self.instagram_api
+        if message.tenant_id is not None and self.api_for is not None:
+            instagram_api = self.api_for(message.tenant_id)
+            if instagram_api is None:
+                logger.error(f"❌ Dropping message for unknown tenant {message.tenant_id}")
+                return "failed", 0.0
+        
+        try:
+            response = instagram_api.post_message(message.recipient_id, message.text)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"⚠️ Send to {message.recipient_id} failed, will retry: {e}")
+            return "retry", self._backoff(message.attempts)
+        
+        self._observe_usage(response.headers)
+        if response.ok:
+            logger.info(f"✅ Message sent to {message.recipient_id}")
+            return "sent", 0.0
+        
+        try:
+            error = response.json().get("error", {})
+        except ValueError:
+            error = {}
+        
+        if response.status_code == 429 or error.get("code") in RATE_LIMIT_CODES:
+            delay = max(self._backoff(message.attempts), _regain_seconds(response.headers))
+            logger.warning(f"⚠️ Rate limited by Graph API, backing off {delay:.1f}s")
+            return "rate_limited", delay
+        if response.status_code >= 500:
+            return "retry", self._backoff(message.attempts)
+        
+        logger.error(f"❌ Failed to send message to {message.recipient_id}: {response.status_code} {error}")
+        return "failed", 0.0
+    
+    def _backoff(self, attempts: int) -> float:
+        """Exponential backoff with full jitter"""
+        delay = min(Config.SEND_BACKOFF_MAX, Config.SEND_BACKOFF_BASE * (2 ** attempts))
+        return random.uniform(delay / 2, delay)
+    
+    def _observe_usage(self, headers):
+        """Slow down as the app approaches its rate limit"""
+        usage = _usage_percent(headers)
+        threshold = Config.SEND_USAGE_THRESHOLD
+        with self._cond:
+            self._usage = usage
+            if usage >= 100:
+                self._paused_until = max(self._paused_until, time.monotonic() + max(_regain_seconds(headers), 60))
+            elif usage > threshold:
+                factor = max(0.1, (100 - usage) / (100 - threshold))
+                self._global.rate = Config.SEND_RATE * factor
+            else:
+                self._global.rate = Config.SEND_RATE
+    
+    def _finish(self, message: _Outbound, outcome: str, delay: float):
+        """Record a send attempt and reschedule the recipient"""
+        done = outcome in ("sent", "failed")
+        if not done:
+            message.attempts += 1
+            # Rate limiting only delays a message; other errors eventually drop it
+            if outcome == "retry" and message.attempts > Config.SEND_MAX_RETRIES:
+                logger.error(f"❌ Giving up on message to {message.recipient_id} after {message.attempts} attempts")
+                outcome, done = "failed", True
+        
+        self._persist_attempt(message, done)
+        
+        with self._cond:
+            self._in_flight -= 1
+            queue = self._pending[message.key]
+            now = time.monotonic()
+            
+            if outcome == "sent":
+                self._stats["sent"] += 1
+            elif outcome == "failed":
+                self._stats["dropped"] += 1
+            elif outcome == "rate_limited":
+                self._stats["rate_limited"] += 1
+                self._paused_until = max(self._paused_until, now + delay)
+            else:
+                self._stats["retried"] += 1
+            
+            if done:
+                queue.popleft()
+            if queue:
+                self._schedule(message.key, now + (0 if done else delay))
+            else:
+                del self._pending[message.key]
+            self._cond.notify_all()
+    
+    def _persist_attempt(self, message: _Outbound, done: bool):
+        if message.id is None:
+            return
+        try:
+            with self.db.connection() as conn:
+                if done:
+                    conn.execute("DELETE FROM outbound_messages WHERE id = ?", (message.id,))
+                else:
+                    conn.execute(
+                        "UPDATE outbound_messages SET attempts = ? WHERE id = ?", (message.attempts, message.id)
+                    )
+        except Exception as e:
+            logger.error(f"Error updating outbound message: {e}")
+    
+    def _recover(self):
+        """Claim messages left by stopped processes and queue them"""
+        now = time.time()
+        # Claim under a one-off token so rows this process just submitted aren't queued twice
+        claim = f"{self.owner}/{uuid.uuid4().hex[:8]}"
+        try:
+            with self.db.connection() as conn:
+                conn.execute(
+                    "UPDATE outbound_messages SET owner = ?, claimed_at = ? WHERE owner != ? AND claimed_at < ?",
+                    (claim, now, self.owner, now - Config.SEND_LEASE_SECONDS)
+                )
+                rows = conn.execute(
+                    """
+                    SELECT id, recipient_id, text, attempts, tenant_id FROM outbound_messages
+                    WHERE owner = ? ORDER BY id
+                    """,
+                    (claim,)
+                ).fetchall()
+                conn.execute("UPDATE outbound_messages SET owner = ? WHERE owner = ?", (self.owner, claim))
+        except Exception as e:
+            logger.error(f"Error recovering outbound messages: {e}")
+            return
+        
+        recovered = [_Outbound(*row) for row in rows]
+        with self._cond:
+            for message in recovered:
+                self._enqueue(message)
+        if recovered:
+            logger.info(f"📤 Recovered {len(recovered)} unsent messages")
+    
+    def _housekeeping(self):
+        """Renew this process's lease, pick up orphaned messages and drop idle buckets"""
+        interval = Config.SEND_LEASE_SECONDS / 3
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: not self._running, timeout=interval)
+                if not self._running:
+                    return
+                for recipient_id in [r for r, b in self._buckets.items() if r not in self._pending and b.is_full()]:
+                    del self._buckets[recipient_id]
+            
+            try:
+                with self.db.connection() as conn:
+                    conn.execute(
+                        "UPDATE outbound_messages SET claimed_at = ? WHERE owner = ?", (time.time(), self.owner)
+                    )
+            except Exception as e:
+                logger.error(f"Error renewing outbound lease: {e}")
+            self._recover()
+    
+    def stats(self) -> dict:
+        """Queue and delivery counters"""
+        with self._cond:
+            return {
+                **self._stats,
+                "queued": sum(len(q) for q in self._pending.values()),
+                "in_flight": self._in_flight,
+                "recipients": len(self._pending),
+                "rate": round(self._global.rate, 2),
+                "usage_percent": self._usage,
+                "paused_for": round(max(self._paused_until - time.monotonic(), 0), 1),
+            }
+    
+    def shutdown(self, timeout: float = None):
+        """
+        Send what can be sent within `timeout`, then stop
+        
+        Unsent messages stay in the database and are picked up by the next
+        process to start.
+        """
+        timeout = Config.SHUTDOWN_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        
+        with self._cond:
+            if not self._running:
+                return
+            self._cond.wait_for(lambda: not self._pending, timeout=timeout)
+            self._running = False
+            # Anything still queued is left for the next process
+            left = sum(len(q) for q in self._pending.values())
+            self._ready.clear()
+            self._cond.notify_all()
+        
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        
+        if left:
+            try:
+                with self.db.connection() as conn:
+                    conn.execute("UPDATE outbound_messages SET claimed_at = 0 WHERE owner = ?", (self.owner,))
+            except Exception as e:
+                logger.error(f"Error releasing outbound messages: {e}")
+            logger.warning(f"⚠️ {left} messages left unsent in the outbound queue")
+        self.db.close()
@@ -0,0 +1,153 @@
+"""Multi-tenant routing: many Instagram accounts and personas in one process"""
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .chat_sessions import ChatSessionPool
+from .config import Config
+from .conversation_store import BaseConversationStore
+from .gemini_handler import GeminiHandler
+from .instagram_api import InstagramAPI
+from .profile_cache import ProfileCache
+from .reply_cache import ReplyCache
+
+logger = logging.getLogger(__name__)
+
+
+class Tenant:
+    """One Instagram account served by the bot"""
+    
+    __slots__ = ("id", "name", "access_token", "instructions", "model")
+    
+    def __init__(self, tenant_id: str, access_token: str, name: str = None, instructions: str = None,
+                 model: str = None):
+        self.id = tenant_id
+        self.access_token = access_token
+        self.name = name or tenant_id
+        self.instructions = instructions or Config.BOT_INSTRUCTIONS
+        self.model = model or Config.GEMINI_MODEL
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> "Tenant":
+        """
+        Build a tenant from its entry in the tenants file
+        
+        The token may be given inline as "access_token" or, to keep secrets
+        out of the file, as the name of an environment variable in "access_token_env".
+        """
+        tenant_id = str(data.get("id") or "")
+        token = data.get("access_token") or os.getenv(data.get("access_token_env") or "")
+        if not tenant_id or not token:
+            raise ValueError(f"Tenant entry needs an id and an access token: {data.get('name') or tenant_id}")
+        return cls(tenant_id, token, data.get("name"), data.get("instructions"), data.get("model"))
+
+
+class TenantRegistry:
+    """
+    Route webhook entries to per-account API clients and Gemini handlers
+    
+    Tenants are read from a JSON file; their clients are created on first
+    use and cached (LRU). All tenants share the HTTP connection pool, the
+    conversation store, the reply cache, one GenerativeModel per model name
+    and one summary thread.
+    """
+    
+    def __init__(self, tenants: list, conversation_store: BaseConversationStore, session=None,
+                 reply_cache: ReplyCache = None, models: dict = None, cache_size: int = None,
+                 chat_sessions: ChatSessionPool = None, profiles: ProfileCache = None):
+        """
+        Initialize the registry
+        
+        Args:
+            tenants: Tenant instances
+            conversation_store: Store shared by every tenant
+            session: Shared requests.Session for Graph API calls
+            reply_cache: Shared reply cache (entries are namespaced per persona)
+            models: GenerativeModels by model name and persona, shared with the handlers (which add missing ones)
+            cache_size: Maximum tenants with live clients (default: from config)
+            chat_sessions: Shared pool of chat sessions (keyed by conversation id, so tenants never collide)
+            profiles: Shared cache of senders' profiles (also keyed by conversation id)
+        """
+        self.tenants = {tenant.id: tenant for tenant in tenants}
+        self.conversation_store = conversation_store
+        self.session = session
+        self.reply_cache = reply_cache
+        self.chat_sessions = chat_sessions
+        self.profiles = profiles
+        self.cache_size = cache_size or Config.TENANT_CACHE_SIZE
+        
+        self._models = {} if models is None else models
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self._summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="insta-bot-tenant-summary")
+    
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "TenantRegistry":
+        """Read tenants from a JSON file: a list of entries, or {"tenants": [...]}"""
+        with open(path) as f:
+            data = json.load(f)
+        entries = data.get("tenants", []) if isinstance(data, dict) else data
+        tenants = [Tenant.from_dict(entry) for entry in entries]
+        logger.info(f"✅ Loaded {len(tenants)} tenants from {path}")
+        return cls(tenants, **kwargs)
+    
+    def resolve(self, *candidate_ids: str) -> Tenant:
+        """Return the tenant for the first matching id (webhook entry id, then recipient id)"""
+        for candidate in candidate_ids:
+            tenant = self.tenants.get(str(candidate)) if candidate else None
+            if tenant is not None:
+                return tenant
+        return None
+    
+    def clients(self, tenant_id: str) -> tuple:
+        """
+        Get (InstagramAPI, GeminiHandler) for a tenant, creating them on first use
+        
+        Returns:
+            The clients, or (None, None) for an unknown tenant
+        """
+        with self._lock:
+            clients = self._clients.get(tenant_id)
+            if clients is not None:
+                self._clients.move_to_end(tenant_id)
+                return clients
+            
+            tenant = self.tenants.get(tenant_id)
+            if tenant is None:
+                return None, None
+            
+            handler = GeminiHandler(
+                system_prompt=tenant.instructions,
+                model=tenant.model,
+                conversation_store=self.conversation_store,
+                reply_cache=self.reply_cache,
+                models=self._models,
+                summary_executor=self._summary_executor,
+                sessions=self.chat_sessions,
+                profiles=self.profiles,
+            )
+            api = InstagramAPI(access_token=tenant.access_token, session=self.session)
+            
+            clients = self._clients[tenant_id] = (api, handler)
+            while len(self._clients) > self.cache_size:
+                self._clients.popitem(last=False)
+            return clients
+    
+    def api(self, tenant_id: str) -> InstagramAPI:
+        """API client for a tenant, or None if unknown"""
+        return self.clients(tenant_id)[0]
+    
+    def stats(self) -> dict:
+        """Tenant counts"""
+        with self._lock:
+            return {
+                "tenants": len(self.tenants),
+                "loaded": len(self._clients),
+                "models": len(self._models),
+            }
+    
+    def close(self):
+        """Wait for pending background summaries"""
+        self._summary_executor.shutdown(wait=True)
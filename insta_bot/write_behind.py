@@ -0,0 +1,332 @@
+"""Write-behind buffering of conversation messages"""
+import glob
+import json
+import logging
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks (Windows): only one process may share a journal path
+    fcntl = None
+
+from . import metrics
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Buffer appended messages and write them to SQLite in batched transactions
+    
+    Message ids are handed out from blocks reserved in sqlite_sequence, so
+    callers get a final id immediately and other processes' AUTOINCREMENT
+    ids never collide with buffered ones. With a journal, each message is
+    appended to an append-only file before add_message returns and replayed
+    on the next start if the process dies before flushing.
+    
+    The journal path is a prefix: each process writes its own files
+    (PATH.<pid>, rotated to PATH.<pid>.<n>) and holds a lock on PATH.<pid>.lock
+    while it runs. At start, only files whose owner's lock is free (the
+    process is gone) are replayed, so gunicorn workers sharing the setting
+    never touch each other's journals.
+    """
+    
+    def __init__(self, db, batch_size: int = None, interval: float = None, journal_path: str = None,
+                 fsync: bool = None, id_block: int = None):
+        """
+        Initialize the buffer
+        
+        Args:
+            db: ConnectionManager for the conversation database
+            batch_size: Pending messages that trigger a flush
+            interval: Longest time in seconds a message stays buffered
+            journal_path: Append-only crash journal (default: from config; empty disables)
+            fsync: fsync the journal on every message (survives power loss, not just crashes)
+            id_block: Message ids reserved per sqlite_sequence update
+        """
+        self.db = db
+        self.batch_size = batch_size or Config.WRITE_BEHIND_BATCH
+        self.interval = interval or Config.WRITE_BEHIND_INTERVAL
+        self.journal_path = Config.WRITE_BEHIND_JOURNAL if journal_path is None else journal_path
+        self.fsync = Config.WRITE_BEHIND_FSYNC if fsync is None else fsync
+        self.id_block = id_block or Config.WRITE_BEHIND_ID_BLOCK
+        # Beyond this, writers flush themselves instead of waiting for the thread
+        self.max_pending = self.batch_size * 50
+        
+        self._pending = []
+        self._by_user = {}
+        self._next_id = 0
+        self._block_end = 0
+        self._segment = 0
+        self._segments = []
+        self._journal = None
+        self._journal_file = None
+        self._owner_lock = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._stats = {"flushes": 0, "flushed_messages": 0, "replayed": 0}
+    
+    def start(self):
+        """Replay any leftover journal, then start the flush thread"""
+        if self.journal_path:
+            self._replay()
+            owner = f"{self.journal_path}.{os.getpid()}"
+            self._owner_lock = _lock(f"{owner}.lock", blocking=True)
+            self._journal_file = owner
+            self._journal = open(owner, "a", encoding="utf-8")
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="insta-bot-write-behind", daemon=True)
+        self._thread.start()
+        logger.info(f"✅ Write-behind enabled (batch {self.batch_size}, {self.interval}s)")
+    
+    def next_id(self) -> int:
+        """Allocate a message id, reserving a new block when needed"""
+        with self._cond:
+            if self._next_id >= self._block_end:
+                self._next_id, self._block_end = self._reserve_ids()
+            message_id = self._next_id
+            self._next_id += 1
+            return message_id
+    
+    def _reserve_ids(self) -> tuple:
+        """Advance the messages AUTOINCREMENT counter by one block and claim the skipped ids"""
+        with self.db.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'messages'").fetchone()
+            if row is None:
+                start = (conn.execute("SELECT MAX(id) FROM messages").fetchone()[0] or 0) + 1
+                conn.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) VALUES ('messages', ?)", (start + self.id_block - 1,)
+                )
+            else:
+                start = row[0] + 1
+                conn.execute(
+                    "UPDATE sqlite_sequence SET seq = ? WHERE name = 'messages'", (start + self.id_block - 1,)
+                )
+        return start, start + self.id_block
+    
+    def append(self, message: dict):
+        """
+        Buffer a message for writing
+        
+        Args:
+            message: Dict with id, user_id, role, content, timestamp and username
+        """
+        with self._cond:
+            if self._journal is not None:
+                self._journal.write(json.dumps(message, ensure_ascii=False) + "\n")
+                self._journal.flush()
+                if self.fsync:
+                    os.fsync(self._journal.fileno())
+            self._pending.append(message)
+            self._by_user.setdefault(message["user_id"], []).append(message)
+            pending = len(self._pending)
+            if pending >= self.batch_size:
+                self._cond.notify()
+        
+        if pending >= self.max_pending:
+            self.flush()
+    
+    def pending(self, user_id: str) -> list:
+        """A user's buffered messages, oldest first"""
+        with self._cond:
+            return list(self._by_user.get(user_id, ()))
+    
+    def _run(self):
+        """Flush when a batch fills up or the interval passes"""
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: not self._running or len(self._pending) >= self.batch_size, timeout=self.interval
+                )
+                running = self._running
+            self.flush()
+            if not running:
+                return
+    
+    def flush(self):
+        """Write all buffered messages in one transaction"""
+        with self._flush_lock:
+            with self._cond:
+                if not self._pending:
+                    return
+                batch = list(self._pending)
+                self._rotate_journal()
+                # Every segment so far only holds messages in this batch (or already written)
+                segments = list(self._segments)
+            
+            try:
+                self._write(batch)
+            except Exception as e:
+                # Messages stay buffered (and journaled) and are retried on the next flush
+                metrics.ERRORS.inc(component="store")
+                logger.error(f"Error flushing {len(batch)} buffered messages: {e}")
+                return
+            
+            with self._cond:
+                del self._pending[:len(batch)]
+                for message in batch:
+                    user_messages = self._by_user.get(message["user_id"])
+                    if user_messages:
+                        user_messages.remove(message)
+                        if not user_messages:
+                            del self._by_user[message["user_id"]]
+                self._stats["flushes"] += 1
+                self._stats["flushed_messages"] += len(batch)
+            
+            for segment in segments:
+                try:
+                    os.remove(segment)
+                except FileNotFoundError:
+                    pass
+            with self._cond:
+                del self._segments[:len(segments)]
+    
+    def _write(self, batch: list):
+        """Insert a batch of messages and touch their conversations"""
+        users = {}
+        for message in batch:
+            if message.get("username") is not None or message["user_id"] not in users:
+                users[message["user_id"]] = message.get("username")
+        
+        with metrics.DB_SECONDS.time(op="flush"), self.db.connection() as conn:
+            # OR IGNORE: a replayed journal may contain messages that were already written
+            conn.executemany(
+                "INSERT OR IGNORE INTO messages (id, user_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                [(m["id"], m["user_id"], m["role"], m["content"], m["timestamp"]) for m in batch]
+            )
+            conn.executemany(
+                """
+                INSERT INTO conversations (user_id, username, messages) VALUES (?, ?, '[]')
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username = COALESCE(excluded.username, username),
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                list(users.items())
+            )
+    
+    def _rotate_journal(self):
+        """Start a new journal segment; old ones are deleted once their messages are written (lock held)"""
+        if self._journal is None:
+            return
+        self._journal.close()
+        self._segment += 1
+        segment = f"{self._journal_file}.{self._segment}"
+        os.replace(self._journal_file, segment)
+        self._segments.append(segment)
+        self._journal = open(self._journal_file, "a", encoding="utf-8")
+    
+    def _replay(self):
+        """Write messages left in the journals of processes that stopped before flushing"""
+        prefix = f"{self.journal_path}."
+        owners = {}
+        for path in glob.glob(f"{glob.escape(self.journal_path)}.*"):
+            owner = path[len(prefix):].split(".", 1)[0]
+            if owner.isdigit():
+                owners.setdefault(owner, []).append(path)
+        
+        # One process replays at a time, so an orphan is claimed once
+        replay_lock = _lock(f"{prefix}replay.lock", blocking=True)
+        try:
+            # The single shared file written before journals were per process
+            if os.path.exists(self.journal_path):
+                self._replay_file(self.journal_path)
+            for owner, paths in owners.items():
+                owner_lock_path = f"{prefix}{owner}.lock"
+                owner_lock = _lock(owner_lock_path, blocking=False)
+                if owner_lock is None:
+                    # Its process is still running
+                    continue
+                try:
+                    # Rotated segments (PATH.<pid>.<n>) oldest first, then the active file
+                    for path in sorted(paths, key=lambda path: _segment_number(path[len(prefix):])):
+                        if path != owner_lock_path:
+                            self._replay_file(path)
+                    os.remove(owner_lock_path)
+                except FileNotFoundError:
+                    pass
+                finally:
+                    owner_lock.close()
+        finally:
+            replay_lock.close()
+        if self._stats["replayed"]:
+            logger.info(f"✅ Replayed {self._stats['replayed']} journaled messages")
+    
+    def _replay_file(self, path: str):
+        messages = []
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        messages.append(json.loads(line))
+                    except ValueError:
+                        # A torn final line from a crash mid-write
+                        logger.warning(f"Skipping unreadable journal line in {path}")
+        except FileNotFoundError:
+            return
+        if messages:
+            self._write(messages)
+            self._stats["replayed"] += len(messages)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    
+    def stats(self) -> dict:
+        """Buffer counters"""
+        with self._cond:
+            return {**self._stats, "pending": len(self._pending)}
+    
+    def close(self):
+        """Flush everything and stop the flush thread"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=Config.SHUTDOWN_TIMEOUT)
+        self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+            if not self._pending and os.path.exists(self._journal_file):
+                os.remove(self._journal_file)
+        if self._owner_lock is not None:
+            if not self._pending:
+                try:
+                    os.remove(self._owner_lock.name)
+                except FileNotFoundError:
+                    pass
+            self._owner_lock.close()
+            self._owner_lock = None
+
+
+def _lock(path: str, blocking: bool):
+    """
+    Open and exclusively lock a lock file
+    
+    Returns:
+        The open file (the lock is held until it is closed), or None if
+        another process holds it and `blocking` is False
+    """
+    f = open(path, "a")
+    if fcntl is None:
+        return f
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+def _segment_number(name: str) -> float:
+    """Order of a journal file named <pid>.<n> (segment) or <pid> (active file)"""
+    parts = name.split(".")
+    if len(parts) == 2 and parts[1].isdigit():
+        return int(parts[1])
+    return float("inf")
@@ -0,0 +1,51 @@
+"""
+WSGI entry point for gunicorn
+
+    gunicorn --preload -w 4 -b 0.0.0.0:8000 insta_bot.wsgi:app
+    gunicorn -w 4 -b 0.0.0.0:8000 'insta_bot.wsgi:create_app()'
+
+With --preload the master imports Flask, requests and the Gemini SDK once
+and every forked worker shares them. The bot itself (threads, SQLite
+connections, HTTP pools) does not survive a fork, so `app` builds it in
+each worker on its first request.
+"""
+import os
+import threading
+from .bot import InstagramBot
+
+
+def preload():
+    """Import the Gemini SDK up front (the bot itself defers it to the first reply)"""
+    import google.generativeai  # noqa: F401
+
+
+def create_app(custom_instructions: str = None, gemini_model: str = None):
+    """Build a bot and return its Flask app"""
+    return InstagramBot(custom_instructions=custom_instructions, gemini_model=gemini_model).app
+
+
+class LazyApp:
+    """WSGI app that builds the bot in the serving process, on first use"""
+    
+    def __init__(self, factory=create_app):
+        self.factory = factory
+        self._app = None
+        self._pid = None
+        self._lock = threading.Lock()
+    
+    def get(self):
+        """The Flask app for this process"""
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._app = self.factory()
+                    self._pid = pid
+        return self._app
+    
+    def __call__(self, environ, start_response):
+        return self.get()(environ, start_response)
+
+
+preload()
+app = LazyApp()
@@ -19,5 +19,5 @@ if __name__ == "__main__":
     bot = InstagramBot()
     
     # Run on port 8000
-    # For production, use gunicorn: gunicorn -w 4 -b 0.0.0.0:8000 main:bot.app
+    # For production, use gunicorn: gunicorn --preload -w 4 -b 0.0.0.0:8000 insta_bot.wsgi:app
     bot.run(host="0.0.0.0", port=8000, debug=False)
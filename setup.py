@@ -28,11 +28,15 @@ setup(
     python_requires=">=3.8",
     install_requires=[
         "flask>=2.3.0",
-        "google-generativeai>=0.3.0",
+        "google-generativeai>=0.7.0",
         "python-dotenv>=1.0.0",
         "requests>=2.31.0",
         "click>=8.0.0",
     ],
+    extras_require={
+        "async": ["httpx>=0.24", "uvicorn>=0.23"],
+        "redis": ["redis>=4.0"],
+    },
     entry_points={
         "console_scripts": [
             "instachatdmbot=insta_bot.cli:cli",
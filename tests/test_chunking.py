@@ -0,0 +1,55 @@
+"""Splitting streamed replies into messages"""
+from insta_bot.chunking import ReplyChunker
+
+
+def stream(chunker, *parts):
+    messages = []
+    for part in parts:
+        messages.extend(chunker.feed(part))
+    return messages + chunker.finish()
+
+
+def test_first_sentence_is_released_at_once_and_prefix_stripped():
+    chunker = ReplyChunker(chunk_chars=20, max_chars=50, max_total=1000)
+    
+    assert chunker.feed("Reply: Hi there! How") == ["Hi there!"]
+    assert chunker.feed(" are you today? I am fine. Thanks") == ["How are you today? I am fine."]
+    assert chunker.finish() == ["Thanks"]
+
+
+def test_messages_without_a_sentence_boundary_split_at_a_space():
+    chunker = ReplyChunker(chunk_chars=5, max_chars=10, max_total=100)
+    
+    assert stream(chunker, "aaaa bbbb cccc dddd") == ["aaaa bbbb", "cccc dddd"]
+
+
+def test_reply_of_exactly_max_total_is_kept_whole():
+    chunker = ReplyChunker(chunk_chars=5, max_chars=50, max_total=20)
+    
+    assert stream(chunker, "Hello world. ", "Bye now.") == ["Hello world.", "Bye now."]
+    assert not chunker.done
+
+
+def test_message_reaching_max_total_is_cut_short():
+    chunker = ReplyChunker(chunk_chars=5, max_chars=50, max_total=20)
+    
+    messages = chunker.feed("Hello world. Bye now and later. ")
+    
+    assert messages == ["Hello world.", "Bye n..."]
+    assert sum(len(message) for message in messages) <= 20
+    assert chunker.done
+
+
+def test_no_room_left_drops_the_message():
+    chunker = ReplyChunker(chunk_chars=5, max_chars=50, max_total=13)
+    
+    assert chunker.feed("Hello world. Bye now. ") == ["Hello world."]
+    assert chunker.done
+
+
+def test_nothing_follows_truncation():
+    chunker = ReplyChunker(chunk_chars=5, max_chars=50, max_total=20)
+    chunker.feed("Hello world. Bye now and later. Still going")
+    
+    assert chunker.feed("More text. And more. ") == []
+    assert chunker.finish() == []
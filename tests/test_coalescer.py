@@ -0,0 +1,117 @@
+"""Per-sender serialization and merging of burst messages"""
+import time
+
+import pytest
+
+from insta_bot.coalescer import MessageCoalescer
+
+
+class Recorder:
+    """Dispatch callback recording each batch; refuses the first `refuse` batches"""
+    
+    def __init__(self, refuse=0):
+        self.batches = []
+        self.refuse = refuse
+    
+    def __call__(self, sender_id, messages):
+        if self.refuse:
+            self.refuse -= 1
+            return False
+        self.batches.append((sender_id, messages))
+        return True
+    
+    def wait(self, count, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while len(self.batches) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.batches
+
+
+@pytest.fixture
+def make_coalescer():
+    coalescers = []
+    
+    def make(dispatch, **kwargs):
+        coalescer = MessageCoalescer(dispatch, **kwargs)
+        coalescer.start()
+        coalescers.append(coalescer)
+        return coalescer
+    
+    yield make
+    for coalescer in coalescers:
+        coalescer.close()
+
+
+def test_without_window_messages_are_dispatched_at_once(make_coalescer):
+    recorder = Recorder()
+    coalescer = make_coalescer(recorder, window=0)
+    
+    coalescer.add("u1", "hello")
+    
+    assert recorder.batches == [("u1", ["hello"])]
+
+
+def test_burst_within_the_window_is_one_batch(make_coalescer):
+    recorder = Recorder()
+    coalescer = make_coalescer(recorder, window=0.1, max_wait=1.0)
+    
+    coalescer.add("u1", "hi")
+    coalescer.add("u1", "are you there?")
+    coalescer.add("u2", "hello")
+    
+    assert sorted(recorder.wait(2)) == [("u1", ["hi", "are you there?"]), ("u2", ["hello"])]
+    assert coalescer.stats()["merged_messages"] == 1
+
+
+def test_max_wait_bounds_the_delay_of_a_long_burst(make_coalescer):
+    recorder = Recorder()
+    coalescer = make_coalescer(recorder, window=0.2, max_wait=0.3)
+    
+    # Each message would extend the window past the end of the burst
+    for i in range(6):
+        coalescer.add("u1", f"message {i}")
+        time.sleep(0.1)
+    
+    assert recorder.batches
+    assert len(recorder.batches[0][1]) < 6
+
+
+def test_messages_during_a_reply_wait_for_it(make_coalescer):
+    recorder = Recorder()
+    coalescer = make_coalescer(recorder, window=0)
+    
+    coalescer.add("u1", "first")
+    coalescer.add("u1", "second")
+    coalescer.add("u1", "third")
+    assert recorder.batches == [("u1", ["first"])]
+    assert coalescer.stats()["in_flight"] == 1
+    
+    coalescer.done("u1")
+    assert recorder.batches[-1] == ("u1", ["second", "third"])
+    
+    coalescer.done("u1")
+    assert coalescer.stats()["senders"] == 0
+
+
+def test_refused_batch_is_retried(make_coalescer):
+    recorder = Recorder(refuse=1)
+    coalescer = make_coalescer(recorder, window=0)
+    
+    coalescer.add("u1", "hello")
+    assert recorder.batches == []
+    
+    # Retried after at least a second
+    assert recorder.wait(1, timeout=3.0) == [("u1", ["hello"])]
+
+
+def test_close_dispatches_pending_messages():
+    recorder = Recorder()
+    coalescer = MessageCoalescer(recorder, window=10, max_wait=10)
+    coalescer.start()
+    
+    coalescer.add("u1", "hello")
+    coalescer.add("u1", "again")
+    assert recorder.batches == []
+    
+    coalescer.close()
+    assert recorder.batches == [("u1", ["hello", "again"])]
@@ -0,0 +1,194 @@
+"""Behaviour shared by the conversation store backends"""
+import threading
+import time
+
+import pytest
+
+from insta_bot.conversation_store import ConversationStore
+from insta_bot.memory_store import MemoryConversationStore
+
+BACKENDS = ["memory", "sqlite", "redis"]
+
+
+@pytest.fixture
+def redis_server():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return fakeredis.FakeServer()
+
+
+def redis_client(server):
+    import fakeredis
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
+
+
+@pytest.fixture(params=BACKENDS)
+def make_store(request, tmp_path):
+    """Factory for a store of each backend; max_messages only applies to memory and Redis"""
+    stores = []
+    
+    def make(max_messages=None, ttl=0):
+        if request.param == "memory":
+            store = MemoryConversationStore(max_messages=max_messages)
+        elif request.param == "sqlite":
+            store = ConversationStore(db_path=str(tmp_path / "conversations.db"), write_behind=False)
+        else:
+            from insta_bot.redis_store import RedisConversationStore
+            server = request.getfixturevalue("redis_server")
+            store = RedisConversationStore(
+                client=redis_client(server), max_messages=max_messages or 1000, ttl=ttl, prefix="test:"
+            )
+        stores.append(store)
+        return store
+    
+    make.backend = request.param
+    yield make
+    for store in stores:
+        store.close()
+
+
+def add(store, user_id, count, prefix="message"):
+    return [
+        store.add_message(user_id, "user" if i % 2 == 0 else "assistant", f"{prefix} {i}")
+        for i in range(count)
+    ]
+
+
+def contents(history):
+    return [msg["content"] for msg in history]
+
+
+def test_history_is_oldest_first_with_increasing_ids(make_store):
+    store = make_store()
+    ids = add(store, "u1", 5)
+    
+    history = store.get_history("u1")
+    
+    assert contents(history) == [f"message {i}" for i in range(5)]
+    assert [msg["id"] for msg in history] == ids
+    assert ids == sorted(ids) and len(set(ids)) == 5
+    assert [msg["role"] for msg in history] == ["user", "assistant", "user", "assistant", "user"]
+
+
+def test_ids_increase_across_users(make_store):
+    store = make_store()
+    first = store.add_message("u1", "user", "a")
+    second = store.add_message("u2", "user", "b")
+    third = store.add_message("u1", "user", "c")
+    
+    assert first < second < third
+    assert contents(store.get_history("u1")) == ["a", "c"]
+    assert contents(store.get_history("u2")) == ["b"]
+
+
+def test_limit_keeps_the_most_recent_or_the_oldest(make_store):
+    store = make_store()
+    add(store, "u1", 6)
+    
+    assert contents(store.get_history("u1", limit=2)) == ["message 4", "message 5"]
+    assert contents(store.get_history("u1", limit=2, oldest=True)) == ["message 0", "message 1"]
+    assert store.get_history("u1", limit=0) == []
+
+
+def test_since_and_before_bound_the_ids(make_store):
+    store = make_store()
+    ids = add(store, "u1", 6)
+    
+    assert contents(store.get_history("u1", since=ids[1])) == [f"message {i}" for i in range(2, 6)]
+    assert contents(store.get_history("u1", before=ids[2])) == ["message 0", "message 1"]
+    assert contents(store.get_history("u1", since=ids[0], before=ids[4])) == ["message 1", "message 2", "message 3"]
+    assert contents(store.get_history("u1", since=ids[0], before=ids[5], limit=2)) == ["message 3", "message 4"]
+    assert contents(store.get_history("u1", since=ids[0], before=ids[5], limit=2, oldest=True)) == [
+        "message 1", "message 2"
+    ]
+
+
+def test_transform_is_applied_to_each_message(make_store):
+    store = make_store()
+    add(store, "u1", 3)
+    
+    assert store.get_history("u1", transform=lambda msg: msg["content"].upper()) == [
+        "MESSAGE 0", "MESSAGE 1", "MESSAGE 2"
+    ]
+
+
+def test_summary_round_trip_and_clear(make_store):
+    store = make_store()
+    ids = add(store, "u1", 3)
+    assert store.get_summary("u1") == ("", 0)
+    
+    store.save_summary("u1", "likes pizza", ids[1])
+    assert store.get_summary("u1") == ("likes pizza", ids[1])
+    
+    store.clear_history("u1")
+    assert store.get_history("u1") == []
+    assert store.get_summary("u1") == ("", 0)
+    # A summary finished after the conversation was cleared is dropped
+    store.save_summary("u1", "stale", ids[2])
+    assert store.get_summary("u1") == ("", 0)
+
+
+def test_old_messages_are_trimmed(make_store):
+    if make_store.backend == "sqlite":
+        pytest.skip("the SQLite store is trimmed by the retention job")
+    store = make_store(max_messages=3)
+    ids = add(store, "u1", 5)
+    
+    history = store.get_history("u1")
+    assert contents(history) == ["message 2", "message 3", "message 4"]
+    assert [msg["id"] for msg in history] == ids[2:]
+    assert contents(store.get_history("u1", since=ids[0])) == ["message 2", "message 3", "message 4"]
+
+
+def test_redis_conversations_expire_after_ttl(redis_server):
+    from insta_bot.redis_store import RedisConversationStore
+    client = redis_client(redis_server)
+    store = RedisConversationStore(client=client, ttl=1, prefix="test:")
+    store.add_message("u1", "user", "hello", username="alice")
+    
+    assert 0 < client.ttl("test:history:u1") <= 1
+    assert 0 < client.ttl("test:conversation:u1") <= 1
+    assert client.hget("test:conversation:u1", "username") == "alice"
+    
+    time.sleep(1.1)
+    assert store.get_history("u1") == []
+    assert store.get_summary("u1") == ("", 0)
+
+
+def test_redis_without_ttl_keeps_conversations(redis_server):
+    from insta_bot.redis_store import RedisConversationStore
+    client = redis_client(redis_server)
+    store = RedisConversationStore(client=client, ttl=0, prefix="test:")
+    store.add_message("u1", "user", "hello")
+    
+    assert client.ttl("test:history:u1") == -1
+
+
+def test_redis_processes_append_in_id_order(redis_server):
+    """Several processes (clients) adding to one conversation leave it in id order"""
+    from insta_bot.redis_store import RedisConversationStore
+    stores = [RedisConversationStore(client=redis_client(redis_server), prefix="test:") for _ in range(4)]
+    
+    def writer(store, n):
+        for i in range(50):
+            store.add_message("u1", "user", f"{n}-{i}")
+    
+    threads = [threading.Thread(target=writer, args=(store, n)) for n, store in enumerate(stores)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    ids = [msg["id"] for msg in stores[0].get_history("u1")]
+    assert len(ids) == 200
+    assert ids == sorted(ids)
+
+
+def test_redis_prefix_separates_bots(redis_server):
+    from insta_bot.redis_store import RedisConversationStore
+    first = RedisConversationStore(client=redis_client(redis_server), prefix="a:")
+    second = RedisConversationStore(client=redis_client(redis_server), prefix="b:")
+    first.add_message("u1", "user", "for a")
+    
+    assert contents(first.get_history("u1")) == ["for a"]
+    assert second.get_history("u1") == []
@@ -0,0 +1,107 @@
+"""Bounded worker pool for webhook events"""
+import threading
+
+import pytest
+
+from insta_bot.dispatcher import MessageDispatcher
+
+
+@pytest.fixture
+def make_dispatcher():
+    dispatchers = []
+    
+    def make(**kwargs):
+        dispatcher = MessageDispatcher(**kwargs)
+        dispatcher.start()
+        dispatchers.append(dispatcher)
+        return dispatcher
+    
+    yield make
+    for dispatcher in dispatchers:
+        dispatcher.shutdown(drain=False, timeout=1.0)
+
+
+def test_jobs_run_on_worker_threads(make_dispatcher):
+    dispatcher = make_dispatcher(workers=2, max_queue_size=10)
+    done = threading.Event()
+    threads = []
+    
+    def job(value):
+        threads.append((value, threading.current_thread().name))
+        done.set()
+    
+    assert dispatcher.submit(job, 1)
+    assert done.wait(1.0)
+    assert threads[0][0] == 1 and threads[0][1].startswith("insta-bot-worker-")
+
+
+def test_full_queue_rejects_jobs(make_dispatcher):
+    dispatcher = make_dispatcher(workers=1, max_queue_size=1)
+    started, release = threading.Event(), threading.Event()
+    
+    def blocker():
+        started.set()
+        release.wait(2.0)
+    
+    assert dispatcher.submit(blocker)
+    assert started.wait(1.0)
+    assert dispatcher.submit(lambda: None)
+    assert not dispatcher.submit(lambda: None)
+    
+    stats = dispatcher.stats()
+    assert stats["busy_workers"] == 1
+    assert stats["queue_depth"] == 1
+    assert stats["submitted"] == 2 and stats["rejected"] == 1
+    release.set()
+
+
+def test_failing_job_is_counted_and_the_worker_survives(make_dispatcher):
+    dispatcher = make_dispatcher(workers=1, max_queue_size=10)
+    done = threading.Event()
+    
+    def fail():
+        raise RuntimeError("boom")
+    
+    dispatcher.submit(fail)
+    dispatcher.submit(done.set)
+    assert done.wait(1.0)
+    
+    dispatcher.shutdown(drain=True, timeout=1.0)
+    stats = dispatcher.stats()
+    assert stats["failed"] == 1 and stats["completed"] == 1
+
+
+def test_shutdown_drains_queued_jobs():
+    dispatcher = MessageDispatcher(workers=1, max_queue_size=10)
+    dispatcher.start()
+    ran = []
+    for i in range(5):
+        dispatcher.submit(ran.append, i)
+    
+    dispatcher.shutdown(drain=True, timeout=2.0)
+    
+    assert ran == [0, 1, 2, 3, 4]
+    assert not dispatcher.submit(ran.append, 5)
+
+
+def test_shutdown_without_drain_discards_queued_jobs():
+    dispatcher = MessageDispatcher(workers=1, max_queue_size=10)
+    dispatcher.start()
+    started, release = threading.Event(), threading.Event()
+    ran = []
+    
+    def blocker():
+        started.set()
+        release.wait(2.0)
+    
+    dispatcher.submit(blocker)
+    assert started.wait(1.0)
+    for i in range(3):
+        dispatcher.submit(ran.append, i)
+    
+    # The blocked job finishes only after the queue has been emptied
+    threading.Timer(0.2, release.set).start()
+    dispatcher.shutdown(drain=False, timeout=2.0)
+    
+    assert ran == []
+    assert dispatcher.stats()["completed"] == 1
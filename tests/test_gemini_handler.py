@@ -0,0 +1,122 @@
+"""Reply generation with fake models: reply cache, profile preamble and fallbacks"""
+from types import SimpleNamespace
+
+import pytest
+
+from insta_bot import gemini_handler, resilience
+from insta_bot.chat_sessions import ChatSessionPool, turn_text
+from insta_bot.gemini_handler import GeminiHandler
+from insta_bot.memory_store import MemoryConversationStore
+from insta_bot.reply_cache import ReplyCache
+
+PROFILE = {"name": "Alice", "username": "alice"}
+
+
+class FakeModel:
+    """Answers every message with a numbered reply and records the history it was given"""
+    
+    def __init__(self):
+        self.histories = []
+    
+    def start_chat(self, history=None):
+        model = self
+        
+        class Chat:
+            def send_message(self, message, **kwargs):
+                model.histories.append([turn_text(turn) for turn in history])
+                return SimpleNamespace(text=f"reply {len(model.histories)}")
+        
+        return Chat()
+
+
+class FakeProfiles:
+    def __init__(self, profiles):
+        self.profiles = profiles
+    
+    def get(self, user_id):
+        return self.profiles.get(user_id)
+
+
+@pytest.fixture(params=[False, True], ids=["no-pool", "pool"])
+def make_handler(request):
+    handlers = []
+    
+    def make(model, profiles):
+        handler = GeminiHandler(
+            system_prompt="persona",
+            model="fake",
+            conversation_store=MemoryConversationStore(),
+            reply_cache=ReplyCache(),
+            models={("fake", "persona"): model, ("fake", None): model},
+            fallback_models=[],
+            sessions=ChatSessionPool(max_sessions=10) if request.param else None,
+            profiles=FakeProfiles(profiles),
+        )
+        handlers.append(handler)
+        return handler
+    
+    yield make
+    for handler in handlers:
+        handler.close()
+
+
+def test_first_message_is_cached_without_the_profile(make_handler):
+    model = FakeModel()
+    handler = make_handler(model, {"u1": PROFILE, "u2": PROFILE})
+    
+    assert handler.generate_reply("u1", "What are your opening hours?") == "reply 1"
+    assert not any("Alice" in text for text in model.histories[0])
+    
+    # Another new user asking the same is answered from the cache
+    assert handler.generate_reply("u2", "What are your opening hours?") == "reply 1"
+    assert len(model.histories) == 1
+    assert [msg["content"] for msg in handler.conversation_store.get_history("u2")] == [
+        "What are your opening hours?", "reply 1"
+    ]
+
+
+def test_later_messages_get_the_profile_and_are_not_cached(make_handler):
+    model = FakeModel()
+    handler = make_handler(model, {"u1": PROFILE, "u2": PROFILE})
+    handler.generate_reply("u1", "hi")
+    handler.generate_reply("u2", "hi")
+    
+    assert handler.generate_reply("u1", "What are your opening hours?") == "reply 2"
+    assert any("Alice" in text for text in model.histories[-1])
+    assert "hi" in model.histories[-1]
+    
+    # Not stored in the cache, so u2 gets its own (personalized) answer
+    assert handler.generate_reply("u2", "What are your opening hours?") == "reply 3"
+    assert any("Alice" in text for text in model.histories[-1])
+
+
+def test_model_that_fails_to_build_is_recorded_on_its_circuit(monkeypatch):
+    monkeypatch.setattr(resilience, "_upstreams", {})
+    main = resilience.get_upstream("main")
+    main.breaker = resilience.CircuitBreaker("main", failure_threshold=1, reset_timeout=0)
+    
+    backup = FakeModel()
+    broken = {"main": True}
+    
+    def build_model(model_name, system_instruction=None):
+        if model_name == "main" and broken["main"]:
+            raise RuntimeError("cannot build")
+        return backup
+    
+    monkeypatch.setattr(gemini_handler, "_build_model", build_model)
+    handler = GeminiHandler(
+        system_prompt="persona", model="main", conversation_store=MemoryConversationStore(),
+        fallback_models=["backup"], sessions=None,
+    )
+    
+    assert handler.generate_reply("u1", "hello") == "reply 1"
+    assert main.breaker.state == resilience.CircuitBreaker.OPEN
+    
+    # The half-open trial fails the same way and is released again
+    assert handler.generate_reply("u1", "hello again") == "reply 2"
+    assert main.breaker.state == resilience.CircuitBreaker.OPEN
+    
+    broken["main"] = False
+    assert handler.generate_reply("u1", "and again") == "reply 3"
+    assert main.breaker.state == resilience.CircuitBreaker.CLOSED
+    handler.close()